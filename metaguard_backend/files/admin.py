@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import FileAnalysis, MetadataField, UserMetadataPolicy
+from .models import FileAnalysis, MetadataField, UserMetadataPolicy, UserRiskStats
 
 
 @admin.register(FileAnalysis)
@@ -35,7 +35,7 @@ class FileAnalysisAdmin(admin.ModelAdmin):
             'fields': ('user', 'file_name', 'file_type', 'file_size')
         }),
         ('Security', {
-            'fields': ('risk_level', 'sha256_before', 'sha256_after')
+            'fields': ('risk_level', 'total_risk_score', 'risk_counts', 'sha256_before', 'sha256_after')
         }),
         ('Metadata', {
             'fields': ('metadata_raw', 'metadata_removed'),
@@ -53,9 +53,10 @@ class MetadataFieldAdmin(admin.ModelAdmin):
     """
     📊 Admin interface for individual metadata fields
     """
-    list_display = ['tag', 'category', 'risk_level', 'removed', 'analysis']
-    list_filter = ['category', 'risk_level', 'removed', 'analysis__user']
-    search_fields = ['tag', 'value', 'analysis__file_name']
+    list_display = ['tag', 'category', 'risk', 'risk_score', 'removed', 'analysis']
+    list_filter = ['category', 'risk', 'removed', 'analysis__user']
+    list_select_related = ['tag', 'analysis']
+    search_fields = ['tag__name', 'value', 'analysis__file_name']
     readonly_fields = ['analysis', 'tag', 'value']
 
 
@@ -88,8 +89,29 @@ class UserMetadataPolicyAdmin(admin.ModelAdmin):
                 'remove_personal',
             )
         }),
+        ('Retention', {
+            'fields': ('retention_days', 'retention_max_files')
+        }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
             'classes': ('collapse',)
         }),
     )
+
+
+@admin.register(UserRiskStats)
+class UserRiskStatsAdmin(admin.ModelAdmin):
+    """
+    📊 Per-user dashboard counters (maintained by analyze/clean)
+    """
+    list_display = [
+        'user',
+        'files_scanned',
+        'files_cleaned',
+        'high_risk_files',
+        'medium_risk_files',
+        'low_risk_files',
+        'updated_at',
+    ]
+    search_fields = ['user__email']
+    readonly_fields = [f.name for f in UserRiskStats._meta.fields]
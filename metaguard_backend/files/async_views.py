@@ -0,0 +1,206 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .delivery import acleaned_artifact, cleaned_file_response, wants_download_link
+from .metrics import stage
+from .models import FileAnalysis, UserMetadataPolicy
+from .permissions import GuestLimitExceeded, enforce_guest_limits
+from .policies import compiled_policy_for_user
+from .records import analysis_payload, mark_file_cleaned, save_file_analysis
+from .services import aanalyze_metadata_cached
+from .uploads import UploadTooLarge, upload_sha256
+
+
+# ================================
+# ASYNC VIEW PLUMBING
+# ================================
+async def authenticate(request):
+    """JWT auth like the DRF views, with the user lookup off the event loop"""
+    try:
+        result = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+def async_api_view(guest: bool):
+    """
+    🔌 Native async POST endpoint for the ASGI entry point
+    ✅ guest=True: anonymous only (like the DRF guest views)
+    ✅ guest=False: JWT required
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method != "POST":
+                return JsonResponse({"detail": f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+            user = await authenticate(request)
+            if guest and user is not None:
+                return JsonResponse(
+                    {"error": "This endpoint is for guest users only"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            if not guest and user is None:
+                return JsonResponse(
+                    {"detail": "Authentication credentials were not provided."},
+                    status=status.HTTP_401_UNAUTHORIZED,
+                )
+
+            request.api_user = user
+            # Multipart parsing touches the disk for large bodies
+            with stage("upload"):
+                try:
+                    await sync_to_async(lambda: request.FILES, thread_sensitive=False)()
+                except UploadTooLarge as e:
+                    return JsonResponse({"error": str(e.detail)}, status=e.status_code)
+            return await view(request, *args, **kwargs)
+
+        # Header (JWT) auth only, same as the DRF views
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+def no_file_response():
+    return JsonResponse(
+        {"error": "No file uploaded"},
+        status=status.HTTP_400_BAD_REQUEST,
+    )
+
+
+# ================================
+# GUEST ANALYZE METADATA (ASYNC)
+# ================================
+@async_api_view(guest=True)
+async def guest_analyze_metadata_async(request):
+    uploaded_file = request.FILES.get("file")
+    if not uploaded_file:
+        return no_file_response()
+
+    try:
+        await sync_to_async(enforce_guest_limits)(request, uploaded_file)
+    except GuestLimitExceeded as e:
+        return JsonResponse({"error": str(e)}, status=e.status_code, headers=e.headers())
+
+    with stage("hash"):
+        file_hash = await sync_to_async(upload_sha256, thread_sensitive=False)(uploaded_file)
+    result = await aanalyze_metadata_cached(uploaded_file, file_hash)
+    metadata, privacy_count, overall_risk, total_score, risk_counts, remaining_count = result
+
+    return JsonResponse(
+        {
+            "metadata": metadata,
+            "before": {
+                "total": len(metadata),
+                "privacy": privacy_count,
+            },
+            "after": {
+                "remaining": remaining_count,
+                "removed": len(metadata) - remaining_count,
+            },
+            "hash_changed": True,
+            "overall_risk": overall_risk,
+            "total_risk_score": total_score,
+            "risk_counts": risk_counts,
+            "partial_read": result.scan is not None,
+            "scan": result.scan,
+        },
+        status=status.HTTP_200_OK,
+    )
+
+
+# ================================
+# GUEST CLEAN METADATA (ASYNC)
+# ================================
+@async_api_view(guest=True)
+async def guest_clean_metadata_async(request):
+    uploaded_file = request.FILES.get("file")
+    if not uploaded_file:
+        return no_file_response()
+
+    try:
+        await sync_to_async(enforce_guest_limits)(request, uploaded_file)
+    except GuestLimitExceeded as e:
+        return JsonResponse({"error": str(e)}, status=e.status_code, headers=e.headers())
+
+    cleaned = await acleaned_artifact(uploaded_file, keep=wants_download_link(request))
+    return cleaned_file_response(request, cleaned, f"cleaned_{uploaded_file.name}")
+
+
+# ================================
+# ANALYZE FILE (AUTHENTICATED, ASYNC)
+# ================================
+@async_api_view(guest=False)
+async def analyze_metadata_authenticated_async(request):
+    user = request.api_user
+    uploaded_file = request.FILES.get("file")
+    if not uploaded_file:
+        return no_file_response()
+
+    try:
+        with stage("hash"):
+            sha256_before = await sync_to_async(upload_sha256, thread_sensitive=False)(uploaded_file)
+        policy, _ = await UserMetadataPolicy.objects.aget_or_create(user=user)
+        compiled = compiled_policy_for_user(user, policy)
+
+        result = await aanalyze_metadata_cached(uploaded_file, sha256_before, list(compiled.remove))
+        metadata, privacy_count, overall_risk, total_score, risk_counts, remaining_count = result
+
+        # One transaction with batched inserts, run on the ORM's thread
+        file_analysis = await sync_to_async(save_file_analysis)(
+            user, uploaded_file, sha256_before, metadata, overall_risk, total_score, risk_counts
+        )
+
+        return JsonResponse(
+            analysis_payload(file_analysis, metadata, privacy_count, overall_risk, total_score, risk_counts, remaining_count, result.scan),
+            status=status.HTTP_200_OK,
+        )
+
+    except Exception as e:
+        return JsonResponse(
+            {"error": f"Error analyzing metadata: {str(e)}"},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        )
+
+
+# ================================
+# CLEAN FILE (AUTHENTICATED, ASYNC)
+# ================================
+@async_api_view(guest=False)
+async def clean_metadata_authenticated_async(request):
+    user = request.api_user
+    file_id = request.POST.get("file_id")
+
+    if not file_id:
+        return JsonResponse(
+            {"error": "file_id is required"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    try:
+        # 🔒 Get file - will return 404 if user doesn't own it
+        file_analysis = await FileAnalysis.objects.select_related("user__metadata_policy").aget(id=file_id, user=user)
+    except (FileAnalysis.DoesNotExist, ValueError):
+        return JsonResponse(
+            {"error": "File not found or you don't have permission to access it"},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+
+    uploaded_file = request.FILES.get("file")
+    if not uploaded_file:
+        return no_file_response()
+
+    policy = compiled_policy_for_user(file_analysis.user)
+    original_hash = await sync_to_async(upload_sha256, thread_sensitive=False)(uploaded_file)
+    cleaned = await acleaned_artifact(uploaded_file, original_hash, policy, keep=wants_download_link(request))
+    await sync_to_async(mark_file_cleaned)(file_analysis, cleaned.sha256_after, policy.categories)
+
+    response = cleaned_file_response(request, cleaned, f"cleaned_{uploaded_file.name}", user)
+    response["X-SHA256-After"] = cleaned.sha256_after
+    return response
@@ -0,0 +1,204 @@
+import json
+import os
+import tempfile
+import zipfile
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterator, List, NamedTuple, Union
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .records import save_file_analyses_bulk
+from .services import analyze_metadata_cached
+from .uploads import upload_sha256
+
+
+BATCH_WORKERS = getattr(settings, "BATCH_ANALYZE_WORKERS", os.cpu_count() or 2)
+BATCH_MAX_FILES = getattr(settings, "BATCH_ANALYZE_MAX_FILES", 500)
+ZIP_MAX_UNCOMPRESSED_BYTES = getattr(settings, "BATCH_ZIP_MAX_UNCOMPRESSED_BYTES", 2 * 1024 * 1024 * 1024)
+
+# Finished files are stored in groups of at most this many before they are reported
+BATCH_SAVE_CHUNK = getattr(settings, "BATCH_ANALYZE_SAVE_CHUNK", 25)
+
+# Raised by zipfile / zlib for one unreadable member (bad CRC, broken
+# deflate stream, unsupported compression, truncated entry)
+ZIP_MEMBER_ERRORS = (zipfile.BadZipFile, zlib.error, NotImplementedError, EOFError, RuntimeError)
+
+
+class BatchError(ValueError):
+    pass
+
+
+class RejectedUpload(NamedTuple):
+    """A ZIP member that couldn't be read; the batch reports it as that item's error"""
+    name: str
+    error: str
+
+
+# ================================
+# COLLECT UPLOADS (FILES OR ONE ZIP)
+# ================================
+def is_zip_upload(uploaded_file) -> bool:
+    if uploaded_file.name.lower().endswith(".zip") or uploaded_file.content_type in (
+        "application/zip", "application/x-zip-compressed"
+    ):
+        uploaded_file.seek(0)
+        found = zipfile.is_zipfile(uploaded_file)
+        uploaded_file.seek(0)
+        return found
+    return False
+
+
+def extract_zip_uploads(archive) -> List[Union[UploadedFile, RejectedUpload]]:
+    """
+    Every regular file in the archive as an upload, spooled to a temp file
+    (kept in memory while small). Refuses archives that expand too far;
+    an encrypted or corrupt member becomes a RejectedUpload, not an error.
+    """
+    uploads = []
+    with zipfile.ZipFile(archive) as zf:
+        members = [m for m in zf.infolist() if not m.is_dir()]
+        if len(members) > BATCH_MAX_FILES:
+            raise BatchError(f"ZIP contains more than {BATCH_MAX_FILES} files")
+        if sum(m.file_size for m in members) > ZIP_MAX_UNCOMPRESSED_BYTES:
+            raise BatchError("ZIP expands beyond the allowed size")
+
+        for member in members:
+            name = os.path.basename(member.filename)
+            if member.flag_bits & 0x1:
+                uploads.append(RejectedUpload(name, "Encrypted ZIP entries are not supported"))
+                continue
+
+            spool = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+            try:
+                with zf.open(member) as source:
+                    for block in iter(lambda: source.read(64 * 1024), b""):
+                        spool.write(block)
+            except ZIP_MEMBER_ERRORS as e:
+                spool.close()
+                uploads.append(RejectedUpload(name, f"Unreadable ZIP entry: {e}"))
+                continue
+            size = spool.tell()
+            spool.seek(0)
+            uploads.append(UploadedFile(
+                file=spool,
+                name=name,
+                content_type="application/octet-stream",
+                size=size,
+            ))
+    return uploads
+
+
+def collect_batch_uploads(files) -> List[UploadedFile]:
+    uploads = files.getlist("files") or files.getlist("file")
+    if len(uploads) == 1 and is_zip_upload(uploads[0]):
+        return extract_zip_uploads(uploads[0])
+    if len(uploads) > BATCH_MAX_FILES:
+        raise BatchError(f"At most {BATCH_MAX_FILES} files per batch")
+    return uploads
+
+
+# ================================
+# PARALLEL ANALYSIS, NDJSON OUT
+# ================================
+def _analyze_one(uploaded_file):
+    sha256_before = upload_sha256(uploaded_file)
+    return sha256_before, analyze_metadata_cached(uploaded_file, sha256_before)
+
+
+def _line(data) -> bytes:
+    return (json.dumps(data, cls=DjangoJSONEncoder) + "\n").encode()
+
+
+def _error_line(index, file_name, error) -> bytes:
+    return _line({
+        "index": index,
+        "file_name": file_name,
+        "status": "error",
+        "error": error,
+    })
+
+
+def _ok_line(index, uploaded_file, sha256_before, result, analysis) -> bytes:
+    metadata, privacy_count, overall_risk, total_score, risk_counts, remaining_count = result
+    return _line({
+        "index": index,
+        "id": analysis.id,
+        "file_name": uploaded_file.name,
+        "status": "ok",
+        "metadata": metadata,
+        "before": {
+            "total": len(metadata),
+            "privacy": privacy_count,
+        },
+        "after": {
+            "remaining": remaining_count,
+            "removed": len(metadata) - remaining_count,
+        },
+        "overall_risk": overall_risk,
+        "total_risk_score": total_score,
+        "risk_counts": risk_counts,
+        "partial_read": result.scan is not None,
+        "scan": result.scan,
+        "sha256_before": sha256_before,
+    })
+
+def stream_batch_analysis(user, uploads: List[Union[UploadedFile, RejectedUpload]]) -> Iterator[bytes]:
+    """
+    Analyze uploads in parallel and yield one NDJSON line per file as soon
+    as it finishes. A failing file only produces an error line. Files are
+    stored in small chunks before they are reported, so everything a client
+    has seen survives a dropped connection; a summary line maps each index
+    to its FileAnalysis id.
+    """
+    stored = []
+    failed = 0
+
+    workers = max(1, min(BATCH_WORKERS, len(uploads)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for index, upload in enumerate(uploads):
+            if isinstance(upload, RejectedUpload):
+                failed += 1
+                yield _error_line(index, upload.name, upload.error)
+            else:
+                futures[pool.submit(_analyze_one, upload)] = index
+
+        remaining = set(futures)
+        try:
+            while remaining:
+                done, remaining = wait(remaining, return_when=FIRST_COMPLETED)
+
+                completed = []
+                for future in sorted(done, key=futures.get):
+                    index = futures[future]
+                    try:
+                        completed.append((index, *future.result()))
+                    except Exception as e:
+                        failed += 1
+                        yield _error_line(index, uploads[index].name, str(e))
+
+                for start in range(0, len(completed), BATCH_SAVE_CHUNK):
+                    chunk = completed[start:start + BATCH_SAVE_CHUNK]
+                    analyses = save_file_analyses_bulk(user, [
+                        (uploads[index], sha256_before, result[0], result[2], result[3], result[4])
+                        for index, sha256_before, result in chunk
+                    ])
+                    for (index, sha256_before, result), analysis in zip(chunk, analyses):
+                        stored.append({"index": index, "id": analysis.id})
+                        yield _ok_line(index, uploads[index], sha256_before, result, analysis)
+        finally:
+            # The client went away: don't analyze files nobody will see
+            for future in remaining:
+                future.cancel()
+
+    yield _line({
+        "summary": True,
+        "total": len(uploads),
+        "succeeded": len(stored),
+        "failed": failed,
+        "analyses": stored,
+    })
+
@@ -0,0 +1,384 @@
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import struct
+import time
+import tracemalloc
+from contextlib import contextmanager
+from hashlib import sha256
+from itertools import cycle
+from typing import Callable, Dict, List, NamedTuple, Optional
+from unittest import mock
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from . import services
+from .exiftool import ExifToolResult
+
+
+# Results the command compares against, written by --save-baseline on the
+# same machine (absolute latencies mean nothing on another host)
+BENCHMARK_BASELINE_PATH = str(getattr(settings, "BENCHMARK_BASELINE_PATH", settings.BASE_DIR / "benchmark_baseline.json"))
+
+# A benchmark regresses when it is this much slower (or allocates this much more)
+BENCHMARK_TOLERANCE = 0.25
+
+BENCHMARK_SEED = 1234
+
+
+# ================================
+# SYNTHETIC CORPUS
+# ================================
+class CorpusFile(NamedTuple):
+    name: str
+    content_type: str
+    data: bytes
+    # What ExifTool would print for this file (-j -a -u -g1), as JSON text
+    exiftool_json: str
+
+    def upload(self) -> SimpleUploadedFile:
+        return SimpleUploadedFile(self.name, self.data, content_type=self.content_type)
+
+
+def _segment(marker: int, payload: bytes) -> bytes:
+    return bytes([0xFF, marker]) + struct.pack(">H", len(payload) + 2) + payload
+
+
+def _jpeg(*segments: bytes) -> bytes:
+    sof = _segment(0xC0, bytes([8]) + struct.pack(">HH", 3024, 4032) + b"\x03\x01\x22\x00\x02\x11\x01\x03\x11\x01")
+    sos = _segment(0xDA, b"\x03\x01\x00\x02\x11\x03\x11\x00\x3f\x00")
+    return b"\xff\xd8" + b"".join(segments) + sof + sos + bytes(range(256)) * 16 + b"\xff\xd9"
+
+
+def _exif(ifd0: Dict[int, str], gps: Dict[int, tuple]) -> bytes:
+    """Big-endian TIFF block: ASCII tags in IFD0, (ref, rationals) in the GPS IFD"""
+    ifd0_size = 2 + 12 * (len(ifd0) + 1) + 4
+    gps_offset = 8 + ifd0_size
+    gps_size = 2 + 12 * len(gps) + 4
+    data_offset = gps_offset + gps_size
+    data = bytearray()
+
+    def entry(tag, type_id, count, raw):
+        if len(raw) <= 4:
+            return struct.pack(">HHI", tag, type_id, count) + raw.ljust(4, b"\x00")
+        offset = data_offset + len(data)
+        data.extend(raw + b"\x00" * (len(raw) % 2))
+        return struct.pack(">HHII", tag, type_id, count, offset)
+
+    entries = [entry(tag, 2, len(value) + 1, value.encode() + b"\x00") for tag, value in sorted(ifd0.items())]
+    entries.append(struct.pack(">HHII", 0x8825, 4, 1, gps_offset))
+    gps_entries = []
+    for tag, value in sorted(gps.items()):
+        if isinstance(value, str):
+            gps_entries.append(entry(tag, 2, 2, value.encode() + b"\x00"))
+        else:
+            raw = b"".join(struct.pack(">II", n, d) for n, d in value)
+            gps_entries.append(entry(tag, 5, len(value), raw))
+
+    return (
+        b"MM\x00*" + struct.pack(">I", 8)
+        + struct.pack(">H", len(entries)) + b"".join(entries) + struct.pack(">I", 0)
+        + struct.pack(">H", len(gps_entries)) + b"".join(gps_entries) + struct.pack(">I", 0)
+        + bytes(data)
+    )
+
+
+def _groups_json(groups: Dict[str, Dict]) -> str:
+    return json.dumps([{"SourceFile": "-", **groups}])
+
+
+def small_jpeg() -> CorpusFile:
+    """A phone snapshot: a dozen EXIF tags and a GPS fix"""
+    ifd0 = {0x010F: "Apple", 0x0110: "iPhone 13", 0x0131: "17.1", 0x0132: "2024:05:01 10:00:00", 0x013B: "Jane Doe"}
+    gps = {0x01: "N", 0x02: ((51, 1), (30, 1), (2600, 100)), 0x03: "W", 0x04: ((0, 1), (7, 1), (4000, 100))}
+    data = _jpeg(_segment(0xE1, b"Exif\x00\x00" + _exif(ifd0, gps)))
+    return CorpusFile("small.jpg", "image/jpeg", data, _groups_json({
+        "IFD0": {"Make": "Apple", "Model": "iPhone 13", "Software": "17.1",
+                 "ModifyDate": "2024:05:01 10:00:00", "Artist": "Jane Doe"},
+        "GPS": {"GPSLatitudeRef": "North", "GPSLatitude": "51 deg 30' 26.00\"",
+                "GPSLongitudeRef": "West", "GPSLongitude": "0 deg 7' 40.00\""},
+    }))
+
+
+def tag_heavy_heic(rng: random.Random) -> CorpusFile:
+    """An iPhone HEIC as ExifTool sees it: ~1,500 tags across many -g1 groups"""
+    data = (
+        struct.pack(">I", 24) + b"ftypheic" + b"\x00\x00\x00\x00" + b"mif1heic"
+        + struct.pack(">I", 4096) + b"meta" + bytes(4088)
+        + struct.pack(">I", 65544) + b"mdat" + rng.randbytes(65536)
+    )
+    groups = {
+        "File": {"FileType": "HEIC", "MIMEType": "image/heic", "ImageWidth": 4032, "ImageHeight": 3024},
+        "IFD0": {"Make": "Apple", "Model": "iPhone 15 Pro", "Software": "17.4.1", "HostComputer": "iPhone 15 Pro"},
+        "GPS": {"GPSLatitude": "51 deg 30' 26.00\" N", "GPSLongitude": "0 deg 7' 40.00\" W",
+                "GPSAltitude": "35 m Above Sea Level", "GPSSpeed": 0, "GPSImgDirection": 183.2},
+        "XMP-photoshop": {"DateCreated": "2024:05:01 10:00:00.123+01:00"},
+        "ICC-header": {f"ProfileField{i}": rng.randint(0, 1 << 16) for i in range(40)},
+        "QuickTime": {f"ItemInfo{i}": f"hvc1 item {i}" for i in range(120)},
+    }
+    # MakerNotes and per-tile item properties are where the bulk comes from
+    for n in range(24):
+        groups[f"Apple{n}"] = {f"MakerNote{n}Tag{i}": rng.choice([
+            rng.randint(0, 9999), f"{rng.random():.6f}", "Jane Doe", "Unknown (0x%04x)" % i,
+        ]) for i in range(50)}
+    for n in range(10):
+        groups[f"HEIC-Tile{n}"] = {f"ImageSpatialExtent{i}": f"{rng.randint(1, 512)}x{rng.randint(1, 512)}" for i in range(25)}
+    return CorpusFile("tagged.heic", "image/heic", data, _groups_json(groups))
+
+
+def huge_xmp_jpeg(rng: random.Random) -> CorpusFile:
+    """A JPEG whose XMP packet carries a few very long values (fills one APP1 segment)"""
+    words = ["archive", "holiday", "scan", "family", "london", "draft", "final", "export"]
+    long_text = lambda n: " ".join(rng.choice(words) for _ in range(n))
+    description = long_text(3000)
+    comment = long_text(2500) + " contact jane.doe@example.com"
+    packet = (
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/">'
+        '<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+        '<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/"'
+        ' xmlns:xmp="http://ns.adobe.com/xap/1.0/" xmlns:photoshop="http://ns.adobe.com/photoshop/1.0/"'
+        f' xmp:CreatorTool="Lightroom" photoshop:City="London" photoshop:Instructions="{comment}">'
+        f'<dc:description><rdf:Alt><rdf:li xml:lang="x-default">{description}</rdf:li></rdf:Alt></dc:description>'
+        '<dc:creator><rdf:Seq><rdf:li>Jane Doe</rdf:li></rdf:Seq></dc:creator>'
+        '</rdf:Description></rdf:RDF></x:xmpmeta>'
+    ).encode()
+    data = _jpeg(_segment(0xE1, b"http://ns.adobe.com/xap/1.0/\x00" + packet))
+    return CorpusFile("huge_xmp.jpg", "image/jpeg", data, _groups_json({
+        "XMP-xmp": {"CreatorTool": "Lightroom"},
+        "XMP-photoshop": {"City": "London", "Instructions": comment},
+        "XMP-dc": {"Description": description, "Creator": "Jane Doe"},
+    }))
+
+
+def build_corpus(seed: int = BENCHMARK_SEED) -> Dict[str, CorpusFile]:
+    """The same bytes on every run for a given seed"""
+    rng = random.Random(seed)
+    files = [small_jpeg(), tag_heavy_heic(rng), huge_xmp_jpeg(rng)]
+    return {f.name: f for f in files}
+
+
+# ================================
+# FAKE EXIFTOOL (IN-PROCESS)
+# ================================
+class FakeExifTool:
+    """
+    Stands in for run_exiftool/run_exiftool_pipe/run_exiftool_stream: metadata reads answer with
+    the corpus file's canned JSON, cleans hand the input back unchanged.
+    Measures our side of the pipeline only, not ExifTool or process startup.
+    """
+
+    def __init__(self, corpus: Dict[str, CorpusFile]):
+        self.outputs = {sha256(f.data).digest(): f.exiftool_json.encode() for f in corpus.values()}
+        self.calls = 0
+
+    def respond(self, args: List[str], data: bytes) -> ExifToolResult:
+        self.calls += 1
+        if "-o" in args:
+            target = args[args.index("-o") + 1]
+            if target == "-":
+                return ExifToolResult(0, data, b"")
+            with open(target, "wb") as f:
+                f.write(data)
+            return ExifToolResult(0, b"1 image files created\n", b"")
+        return ExifToolResult(0, self.outputs.get(sha256(data).digest(), b"[{}]"), b"")
+
+    def run_pipe(self, args, chunks):
+        return self.respond(args, b"".join(chunks))
+
+    def run(self, args):
+        with open(args[-1], "rb") as f:
+            return self.respond(args, f.read())
+
+    @contextmanager
+    def installed(self):
+        with mock.patch.multiple(services, run_exiftool=self.run, run_exiftool_pipe=self.run_pipe,
+                                 run_exiftool_stream=self.run_pipe):
+            yield self
+
+
+# ================================
+# MEASUREMENT
+# ================================
+class Benchmark(NamedTuple):
+    name: str
+    # setup() runs untimed before every call and returns the call's arguments
+    setup: Callable[[], tuple]
+    func: Callable
+
+
+class BenchmarkStats(NamedTuple):
+    name: str
+    calls: int
+    ops_per_sec: float
+    p50_us: float
+    p95_us: float
+    p99_us: float
+    alloc_peak_kb: float
+    alloc_retained_b: float
+
+    def to_dict(self) -> Dict:
+        return {k: round(v, 3) if isinstance(v, float) else v for k, v in self._asdict().items()}
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def measure(bench: Benchmark, calls: int, warmup: int = 5, alloc_calls: Optional[int] = None) -> BenchmarkStats:
+    """
+    Time each call on its own (latency percentiles, ops/sec over the timed
+    total), then repeat a few calls under tracemalloc for allocations.
+    Timing and allocation tracking are separate passes: tracemalloc
+    slows every allocation down.
+    """
+    for _ in range(warmup):
+        bench.func(*bench.setup())
+
+    timings = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(calls):
+            args = bench.setup()
+            start = time.perf_counter_ns()
+            bench.func(*args)
+            timings.append(time.perf_counter_ns() - start)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    alloc_calls = alloc_calls or max(1, min(calls, 50))
+    peaks, retained = [], []
+    tracemalloc.start()
+    try:
+        for _ in range(alloc_calls):
+            args = bench.setup()
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            result = bench.func(*args)
+            after, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            retained.append(after - before)
+            del result
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    total = sum(timings)
+    return BenchmarkStats(
+        name=bench.name,
+        calls=calls,
+        ops_per_sec=calls / (total / 1e9) if total else float("inf"),
+        p50_us=_percentile(timings, 50) / 1000,
+        p95_us=_percentile(timings, 95) / 1000,
+        p99_us=_percentile(timings, 99) / 1000,
+        alloc_peak_kb=statistics.mean(peaks) / 1024,
+        alloc_retained_b=statistics.mean(retained),
+    )
+
+
+# ================================
+# THE SUITE
+# ================================
+def _drain(cleaned):
+    try:
+        with cleaned.open() as f:
+            return f.read()
+    finally:
+        cleaned.cleanup()
+
+
+def build_benchmarks(corpus: Dict[str, CorpusFile]) -> List[Benchmark]:
+    remove_tags = services.GUEST_METADATA_POLICY["remove"]
+    raws = {name: json.loads(f.exiftool_json)[0] for name, f in corpus.items()}
+
+    # calculate_field_risk: one call per (tag, value), cycling through every file's fields
+    pairs = cycle([(k, v) for raw in raws.values() for k, v in raw.items()])
+    benches = [Benchmark("calculate_field_risk", lambda: next(pairs), services.calculate_field_risk)]
+
+    for name, f in corpus.items():
+        scored = services.score_metadata(raws[name], remove_tags)[0]
+        benches += [
+            Benchmark(f"calculate_overall_risk[{name}]", lambda scored=scored: (scored,), services.calculate_overall_risk),
+            Benchmark(f"analyze_metadata_guest[{name}]", lambda f=f: (f.upload(), remove_tags), services.analyze_metadata_guest),
+            Benchmark(
+                f"clean_metadata_guest[{name}]",
+                lambda f=f: (f.upload(),),
+                lambda upload: _drain(services.clean_metadata_guest(upload)),
+            ),
+        ]
+    return benches
+
+
+def run_benchmarks(calls: int = 200, only: Optional[str] = None, seed: int = BENCHMARK_SEED) -> List[BenchmarkStats]:
+    corpus = build_corpus(seed)
+    results = []
+    with FakeExifTool(corpus).installed():
+        for bench in build_benchmarks(corpus):
+            if only and only not in bench.name:
+                continue
+            # Single field scoring is ~microseconds: give it many more calls
+            n = calls * 50 if bench.name == "calculate_field_risk" else calls
+            results.append(measure(bench, n))
+    return results
+
+
+# ================================
+# BASELINE
+# ================================
+class BaselineMismatch(Exception):
+    """The baseline was recorded on another machine or interpreter"""
+
+
+def benchmark_host() -> str:
+    return f"{platform.node()} {platform.machine()} {platform.python_implementation()} {platform.python_version()}"
+
+
+def load_baseline(path: str = BENCHMARK_BASELINE_PATH) -> Dict[str, Dict]:
+    """
+    Stored results by benchmark name, {} when there are none. Raises
+    BaselineMismatch when they come from another host.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        stored = json.load(f)
+    host = stored.get("host")
+    if host != benchmark_host():
+        raise BaselineMismatch(f"Baseline was recorded on {host or 'an unknown host'}, this is {benchmark_host()}")
+    return stored["benchmarks"]
+
+
+def save_baseline(results: List[BenchmarkStats], path: str = BENCHMARK_BASELINE_PATH):
+    with open(path, "w") as f:
+        json.dump({
+            "host": benchmark_host(),
+            "benchmarks": {r.name: r.to_dict() for r in results},
+        }, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare_to_baseline(results: List[BenchmarkStats], baseline: Dict[str, Dict], tolerance: float = BENCHMARK_TOLERANCE) -> List[Dict]:
+    """
+    One row per benchmark: speed and allocation change against the baseline.
+    speed < 1 is slower (by median latency). New benchmarks have no baseline and never regress.
+    """
+    rows = []
+    for r in results:
+        base = baseline.get(r.name)
+        row = {"name": r.name, "speed": None, "alloc": None, "regressed": False}
+        if base:
+            # Median latency, not ops/sec: one slow outlier call shouldn't fail a run
+            row["speed"] = base["p50_us"] / r.p50_us if r.p50_us else None
+            row["alloc"] = r.alloc_peak_kb / base["alloc_peak_kb"] if base["alloc_peak_kb"] else None
+            row["regressed"] = (
+                (row["speed"] is not None and row["speed"] < 1 - tolerance)
+                or (row["alloc"] is not None and row["alloc"] > 1 + tolerance)
+            )
+        rows.append(row)
+    return rows
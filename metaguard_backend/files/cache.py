@@ -0,0 +1,190 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+DEFAULT_ANALYSIS_CACHE = {
+    "BACKEND": "files.cache.LocMemResultCache",
+    "OPTIONS": {
+        "max_entries": 1024,
+        "ttl": 24 * 60 * 60,
+    },
+}
+
+
+# ================================
+# BASE BACKEND
+# ================================
+class BaseResultCache:
+    """
+    📦 Analysis results keyed by content hash + policy version
+    ✅ Size and TTL based eviction
+    ✅ Hit/miss counters for this process
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 24 * 60 * 60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Dict]:
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: Dict):
+        self._set(key, value)
+
+    def stats(self) -> Dict:
+        return {
+            "backend": type(self).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _get(self, key: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def _set(self, key: str, value: Dict):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+# ================================
+# IN-PROCESS LRU
+# ================================
+class LocMemResultCache(BaseResultCache):
+    """
+    Values are kept as JSON, like the SQLite store, so every get() returns
+    a fresh copy a caller can change without touching the cache.
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if now - stored_at > self.ttl:
+                del self._data[key]
+                self.evictions += 1
+                return None
+            self._data.move_to_end(key)
+        return json.loads(value)
+
+    def _set(self, key, value):
+        payload = json.dumps(value)
+        with self._lock:
+            self._data[key] = (time.time(), payload)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# ================================
+# SHARED SQLITE STORE
+# ================================
+class SQLiteResultCache(BaseResultCache):
+    """
+    💾 Local SQLite file that every worker process on the host can share
+    """
+
+    def __init__(self, path=None, **options):
+        super().__init__(**options)
+        self.path = str(path or settings.BASE_DIR / "analysis_cache.sqlite3")
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS analysis_cache ("
+                " key TEXT PRIMARY KEY,"
+                " payload TEXT NOT NULL,"
+                " stored_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS analysis_cache_accessed ON analysis_cache (accessed_at)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _get(self, key):
+        conn = self._connection()
+        now = time.time()
+        row = conn.execute(
+            "SELECT payload, stored_at FROM analysis_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        payload, stored_at = row
+        if now - stored_at > self.ttl:
+            conn.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+            self.evictions += 1
+            return None
+        conn.execute("UPDATE analysis_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(payload)
+
+    def _set(self, key, value):
+        conn = self._connection()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO analysis_cache (key, payload, stored_at, accessed_at)"
+            " VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), now, now),
+        )
+        expired = conn.execute(
+            "DELETE FROM analysis_cache WHERE stored_at < ?", (now - self.ttl,)
+        ).rowcount
+        overflow = conn.execute(
+            "DELETE FROM analysis_cache WHERE key IN ("
+            " SELECT key FROM analysis_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        ).rowcount
+        self.evictions += expired + overflow
+
+    def clear(self):
+        self._connection().execute("DELETE FROM analysis_cache")
+
+
+_cache: Optional[BaseResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_analysis_cache() -> BaseResultCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = getattr(settings, "ANALYSIS_CACHE", DEFAULT_ANALYSIS_CACHE)
+                backend = import_string(config["BACKEND"])
+                _cache = backend(**config.get("OPTIONS", {}))
+    return _cache
@@ -0,0 +1,421 @@
+import io
+import json
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from typing import NamedTuple, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.http import FileResponse, HttpResponse
+from django.urls import reverse
+from django.utils.http import content_disposition_header
+
+from .metrics import record_artifact
+from .policies import GUEST_COMPILED_POLICY
+from .services import CleanedFile, aclean_metadata_guest, clean_metadata_guest
+from .uploads import upload_sha256
+
+
+CLEANED_ARTIFACT_DIR = str(getattr(settings, "CLEANED_ARTIFACT_DIR", settings.BASE_DIR / "cleaned_artifacts"))
+
+# Seconds a cleaned file stays after its last use (clean, reuse or download)
+CLEANED_ARTIFACT_TTL = getattr(settings, "CLEANED_ARTIFACT_TTL", 15 * 60)
+
+# Smaller cleans are streamed straight from the clean and never stored,
+# unless the client asks for a download link (?link=1)
+CLEANED_ARTIFACT_MIN_BYTES = getattr(settings, "CLEANED_ARTIFACT_MIN_BYTES", 16 * 1024 * 1024)
+
+# None: Django streams the file (os.sendfile via the WSGI server's file_wrapper).
+# "x-accel-redirect" (nginx) or "x-sendfile" (Apache, lighttpd): the proxy sends it.
+CLEANED_FILE_OFFLOAD = getattr(settings, "CLEANED_FILE_OFFLOAD", None)
+
+# Internal nginx location aliased to CLEANED_ARTIFACT_DIR
+CLEANED_FILE_ACCEL_PREFIX = getattr(settings, "CLEANED_FILE_ACCEL_PREFIX", "/protected/cleaned/")
+
+ARTIFACT_PURGE_INTERVAL = 60
+DOWNLOAD_TOKEN_SALT = "files.cleaned-download"
+
+RANGE_REGEX = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+# ================================
+# CLEANED ARTIFACT STORE
+# ================================
+# One file per (original hash, policy version) plus a JSON sidecar with the
+# hashes. Same upload + same policy = same cleaned bytes, so a retried or
+# resumed download reuses the file instead of running the clean again.
+# Only large cleans and cleans asked for a download link are stored.
+class CleanedArtifact(CleanedFile):
+    """A cleaned file kept in the artifact store: cleanup() leaves it there"""
+
+    def __init__(self, key, sha256_before, sha256_after, path):
+        super().__init__(sha256_before, sha256_after, path=path)
+        self.key = key
+
+
+def artifact_key(sha256_before: str, policy_version: str) -> str:
+    return f"{sha256_before}-{policy_version}"
+
+
+def artifact_path(key: str) -> str:
+    return os.path.join(CLEANED_ARTIFACT_DIR, key)
+
+
+def load_artifact(key: str) -> Optional[CleanedArtifact]:
+    """The stored artifact if it is still fresh; using it restarts its TTL"""
+    path = artifact_path(key)
+    try:
+        if os.path.getmtime(path) < time.time() - CLEANED_ARTIFACT_TTL:
+            return None
+        with open(path + ".json") as sidecar:
+            hashes = json.load(sidecar)
+        # Both files, or the purge drops the sidecar while the artifact is in use
+        os.utime(path)
+        os.utime(path + ".json")
+    except (OSError, ValueError):
+        return None
+    return CleanedArtifact(key, hashes["sha256_before"], hashes["sha256_after"], path)
+
+
+def _write_atomic(path: str, write):
+    fd, tmp_path = tempfile.mkstemp(dir=CLEANED_ARTIFACT_DIR, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            write(out)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def save_artifact(key: str, sha256_before: str, cleaned: CleanedFile) -> CleanedArtifact:
+    """
+    Keep a clean's output in the store. A temp file the clean owns is
+    renamed into place; in-memory and piece-wise results are written out.
+    """
+    os.makedirs(CLEANED_ARTIFACT_DIR, exist_ok=True)
+    path = artifact_path(key)
+
+    moved = False
+    if cleaned.path is not None and cleaned.path in cleaned.temp_paths:
+        try:
+            os.replace(cleaned.path, path)
+            moved = True
+        except OSError:
+            pass  # temp dir on another filesystem
+    if not moved:
+        def copy(out):
+            with cleaned.open() as source:
+                shutil.copyfileobj(source, out, 1024 * 1024)
+        _write_atomic(path, copy)
+
+    hashes = {"sha256_before": sha256_before, "sha256_after": cleaned.sha256_after}
+    _write_atomic(path + ".json", lambda out: out.write(json.dumps(hashes).encode()))
+
+    purge_expired_artifacts()
+    return CleanedArtifact(key, sha256_before, cleaned.sha256_after, path)
+
+
+_last_purge = 0.0
+_purge_lock = threading.Lock()
+
+
+def purge_expired_artifacts(force: bool = False) -> int:
+    """
+    Delete artifacts past their TTL together with their sidecars, and
+    sidecars left without an artifact; runs at most once a minute per process
+    """
+    global _last_purge
+    now = time.time()
+    with _purge_lock:
+        if not force and now - _last_purge < ARTIFACT_PURGE_INTERVAL:
+            return 0
+        _last_purge = now
+
+    removed = 0
+    try:
+        entries = list(os.scandir(CLEANED_ARTIFACT_DIR))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        if entry.name.endswith(".json"):
+            continue  # goes with its artifact
+        try:
+            if entry.stat().st_mtime >= now - CLEANED_ARTIFACT_TTL:
+                continue
+            os.remove(entry.path)
+            removed += 1
+        except OSError:
+            continue
+        try:
+            os.remove(entry.path + ".json")
+            removed += 1
+        except OSError:
+            pass
+
+    for entry in entries:
+        if entry.name.endswith(".json") and not os.path.exists(entry.path[:-len(".json")]):
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def wants_download_link(request) -> bool:
+    """?link=1: keep the clean so X-Download-URL can fetch (and resume) it"""
+    return request.GET.get("link", "").lower() in ("1", "true", "yes")
+
+
+def should_keep(cleaned: CleanedFile, keep: bool) -> bool:
+    return keep or cleaned.size >= CLEANED_ARTIFACT_MIN_BYTES
+
+
+def cleaned_artifact(uploaded_file, original_hash=None, policy=None, clean=clean_metadata_guest, keep=False) -> CleanedFile:
+    """
+    🧹 The upload cleaned under `policy`, reusing a fresh artifact when
+    the same file was cleaned with the same policy a moment ago.
+    The clean is stored only when `keep` is set or it is large; otherwise
+    the CleanedFile itself comes back, to be streamed and cleaned up.
+    """
+    if original_hash is None:
+        original_hash = upload_sha256(uploaded_file)
+    if policy is None:
+        policy = GUEST_COMPILED_POLICY
+
+    key = artifact_key(original_hash, policy.version)
+    artifact = load_artifact(key)
+    if artifact is not None:
+        record_artifact("reused")
+        return artifact
+
+    cleaned = clean(uploaded_file, original_hash, policy)
+    if not should_keep(cleaned, keep):
+        record_artifact("streamed")
+        return cleaned
+    try:
+        record_artifact("cleaned")
+        return save_artifact(key, original_hash, cleaned)
+    finally:
+        cleaned.cleanup()
+
+
+async def acleaned_artifact(uploaded_file, original_hash=None, policy=None, keep=False) -> CleanedFile:
+    if original_hash is None:
+        original_hash = await sync_to_async(upload_sha256, thread_sensitive=False)(uploaded_file)
+    if policy is None:
+        policy = GUEST_COMPILED_POLICY
+
+    key = artifact_key(original_hash, policy.version)
+    artifact = await sync_to_async(load_artifact, thread_sensitive=False)(key)
+    if artifact is not None:
+        record_artifact("reused")
+        return artifact
+
+    cleaned = await aclean_metadata_guest(uploaded_file, original_hash, policy)
+    if not should_keep(cleaned, keep):
+        record_artifact("streamed")
+        return cleaned
+    try:
+        record_artifact("cleaned")
+        return await sync_to_async(save_artifact, thread_sensitive=False)(key, original_hash, cleaned)
+    finally:
+        cleaned.cleanup()
+
+
+# ================================
+# DOWNLOAD LINKS
+# ================================
+class DownloadGrant(NamedTuple):
+    key: str
+    filename: str
+    user_id: Optional[int]
+
+
+def download_token(artifact: CleanedArtifact, filename: str, user=None) -> str:
+    """Signed and short-lived; a user's link only works for that user"""
+    user_id = user.id if user is not None and user.is_authenticated else None
+    return signing.dumps({"k": artifact.key, "f": filename, "u": user_id}, salt=DOWNLOAD_TOKEN_SALT, compress=True)
+
+
+def read_download_token(token: str) -> Optional[DownloadGrant]:
+    try:
+        data = signing.loads(token, salt=DOWNLOAD_TOKEN_SALT, max_age=CLEANED_ARTIFACT_TTL)
+    except signing.BadSignature:
+        return None
+    return DownloadGrant(data["k"], data["f"], data["u"])
+
+
+# ================================
+# RANGE RESPONSES
+# ================================
+class FileRange(io.RawIOBase):
+    """
+    Bytes [start, end) of an open file, seen as a whole file. The real file
+    stays positioned at the range and fileno() is exposed, so the WSGI
+    server's file_wrapper can os.sendfile() the range without copying it.
+    """
+
+    def __init__(self, raw, start: int, end: int):
+        super().__init__()
+        self.raw = raw
+        self.start = start
+        self.length = end - start
+        self.pos = 0
+        raw.seek(start)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def fileno(self):
+        return self.raw.fileno()
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.pos, io.SEEK_END: self.length}[whence]
+        self.pos = min(max(0, base + offset), self.length)
+        self.raw.seek(self.start + self.pos)
+        return self.pos
+
+    def readinto(self, buffer):
+        count = min(len(buffer), self.length - self.pos)
+        if count <= 0:
+            return 0
+        n = self.raw.readinto(memoryview(buffer)[:count])
+        self.pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.raw.close()
+        super().close()
+
+
+class CleanedFileResponse(FileResponse):
+    # Bigger reads when the server streams instead of using sendfile (ASGI)
+    block_size = 64 * 1024
+
+
+class StreamedCleanResponse(CleanedFileResponse):
+    """A clean that was not stored: its temp files go once the response is sent"""
+
+    def __init__(self, cleaned: CleanedFile, *args, **kwargs):
+        self.cleaned = cleaned
+        super().__init__(cleaned.open(), *args, **kwargs)
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.cleaned.cleanup()
+
+
+def requested_range(request, size: int, etag: Optional[str] = None):
+    """
+    (start, end) for a single satisfiable "Range: bytes=" request, False if
+    it can't be satisfied, None to send the whole file. Multiple ranges and
+    stale If-Range validators get the whole file, as RFC 9110 allows.
+    """
+    header = request.META.get("HTTP_RANGE", "")
+    if request.method not in ("GET", "HEAD") or not header:
+        return None
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if if_range and (etag is None or if_range.strip() != f'"{etag}"'):
+        return None
+
+    match = RANGE_REGEX.match(header.replace(" ", ""))
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+
+    if not first:
+        # Suffix: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            return False
+        return max(0, size - length), size - 1
+
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return False
+    return start, end
+
+
+def offload_header(path: str) -> Optional[Tuple[str, str]]:
+    """The proxy header that makes it send `path`, if offloading is configured"""
+    if CLEANED_FILE_OFFLOAD == "x-sendfile":
+        return "X-Sendfile", os.path.abspath(path)
+    if CLEANED_FILE_OFFLOAD == "x-accel-redirect":
+        relative = os.path.relpath(os.path.abspath(path), os.path.abspath(CLEANED_ARTIFACT_DIR))
+        if not relative.startswith(os.pardir):
+            # Only the artifact directory is behind the internal location
+            return "X-Accel-Redirect", CLEANED_FILE_ACCEL_PREFIX.rstrip("/") + "/" + relative.replace(os.sep, "/")
+    return None
+
+
+def file_download_response(request, path: str, filename: str, etag: Optional[str] = None) -> HttpResponse:
+    """
+    📦 Send a file on disk as an attachment
+    ✅ Range requests get 206 (or 416) with Content-Range
+    ✅ With a proxy offload header the proxy sends the bytes and handles Range
+    """
+    offload = offload_header(path)
+    if offload is not None:
+        content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        response = HttpResponse(content_type=content_type)
+        response[offload[0]] = offload[1]
+        response["Content-Disposition"] = content_disposition_header(True, filename)
+    else:
+        size = os.path.getsize(path)
+        byte_range = requested_range(request, size, etag)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+        start, end = byte_range or (0, size - 1)
+        response = CleanedFileResponse(
+            FileRange(open(path, "rb"), start, end + 1),
+            as_attachment=True,
+            filename=filename,
+            status=206 if byte_range else 200,
+        )
+        if byte_range:
+            response["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    response["Accept-Ranges"] = "bytes"
+    if etag:
+        response["ETag"] = f'"{etag}"'
+    return response
+
+
+def cleaned_file_response(request, cleaned: CleanedFile, filename: str, user=None) -> HttpResponse:
+    """
+    The cleaned file. A stored artifact also gets Range support and a link
+    to fetch it again while it lasts; anything else is streamed as-is.
+    """
+    if isinstance(cleaned, CleanedArtifact):
+        response = file_download_response(request, cleaned.path, filename, etag=cleaned.sha256_after)
+        response["X-Download-URL"] = reverse("cleaned_download", args=[download_token(cleaned, filename, user)])
+    else:
+        response = StreamedCleanResponse(cleaned, as_attachment=True, filename=filename)
+        response["ETag"] = f'"{cleaned.sha256_after}"'
+    response["X-Metadata-Cleaned"] = "true"
+    response["X-Hash-Changed"] = str(cleaned.hash_changed).lower()
+    return response
@@ -0,0 +1,432 @@
+import asyncio
+import atexit
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+import time
+import weakref
+from typing import Iterable, List, NamedTuple, Optional
+
+from django.conf import settings
+
+from .metrics import record_exiftool, stage
+
+
+EXIFTOOL_PATH = getattr(settings, "EXIFTOOL_PATH", r"C:\exiftool\exiftool.exe")
+
+# Pool size 0 disables the pool and spawns one ExifTool process per call
+EXIFTOOL_POOL_SIZE = getattr(settings, "EXIFTOOL_POOL_SIZE", 2)
+EXIFTOOL_MAX_JOBS_PER_WORKER = getattr(settings, "EXIFTOOL_MAX_JOBS_PER_WORKER", 500)
+EXIFTOOL_TIMEOUT = getattr(settings, "EXIFTOOL_TIMEOUT", 60)
+
+# Uploads up to this size are piped through stdin/stdout instead of temp files
+EXIFTOOL_PIPE_MAX_BYTES = getattr(settings, "EXIFTOOL_PIPE_MAX_BYTES", 16 * 1024 * 1024)
+
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class ExifToolError(RuntimeError):
+    pass
+
+
+class ExifToolCrashed(ExifToolError):
+    """The worker died mid-job: safe to retry on a fresh one"""
+
+
+class ExifToolTimeout(ExifToolError):
+    """No worker free in time, or the job ran past its deadline"""
+
+
+class ExifToolResult(NamedTuple):
+    status: int
+    stdout: bytes
+    stderr: bytes
+
+    @property
+    def text(self) -> str:
+        return self.stdout.decode("utf-8", errors="replace")
+
+
+# ================================
+# STAY-OPEN WORKER
+# ================================
+class ExifToolWorker:
+    """
+    🔁 One long-lived ExifTool process running in -stay_open mode
+    ✅ Arguments are streamed through stdin, one per line
+    ✅ Each job ends with -executeN, output ends with {readyN}
+    ✅ stdout and stderr are drained continuously by reader threads, so a
+       chatty stderr can't fill its pipe and block ExifTool
+    ✅ A job past its deadline kills the process
+    """
+
+    def __init__(self, executable: str = EXIFTOOL_PATH):
+        self.executable = executable
+        self.jobs = 0
+        self.process = subprocess.Popen(
+            [executable, "-stay_open", "True", "-@", "-", "-common_args", "-charset", "filename=utf8"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            shell=False,
+        )
+        self._output = threading.Condition()
+        self._stdout = bytearray()
+        self._stderr = bytearray()
+        self._eof = False
+        for stream, buffer in ((self.process.stdout, self._stdout), (self.process.stderr, self._stderr)):
+            threading.Thread(target=self._drain, args=(stream, buffer), daemon=True, name="exiftool-reader").start()
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def _drain(self, stream, buffer: bytearray):
+        fd = stream.fileno()
+        while True:
+            try:
+                chunk = os.read(fd, READ_BLOCK_SIZE)
+            except OSError:
+                chunk = b""
+            with self._output:
+                if chunk:
+                    buffer += chunk
+                else:
+                    self._eof = True
+                self._output.notify_all()
+            if not chunk:
+                return
+
+    def execute(self, args: List[str], timeout: float = EXIFTOOL_TIMEOUT) -> ExifToolResult:
+        self.jobs += 1
+        seq = self.jobs
+        ready = f"{{ready{seq}}}".encode()
+        status_marker = f"=post{seq}".encode()
+
+        lines = [str(a) for a in args]
+        if any("\n" in line for line in lines):
+            raise ExifToolError("ExifTool arguments cannot contain newlines")
+
+        # -echo4 prints the exit status of this job to stderr when it finishes
+        lines.extend(["-echo4", f"=${{status}}=post{seq}", f"-execute{seq}"])
+        payload = ("\n".join(lines) + "\n").encode("utf-8")
+
+        try:
+            self.process.stdin.write(payload)
+            self.process.stdin.flush()
+        except (OSError, ValueError) as e:
+            raise ExifToolCrashed(f"ExifTool worker crashed: {e}") from e
+
+        deadline = time.monotonic() + timeout
+        with self._output:
+            while not (_ends_with(self._stdout, ready) and _ends_with(self._stderr, status_marker)):
+                if self._eof:
+                    raise ExifToolCrashed("ExifTool worker exited unexpectedly")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.process.kill()
+                    raise ExifToolTimeout(f"ExifTool took longer than {timeout:g}s")
+                self._output.wait(remaining)
+
+            stdout = bytes(self._stdout).rstrip(b"\r\n")[: -len(ready)].rstrip(b"\r\n")
+            stderr = bytes(self._stderr).rstrip(b"\r\n")[: -len(status_marker)]
+            self._stdout.clear()
+            self._stderr.clear()
+
+        # stderr now ends with "=<status>"
+        head, _, status_text = stderr.rpartition(b"=")
+        try:
+            status = int(status_text.strip())
+        except ValueError:
+            status = 0
+
+        return ExifToolResult(status, stdout, head.rstrip(b"\r\n"))
+
+    def close(self):
+        if not self.alive:
+            return
+        try:
+            self.process.stdin.write(b"-stay_open\nFalse\n")
+            self.process.stdin.flush()
+            self.process.wait(timeout=5)
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            self.process.kill()
+
+
+def _ends_with(buffer: bytearray, marker: bytes) -> bool:
+    return bytes(buffer[-len(marker) - 4:]).rstrip(b"\r\n").endswith(marker)
+
+
+# ================================
+# WORKER POOL
+# ================================
+class ExifToolPool:
+    """
+    🏊 Fixed-size pool of stay-open ExifTool workers
+    ✅ Workers are started lazily and shared between requests
+    ✅ Workers are recycled after max_jobs requests or when they crash
+    """
+
+    def __init__(self, size: int = EXIFTOOL_POOL_SIZE, max_jobs: int = EXIFTOOL_MAX_JOBS_PER_WORKER,
+                 executable: str = EXIFTOOL_PATH, timeout: float = EXIFTOOL_TIMEOUT):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.executable = executable
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._workers = []
+        self.recycled = 0
+
+    def _checkout(self) -> ExifToolWorker:
+        if not self._slots.acquire(timeout=self.timeout):
+            raise ExifToolTimeout("Timed out waiting for an ExifTool worker")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            worker = ExifToolWorker(self.executable)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._workers.append(worker)
+        return worker
+
+    def _checkin(self, worker: ExifToolWorker, broken: bool = False):
+        if broken or not worker.alive or worker.jobs >= self.max_jobs:
+            self._retire(worker)
+        else:
+            self._idle.put(worker)
+        self._slots.release()
+
+    def _retire(self, worker: ExifToolWorker):
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+        self.recycled += 1
+        worker.close()
+
+    def execute(self, args: List[str]) -> ExifToolResult:
+        worker = self._checkout()
+        try:
+            result = worker.execute(args, self.timeout)
+        except ExifToolError:
+            self._checkin(worker, broken=True)
+            raise
+        self._checkin(worker)
+        return result
+
+    def stats(self) -> List[dict]:
+        with self._lock:
+            return [
+                {"pid": w.process.pid, "jobs": w.jobs, "alive": w.alive}
+                for w in self._workers
+            ]
+
+    def close(self):
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.close()
+        while not self._idle.empty():
+            self._idle.get_nowait()
+
+
+_pool: Optional[ExifToolPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ExifToolPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ExifToolPool()
+                atexit.register(_pool.close)
+    return _pool
+
+
+# ================================
+# SERVICE API
+# ================================
+def run_exiftool(args: List[str]) -> ExifToolResult:
+    """
+    Run one ExifTool command (arguments without the executable).
+    Uses the stay-open pool when enabled, otherwise spawns a process.
+    Timeouts (job or pool checkout) and crashes are counted too.
+    """
+    with stage("exiftool"):
+        try:
+            if EXIFTOOL_POOL_SIZE > 0:
+                try:
+                    result = get_pool().execute(args)
+                except ExifToolCrashed:
+                    # Worker died mid-job: it has been recycled, retry once on a fresh one.
+                    # Timeouts are not retried: that would only double the wait.
+                    result = get_pool().execute(args)
+            else:
+                completed = subprocess.run(
+                    [EXIFTOOL_PATH, *args],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    shell=False,
+                    timeout=EXIFTOOL_TIMEOUT,
+                )
+                result = ExifToolResult(completed.returncode, completed.stdout, completed.stderr)
+        except ExifToolTimeout:
+            record_exiftool("timeout")
+            raise
+        except subprocess.TimeoutExpired as e:
+            # subprocess.run() has already killed it
+            record_exiftool("timeout")
+            raise ExifToolTimeout(f"ExifTool took longer than {EXIFTOOL_TIMEOUT:g}s") from e
+        except ExifToolCrashed:
+            record_exiftool("crashed")
+            raise
+
+    record_exiftool(result.status)
+    return result
+
+
+def pipe_uploads() -> bool:
+    """
+    Stream uploads through stdin? Only without the pool: a stay-open
+    worker takes its arguments on stdin, and starting a process per
+    upload costs far more than writing it to a temp file.
+    """
+    return EXIFTOOL_POOL_SIZE <= 0
+
+
+def run_exiftool_pipe(args: List[str], chunks: Iterable[bytes]) -> ExifToolResult:
+    """
+    Run one ExifTool process that reads the file from stdin ("-").
+    Chunks are fed and both outputs drained from threads, so neither the
+    input nor the output touches the disk and the deadline always holds.
+    """
+    process = subprocess.Popen(
+        [EXIFTOOL_PATH, *args],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        shell=False,
+    )
+
+    def feed():
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+        except (OSError, ValueError):
+            # ExifTool stopped reading (it has all it needs, failed or was killed)
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    outputs = {}
+    threads = [threading.Thread(target=feed, daemon=True)] + [
+        threading.Thread(target=lambda name=name: outputs.__setitem__(name, getattr(process, name).read()), daemon=True)
+        for name in ("stdout", "stderr")
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        with stage("exiftool"):
+            status = process.wait(timeout=EXIFTOOL_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+        record_exiftool("timeout")
+        raise ExifToolTimeout(f"ExifTool took longer than {EXIFTOOL_TIMEOUT:g}s")
+    finally:
+        for thread in threads:
+            thread.join()
+
+    record_exiftool(status)
+    return ExifToolResult(status, outputs.get("stdout", b""), outputs.get("stderr", b""))
+
+
+def run_exiftool_stream(args: List[str], chunks: Iterable[bytes]) -> ExifToolResult:
+    """
+    Run a read-only ExifTool command on streamed bytes ("-" in args is the
+    input). Piped when pipe_uploads(), otherwise spooled to a temp file
+    for a stay-open worker.
+    """
+    if pipe_uploads():
+        return run_exiftool_pipe(args, chunks)
+
+    with tempfile.NamedTemporaryFile(delete=False) as spool:
+        for chunk in chunks:
+            spool.write(chunk)
+    try:
+        return run_exiftool([spool.name if arg == "-" else arg for arg in args])
+    finally:
+        os.remove(spool.name)
+
+
+# ================================
+# ASYNCIO EXECUTION (ASGI VIEWS)
+# ================================
+# Global cap on concurrent ExifTool processes started from async views
+EXIFTOOL_ASYNC_CONCURRENCY = getattr(settings, "EXIFTOOL_ASYNC_CONCURRENCY", 8)
+
+_async_semaphores = weakref.WeakKeyDictionary()
+
+
+def _async_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = _async_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _async_semaphores[loop] = asyncio.Semaphore(EXIFTOOL_ASYNC_CONCURRENCY)
+    return semaphore
+
+
+async def run_exiftool_async(args: List[str], chunks: Optional[Iterable[bytes]] = None) -> ExifToolResult:
+    """
+    Run one ExifTool command as an asyncio subprocess. With `chunks`
+    the file is fed through stdin ("-"), otherwise args must name a path.
+    The event loop stays free while ExifTool works.
+    """
+    async with _async_semaphore():
+        process = await asyncio.create_subprocess_exec(
+            EXIFTOOL_PATH, *args,
+            stdin=asyncio.subprocess.PIPE if chunks is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+
+        async def feed():
+            if chunks is None:
+                return
+            try:
+                for chunk in chunks:
+                    process.stdin.write(chunk)
+                    await process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                # ExifTool stopped reading (it has all it needs, or it failed)
+                pass
+            finally:
+                process.stdin.close()
+
+        try:
+            with stage("exiftool"):
+                _, stdout, stderr = await asyncio.wait_for(
+                    asyncio.gather(feed(), process.stdout.read(), process.stderr.read()),
+                    timeout=EXIFTOOL_TIMEOUT,
+                )
+                status = await process.wait()
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            record_exiftool("timeout")
+            raise ExifToolTimeout(f"ExifTool took longer than {EXIFTOOL_TIMEOUT:g}s")
+
+    record_exiftool(status)
+    return ExifToolResult(status, stdout, stderr)
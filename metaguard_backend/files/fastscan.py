@@ -0,0 +1,249 @@
+import io
+from typing import Dict, List, NamedTuple, Optional
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+
+from .exiftool import EXIFTOOL_PIPE_MAX_BYTES
+
+
+# Uploads at least this big are scanned from their headers only
+FAST_SCAN_MIN_BYTES = getattr(settings, "FAST_SCAN_MIN_BYTES", EXIFTOOL_PIPE_MAX_BYTES)
+
+# JPEG-style formats: metadata segments sit before the image data
+FAST_SCAN_HEAD_BYTES = getattr(settings, "FAST_SCAN_HEAD_BYTES", 4 * 1024 * 1024)
+
+# QuickTime/MP4: give up (full scan) if the non-media atoms are bigger than this
+FAST_SCAN_MAX_HEADER_BYTES = getattr(settings, "FAST_SCAN_MAX_HEADER_BYTES", 64 * 1024 * 1024)
+
+# "-fast" stops at the image/media data, "-fast2" also skips MakerNotes
+FAST_SCAN_EXIFTOOL_OPTION = getattr(settings, "FAST_SCAN_EXIFTOOL_OPTION", "-fast")
+
+# Endpoints (URL names) whose large uploads keep only these parts while streaming in
+FAST_SCAN_UPLOAD_ENDPOINTS = getattr(settings, "FAST_SCAN_UPLOAD_ENDPOINTS", ())
+
+READ_BLOCK_SIZE = 1024 * 1024
+
+QUICKTIME_FIRST_ATOMS = {b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide", b"pnot"}
+
+# Media payload: replaced by an empty atom of the same type
+QUICKTIME_MEDIA_ATOMS = {b"mdat"}
+
+
+class ScanPlan(NamedTuple):
+    mode: str
+    chunks: List[bytes]
+    file_size: int
+
+    @property
+    def bytes_read(self) -> int:
+        return sum(len(c) for c in self.chunks)
+
+    def report(self) -> Dict:
+        """What the API tells the client about a partial read"""
+        return {
+            "mode": self.mode,
+            "bytes_read": self.bytes_read,
+            "file_size": self.file_size,
+            "exiftool_option": FAST_SCAN_EXIFTOOL_OPTION,
+        }
+
+
+def scan_args() -> List[str]:
+    return [FAST_SCAN_EXIFTOOL_OPTION, "-j", "-a", "-u", "-g1", "-"]
+
+
+# ================================
+# FORMAT-AWARE READ LIMITS
+# ================================
+def _read_at(uploaded_file, offset: int, size: int) -> bytes:
+    uploaded_file.seek(offset)
+    return uploaded_file.read(size)
+
+
+def _quicktime_headers(uploaded_file, size: int) -> Optional[List[bytes]]:
+    """
+    Every top-level atom except the media data, read in full. mdat is
+    replaced by an empty atom so ExifTool sees the same structure.
+    """
+    chunks, kept, pos = [], 0, 0
+    while pos < size:
+        header = _read_at(uploaded_file, pos, 16)
+        if len(header) < 8:
+            return None
+        atom_size = int.from_bytes(header[:4], "big")
+        atom_type = header[4:8]
+        header_len = 8
+        if atom_size == 1:
+            if len(header) < 16:
+                return None
+            atom_size = int.from_bytes(header[8:16], "big")
+            header_len = 16
+        elif atom_size == 0:
+            atom_size = size - pos
+        if atom_size < header_len or pos + atom_size > size:
+            return None
+
+        if atom_type in QUICKTIME_MEDIA_ATOMS:
+            chunks.append(b"\x00\x00\x00\x08" + atom_type)
+        else:
+            kept += atom_size
+            if kept > FAST_SCAN_MAX_HEADER_BYTES:
+                return None
+            uploaded_file.seek(pos)
+            remaining = atom_size
+            while remaining:
+                block = uploaded_file.read(min(READ_BLOCK_SIZE, remaining))
+                if not block:
+                    return None
+                chunks.append(block)
+                remaining -= len(block)
+        pos += atom_size
+
+    return chunks
+
+
+def _jpeg_head(uploaded_file, size: int) -> List[bytes]:
+    return [_read_at(uploaded_file, 0, min(size, FAST_SCAN_HEAD_BYTES))]
+
+
+def scan_mode(head: bytes) -> Optional[str]:
+    """How the file starting with `head` can be cut down, None if it can't"""
+    if head[4:8] in QUICKTIME_FIRST_ATOMS:
+        return "quicktime-atoms"
+    if head[:3] == b"\xff\xd8\xff":
+        return "head"
+    return None
+
+
+def plan_fast_scan(uploaded_file) -> Optional[ScanPlan]:
+    """
+    The parts of a large upload ExifTool needs, or None when the format
+    isn't one we can cut down safely (TIFF-based RAW, unknown, small files).
+    """
+    if header_only(uploaded_file):
+        return uploaded_file.scan_plan
+
+    size = uploaded_file.size
+    if size < FAST_SCAN_MIN_BYTES:
+        return None
+
+    mode = scan_mode(_read_at(uploaded_file, 0, 12))
+    try:
+        if mode == "quicktime-atoms":
+            chunks = _quicktime_headers(uploaded_file, size)
+            return ScanPlan(mode, chunks, size) if chunks else None
+        if mode == "head":
+            return ScanPlan(mode, _jpeg_head(uploaded_file, size), size)
+        return None
+    finally:
+        uploaded_file.seek(0)
+
+
+# ================================
+# WHILE THE UPLOAD STREAMS IN
+# ================================
+class HeaderCollector:
+    """
+    Picks the same parts plan_fast_scan() reads out of an upload as it
+    arrives, so the media data is never stored. Unlike a read from disk
+    there's no full scan to fall back on: a malformed atom keeps everything
+    after it, and non-media atoms past FAST_SCAN_MAX_HEADER_BYTES are cut.
+    """
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.chunks = []
+        self.kept = 0
+        self.pending = b""  # an atom header split across chunks
+        self.keep = 0       # bytes of the current atom still to keep
+        self.skip = 0       # bytes of the current media atom still to drop
+        self.rest = None    # "keep" / "skip": everything up to the end of the file
+
+    def _keep(self, data):
+        limit = FAST_SCAN_HEAD_BYTES if self.mode == "head" else FAST_SCAN_MAX_HEADER_BYTES
+        data = data[:max(0, limit - self.kept)]
+        if data:
+            self.chunks.append(bytes(data))
+            self.kept += len(data)
+
+    def feed(self, data: bytes):
+        if self.mode == "head":
+            self._keep(data)
+            return
+
+        view = memoryview(data)
+        while view:
+            if self.rest == "keep":
+                self._keep(view)
+                return
+            if self.rest == "skip":
+                return
+            if self.keep:
+                n = min(len(view), self.keep)
+                self._keep(view[:n])
+                self.keep -= n
+                view = view[n:]
+            elif self.skip:
+                n = min(len(view), self.skip)
+                self.skip -= n
+                view = view[n:]
+            else:
+                view = self._atom_header(view)
+
+    def _atom_header(self, view):
+        """Take header bytes; once the whole header is in, start on the atom"""
+        while True:
+            need = 16 if self.pending[:4] == b"\x00\x00\x00\x01" else 8
+            if len(self.pending) >= need:
+                break
+            if not view:
+                return view
+            n = min(need - len(self.pending), len(view))
+            self.pending += bytes(view[:n])
+            view = view[n:]
+
+        header, self.pending = self.pending, b""
+        atom_type = header[4:8]
+        size = int.from_bytes(header[8:16] if len(header) == 16 else header[:4], "big")
+        if 0 < size < len(header):
+            # Not an atom: ExifTool gets everything from here on
+            self._keep(header)
+            self.rest = "keep"
+            return view
+
+        body = size - len(header) if size else None
+        if atom_type in QUICKTIME_MEDIA_ATOMS:
+            self.chunks.append(b"\x00\x00\x00\x08" + atom_type)
+            if body is None:
+                self.rest = "skip"
+            else:
+                self.skip = body
+        else:
+            self._keep(header)
+            if body is None:
+                self.rest = "keep"
+            else:
+                self.keep = body
+        return view
+
+    def plan(self, file_size: int) -> ScanPlan:
+        return ScanPlan(self.mode, self.chunks, file_size)
+
+
+class HeaderOnlyUpload(UploadedFile):
+    """
+    An upload of which only `scan_plan`'s parts were kept. Reads see those
+    parts; `size` and `sha256` are the whole file's.
+    """
+
+    def __init__(self, scan_plan: ScanPlan, name, content_type, charset, content_type_extra=None):
+        super().__init__(
+            io.BytesIO(b"".join(scan_plan.chunks)), name, content_type, scan_plan.file_size,
+            charset, content_type_extra,
+        )
+        self.scan_plan = scan_plan
+
+
+def header_only(uploaded_file) -> bool:
+    return isinstance(uploaded_file, HeaderOnlyUpload)
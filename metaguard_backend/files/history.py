@@ -0,0 +1,133 @@
+import base64
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from django.db.models import Prefetch, Q
+
+from .models import FileAnalysis, MetadataField
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+HISTORY_FIELDS = [
+    "id",
+    "file_name",
+    "file_type",
+    "file_size",
+    "risk_level",
+    "total_risk_score",
+    "risk_counts",
+    "sha256_before",
+    "sha256_after",
+    "metadata_raw",
+    "metadata_removed",
+    "scanned_at",
+    "cleaned_at",
+    "updated_at",
+    "metadata_fields",
+]
+
+# Built from the MetadataField rows, not stored on FileAnalysis
+FIELD_ROW_FIELDS = {"metadata_raw", "metadata_fields"}
+
+# What list screens need: names, risk and timestamps
+SUMMARY_FIELDS = ["id", "file_name", "file_type", "risk_level", "scanned_at", "cleaned_at"]
+
+
+class InvalidHistoryQuery(ValueError):
+    pass
+
+
+# ================================
+# KEYSET CURSOR (scanned_at, id)
+# ================================
+def encode_cursor(file_obj: FileAnalysis) -> str:
+    raw = f"{file_obj.scanned_at.isoformat()}|{file_obj.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        scanned_at, file_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(scanned_at), int(file_id)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidHistoryQuery("Invalid cursor")
+
+
+# ================================
+# PROJECTION
+# ================================
+def resolve_fields(view: Optional[str], fields: Optional[str]) -> List[str]:
+    if fields:
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in requested if f not in HISTORY_FIELDS]
+        if unknown:
+            raise InvalidHistoryQuery(f"Unknown fields: {', '.join(unknown)}")
+        return requested
+    if view == "summary":
+        return SUMMARY_FIELDS
+    if view in (None, "", "full"):
+        return HISTORY_FIELDS
+    raise InvalidHistoryQuery("view must be 'summary' or 'full'")
+
+
+def serialize_file_analysis(file_obj: FileAnalysis, fields: Sequence[str]) -> Dict:
+    data = {}
+    for name in fields:
+        if name == "metadata_fields":
+            data[name] = [
+                {
+                    "tag": m.tag.name,
+                    "value": m.value,
+                    "category": m.category_name,
+                    "risk_level": m.risk_level,
+                    "removed": m.removed
+                }
+                for m in file_obj.metadata_fields.all()
+            ]
+        else:
+            data[name] = getattr(file_obj, name)
+    return data
+
+
+def with_metadata_fields(queryset):
+    """Field rows and their tag names in one extra query, in extraction order"""
+    return queryset.prefetch_related(Prefetch(
+        "metadata_fields",
+        queryset=MetadataField.objects.select_related("tag").order_by("id"),
+    ))
+
+
+# ================================
+# ONE PAGE OF HISTORY
+# ================================
+def history_page(user, fields: Sequence[str], limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None):
+    """
+    Newest first, walking the (user, -scanned_at) index with a keyset cursor.
+    Only the requested columns are loaded; fields are prefetched on request.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    columns = {"id", "scanned_at"} | {f for f in fields if f not in FIELD_ROW_FIELDS}
+    files = (
+        FileAnalysis.objects
+        .filter(user=user)
+        .only(*columns)
+        .order_by("-scanned_at", "-id")
+    )
+
+    if cursor:
+        scanned_at, file_id = decode_cursor(cursor)
+        files = files.filter(
+            Q(scanned_at__lt=scanned_at) | Q(scanned_at=scanned_at, id__lt=file_id)
+        )
+
+    if FIELD_ROW_FIELDS & set(fields):
+        files = with_metadata_fields(files)
+
+    # One extra row tells us whether there is a next page
+    page = list(files[:limit + 1])
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+
+    return [serialize_file_analysis(f, fields) for f in page[:limit]], next_cursor
@@ -0,0 +1,301 @@
+import json
+import logging
+import math
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import AnalysisJob
+from .records import analyze_and_save, clean_and_save
+
+
+logger = logging.getLogger(__name__)
+
+JOB_SPOOL_DIR = str(getattr(settings, "ANALYSIS_JOB_DIR", settings.BASE_DIR / "job_spool"))
+JOB_WORKERS = getattr(settings, "ANALYSIS_JOB_WORKERS", 2)
+JOB_LEASE_SECONDS = getattr(settings, "ANALYSIS_JOB_LEASE_SECONDS", 10 * 60)
+JOB_MAX_ATTEMPTS = getattr(settings, "ANALYSIS_JOB_MAX_ATTEMPTS", 3)
+JOB_RESULT_TTL = getattr(settings, "ANALYSIS_JOB_RESULT_TTL", 24 * 60 * 60)
+
+# Run jobs on a thread pool inside the web process as soon as they are queued.
+# Turn off when a dedicated `manage.py run_analysis_jobs` worker is running.
+JOBS_IN_PROCESS = getattr(settings, "ANALYSIS_JOBS_IN_PROCESS", True)
+
+# In-process mode: how often the web process picks up jobs left queued or
+# leased by a previous process, and purges expired results
+JOB_SWEEP_INTERVAL = getattr(settings, "ANALYSIS_JOB_SWEEP_INTERVAL", 60)
+
+
+class SpooledJobUpload(UploadedFile):
+    """The job's spool file, handed to the services like a Django upload"""
+
+    def __init__(self, file, path, **kwargs):
+        super().__init__(file=file, **kwargs)
+        self._path = path
+
+    def temporary_file_path(self):
+        return self._path
+
+
+# ================================
+# ENQUEUE
+# ================================
+def enqueue_job(user, kind: str, uploaded_file, file_analysis=None) -> AnalysisJob:
+    """
+    Spool the upload next to the queue and record the job.
+    The job is dispatched once the surrounding transaction commits.
+    """
+    os.makedirs(JOB_SPOOL_DIR, exist_ok=True)
+    job_id = uuid.uuid4()
+    upload_path = os.path.join(JOB_SPOOL_DIR, f"{job_id}.upload")
+
+    with open(upload_path, "wb") as spool:
+        for chunk in uploaded_file.chunks():
+            spool.write(chunk)
+
+    job = AnalysisJob.objects.create(
+        id=job_id,
+        user=user,
+        file_analysis=file_analysis,
+        kind=kind,
+        file_name=uploaded_file.name,
+        content_type=uploaded_file.content_type or "",
+        file_size=uploaded_file.size,
+        upload_path=upload_path,
+    )
+
+    if JOBS_IN_PROCESS:
+        transaction.on_commit(dispatch_in_process)
+
+    return job
+
+
+# ================================
+# CLAIM (LEASED, ATOMIC)
+# ================================
+def claim_next_job() -> Optional[AnalysisJob]:
+    """
+    Take the oldest queued job, or a running one whose worker died
+    (its lease expired). The conditional UPDATE makes the claim atomic
+    across threads and processes.
+    """
+    while True:
+        now = timezone.now()
+        claimable = Q(status=AnalysisJob.STATUS_QUEUED) | Q(
+            status=AnalysisJob.STATUS_RUNNING, locked_until__lt=now
+        )
+        job_id = (
+            AnalysisJob.objects.filter(claimable)
+            .order_by("created_at")
+            .values_list("id", flat=True)
+            .first()
+        )
+        if job_id is None:
+            return None
+
+        claimed = AnalysisJob.objects.filter(claimable, id=job_id).update(
+            status=AnalysisJob.STATUS_RUNNING,
+            locked_until=now + timedelta(seconds=JOB_LEASE_SECONDS),
+            attempts=F("attempts") + 1,
+            started_at=now,
+        )
+        if claimed:
+            return AnalysisJob.objects.select_related("user", "file_analysis__user__metadata_policy").get(id=job_id)
+        # Another worker won the race, try the next one
+
+
+def renew_lease(job: AnalysisJob) -> bool:
+    """Push the lease out again; False once the job is no longer ours"""
+    return bool(AnalysisJob.objects.filter(
+        id=job.id, status=AnalysisJob.STATUS_RUNNING, attempts=job.attempts,
+    ).update(locked_until=timezone.now() + timedelta(seconds=JOB_LEASE_SECONDS)))
+
+
+@contextmanager
+def lease_heartbeat(job: AnalysisJob):
+    """
+    Renew the lease every third of its length while the job runs, so a
+    long clean isn't mistaken for a dead worker and run a second time.
+    """
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(JOB_LEASE_SECONDS / 3):
+                if not renew_lease(job):
+                    return
+        finally:
+            close_old_connections()
+
+    thread = threading.Thread(target=beat, name=f"lease-{job.id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+# ================================
+# RUN ONE JOB
+# ================================
+def run_job(job: AnalysisJob):
+    if job.attempts > JOB_MAX_ATTEMPTS:
+        _finish(job, AnalysisJob.STATUS_FAILED, error="Gave up after repeated worker failures")
+        return
+
+    with lease_heartbeat(job):
+        _run_job(job)
+
+
+def _run_job(job: AnalysisJob):
+    try:
+        with open(job.upload_path, "rb") as spool:
+            uploaded_file = SpooledJobUpload(
+                spool,
+                job.upload_path,
+                name=job.file_name,
+                content_type=job.content_type,
+                size=job.file_size,
+            )
+
+            if job.kind == AnalysisJob.KIND_ANALYZE:
+                payload = analyze_and_save(job.user, uploaded_file)
+                result = json.loads(json.dumps(payload, cls=DjangoJSONEncoder))
+                _finish(job, AnalysisJob.STATUS_DONE, result=result)
+            else:
+                cleaned = clean_and_save(job.file_analysis, uploaded_file)
+                # The job result outlives the clean (and any artifact): link, or copy
+                result_path = os.path.join(JOB_SPOOL_DIR, f"{job.id}.cleaned")
+                try:
+                    if cleaned.path is None:
+                        with cleaned.open() as source, open(result_path, "wb") as out:
+                            shutil.copyfileobj(source, out, 1024 * 1024)
+                    else:
+                        try:
+                            os.link(cleaned.path, result_path)
+                        except OSError:
+                            shutil.copyfile(cleaned.path, result_path)
+                finally:
+                    cleaned.cleanup()
+                _finish(job, AnalysisJob.STATUS_DONE, result={
+                    "hash_changed": cleaned.hash_changed,
+                    "sha256_after": cleaned.sha256_after,
+                }, result_path=result_path)
+
+    except Exception as e:
+        logger.exception("Analysis job %s failed", job.id)
+        _finish(job, AnalysisJob.STATUS_FAILED, error=str(e))
+
+
+def _finish(job: AnalysisJob, status: str, result=None, result_path="", error=""):
+    job.status = status
+    job.result = result
+    job.result_path = result_path
+    job.error = error
+    job.locked_until = None
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "result", "result_path", "error", "locked_until", "finished_at"])
+
+    if os.path.exists(job.upload_path):
+        os.remove(job.upload_path)
+
+
+def run_pending_jobs() -> int:
+    """Drain the queue on the current thread"""
+    processed = 0
+    try:
+        while True:
+            job = claim_next_job()
+            if job is None:
+                return processed
+            run_job(job)
+            processed += 1
+    finally:
+        close_old_connections()
+
+
+def purge_finished_jobs():
+    """Drop job rows and cleaned files older than the result TTL"""
+    cutoff = timezone.now() - timedelta(seconds=JOB_RESULT_TTL)
+    expired = AnalysisJob.objects.filter(
+        status__in=[AnalysisJob.STATUS_DONE, AnalysisJob.STATUS_FAILED],
+        finished_at__lt=cutoff,
+    )
+    for result_path in expired.exclude(result_path="").values_list("result_path", flat=True):
+        if os.path.exists(result_path):
+            os.remove(result_path)
+    expired.delete()
+
+
+# ================================
+# IN-PROCESS WORKER POOL
+# ================================
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def dispatch_in_process():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="analysis-job")
+    _executor.submit(run_pending_jobs)
+
+
+def _sweep_forever():
+    while True:
+        try:
+            dispatch_in_process()
+            purge_finished_jobs()
+        except Exception:
+            logger.exception("Analysis job sweep failed")
+        finally:
+            close_old_connections()
+        time.sleep(JOB_SWEEP_INTERVAL)
+
+
+_sweeper: Optional[threading.Thread] = None
+
+
+def start_in_process_worker():
+    """
+    Called by the WSGI/ASGI entry points: run whatever a previous process
+    left queued (or leased and died on) now, then sweep every
+    JOB_SWEEP_INTERVAL seconds. Uploads still dispatch immediately.
+    """
+    global _sweeper
+    if not JOBS_IN_PROCESS:
+        return
+    with _executor_lock:
+        if _sweeper is None:
+            _sweeper = threading.Thread(target=_sweep_forever, name="analysis-job-sweep", daemon=True)
+            _sweeper.start()
+
+
+def wait_for_job(job_id, user, timeout: float, poll_interval: float = 0.5) -> Optional[AnalysisJob]:
+    """Long-poll: return once the job is done/failed or the timeout passes"""
+    if not math.isfinite(timeout):
+        timeout = 0
+    deadline = time.monotonic() + timeout
+    while True:
+        job = AnalysisJob.objects.filter(id=job_id, user=user).first()
+        if job is None or job.status in (AnalysisJob.STATUS_DONE, AnalysisJob.STATUS_FAILED):
+            return job
+        if time.monotonic() >= deadline:
+            return job
+        time.sleep(poll_interval)
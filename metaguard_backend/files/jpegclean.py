@@ -0,0 +1,331 @@
+import hashlib
+import struct
+from typing import Iterable, List, Optional, Set, Tuple, Union
+from xml.dom import minidom
+from xml.parsers.expat import ExpatError
+
+from django.conf import settings
+
+from .fastpath import (
+    EXIF_HEADER,
+    EXIF_POINTER,
+    EXIF_TAGS,
+    GPS_POINTER,
+    GPS_TAGS,
+    IFD0_TAGS,
+    INTEROP_POINTER,
+    INTEROP_TAGS,
+    IPTC_TAGS,
+    PHOTOSHOP_HEADER,
+    TYPE_SIZES,
+    XMP_HEADER,
+    Unsupported,
+    upload_buffer,
+)
+from .removal import expand_remove_tags, remove_groups
+
+
+# Clean plain JPEGs by rewriting their metadata segments in Python
+JPEG_NATIVE_CLEAN = getattr(settings, "JPEG_NATIVE_CLEAN", True)
+
+RDF_NS = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+EXTENDED_XMP_HEADER = b"http://ns.adobe.com/xmp/extension/\x00"
+MPF_HEADER = b"MPF\x00"
+
+MAX_SEGMENT_PAYLOAD = 0xFFFF - 2
+
+# Output pieces: new bytes, or a (start, end) range of the original upload
+Piece = Union[bytes, memoryview, Tuple[int, int]]
+
+
+def _names_to_ids(tags) -> dict:
+    return {name.lower(): tag_id for tag_id, (name, _) in tags.items()}
+
+
+IFD_TAG_IDS = {
+    "IFD0": _names_to_ids(IFD0_TAGS),
+    "ExifIFD": _names_to_ids(EXIF_TAGS),
+    "GPS": _names_to_ids(GPS_TAGS),
+    "InteropIFD": _names_to_ids(INTEROP_TAGS),
+}
+IFD_TAG_IDS["IFD1"] = IFD_TAG_IDS["IFD0"]
+
+IPTC_DATASETS = {name.lower(): dataset for dataset, name in IPTC_TAGS.items()}
+
+# Every tag id: a whole IFD goes
+ALL_TAG_IDS = range(0x10000)
+
+# Group deletes this cleaner can do itself
+NATIVE_GROUPS = {"gps"}
+
+
+# ================================
+# EXIF: DROP IFD ENTRIES IN PLACE
+# ================================
+def _strip_ifd(tiff: bytearray, endian: str, offset: int, remove_ids: Set[int]):
+    """
+    Remove entries from one IFD without moving anything else: the entry
+    table is compacted, freed slots and removed values are zeroed.
+    Returns (changed, next IFD offset, {pointer tag: offset}).
+    """
+    if offset + 2 > len(tiff):
+        raise Unsupported("Truncated IFD")
+    (count,) = struct.unpack_from(endian + "H", tiff, offset)
+    table_end = offset + 2 + 12 * count
+    if table_end + 4 > len(tiff):
+        raise Unsupported("Truncated IFD")
+
+    kept, pointers, changed = [], {}, False
+    for i in range(count):
+        entry = offset + 2 + 12 * i
+        tag_id, type_id, n = struct.unpack_from(endian + "HHI", tiff, entry)
+        if tag_id in (EXIF_POINTER, GPS_POINTER, INTEROP_POINTER):
+            pointers[tag_id] = struct.unpack_from(endian + "I", tiff, entry + 8)[0]
+
+        if tag_id not in remove_ids:
+            kept.append(bytes(tiff[entry:entry + 12]))
+            continue
+
+        changed = True
+        size = TYPE_SIZES.get(type_id, 1) * n
+        if size > 4:
+            # The value itself (coordinates, comments) must not survive
+            (value_offset,) = struct.unpack_from(endian + "I", tiff, entry + 8)
+            if value_offset + size > len(tiff):
+                raise Unsupported("Value outside the EXIF block")
+            tiff[value_offset:value_offset + size] = bytes(size)
+
+    (next_ifd,) = struct.unpack_from(endian + "I", tiff, table_end)
+    if changed:
+        struct.pack_into(endian + "H", tiff, offset, len(kept))
+        new_end = offset + 2 + 12 * len(kept)
+        tiff[offset + 2:new_end] = b"".join(kept)
+        struct.pack_into(endian + "I", tiff, new_end, next_ifd)
+        tiff[new_end + 4:table_end + 4] = bytes(table_end - new_end)
+    return changed, next_ifd, pointers
+
+
+def strip_exif(payload: memoryview, remove: Set[str], groups: Set[str] = frozenset()) -> Optional[bytes]:
+    """APP1 Exif payload without the removed tags, or None when nothing changes"""
+    remove_ids = {
+        group: {ids[name] for name in remove if name in ids}
+        for group, ids in IFD_TAG_IDS.items()
+    }
+    if "gps" in groups:
+        # Like -gps:all=: the whole GPS IFD and the pointer to it
+        remove_ids["GPS"] = ALL_TAG_IDS
+        remove_ids["IFD0"].add(GPS_POINTER)
+    if not any(remove_ids.values()):
+        return None
+
+    tiff_bytes = bytearray(payload[len(EXIF_HEADER):])
+    order = bytes(tiff_bytes[:2])
+    if order not in (b"II", b"MM"):
+        raise Unsupported("Bad TIFF byte order")
+    endian = "<" if order == b"II" else ">"
+
+    (ifd0,) = struct.unpack_from(endian + "I", tiff_bytes, 4)
+    changed, next_ifd, pointers = _strip_ifd(tiff_bytes, endian, ifd0, remove_ids["IFD0"])
+
+    if EXIF_POINTER in pointers:
+        exif_changed, _, sub = _strip_ifd(tiff_bytes, endian, pointers[EXIF_POINTER], remove_ids["ExifIFD"])
+        changed |= exif_changed
+        if INTEROP_POINTER in sub:
+            changed |= _strip_ifd(tiff_bytes, endian, sub[INTEROP_POINTER], remove_ids["InteropIFD"])[0]
+    if GPS_POINTER in pointers:
+        changed |= _strip_ifd(tiff_bytes, endian, pointers[GPS_POINTER], remove_ids["GPS"])[0]
+    if next_ifd:
+        changed |= _strip_ifd(tiff_bytes, endian, next_ifd, remove_ids["IFD1"])[0]
+
+    return EXIF_HEADER + bytes(tiff_bytes) if changed else None
+
+
+# ================================
+# XMP: DROP TOP-LEVEL PROPERTIES
+# ================================
+def strip_xmp(payload: memoryview, remove: Set[str]) -> Optional[bytes]:
+    packet = bytes(payload[len(XMP_HEADER):])
+    if b"<!DOCTYPE" in packet or b"<!ENTITY" in packet:
+        raise Unsupported("XMP with a DTD")
+
+    try:
+        doc = minidom.parseString(packet.strip(b"\x00 \r\n\t"))
+    except ExpatError:
+        raise Unsupported("Unparseable XMP")
+
+    changed = False
+    for description in doc.getElementsByTagNameNS(RDF_NS, "Description"):
+        if description.parentNode.namespaceURI != RDF_NS or description.parentNode.localName != "RDF":
+            continue  # inside a structure: not a top-level tag
+
+        for i in reversed(range(description.attributes.length)):
+            attr = description.attributes.item(i)
+            if attr.namespaceURI in (RDF_NS, "http://www.w3.org/2000/xmlns/"):
+                continue
+            if (attr.localName or attr.name).lower() in remove:
+                description.removeAttributeNode(attr)
+                changed = True
+
+        for child in list(description.childNodes):
+            if child.nodeType == child.ELEMENT_NODE and child.localName.lower() in remove:
+                description.removeChild(child)
+                changed = True
+
+    if not changed:
+        doc.unlink()
+        return None
+
+    # Keep the <?xpacket?> wrappers, skip the XML declaration
+    xml = "".join(node.toxml() for node in doc.childNodes).encode("utf-8")
+    doc.unlink()
+    return XMP_HEADER + xml
+
+
+# ================================
+# PHOTOSHOP IRB: DROP IPTC DATASETS
+# ================================
+def _strip_iptc(data: memoryview, remove_datasets: Set[int]) -> Optional[bytes]:
+    out, pos, changed = [], 0, False
+    while pos + 5 <= len(data):
+        if data[pos] != 0x1C:
+            raise Unsupported("Bad IPTC marker")
+        record, dataset = data[pos + 1], data[pos + 2]
+        length = int.from_bytes(data[pos + 3:pos + 5], "big")
+        if length & 0x8000:
+            raise Unsupported("Extended IPTC dataset")
+        end = pos + 5 + length
+        if record == 2 and dataset in remove_datasets:
+            changed = True
+        else:
+            out.append(bytes(data[pos:end]))
+        pos = end
+    return b"".join(out) if changed else None
+
+
+def strip_photoshop(payload: memoryview, remove: Set[str]) -> Optional[bytes]:
+    remove_datasets = {IPTC_DATASETS[name] for name in remove if name in IPTC_DATASETS}
+    if not remove_datasets:
+        return None
+
+    body = payload[len(PHOTOSHOP_HEADER):]
+    resources, new_iptc, pos = [], None, 0
+    while pos + 12 <= len(body):
+        if bytes(body[pos:pos + 4]) != b"8BIM":
+            raise Unsupported("Bad Photoshop resource")
+        start = pos
+        resource_id = int.from_bytes(body[pos + 4:pos + 6], "big")
+        name_len = body[pos + 6]
+        pos += 6 + ((name_len + 2) & ~1)
+        size = int.from_bytes(body[pos:pos + 4], "big")
+        header = bytes(body[start:pos])
+        data = body[pos + 4:pos + 4 + size]
+        pos += 4 + size + (size & 1)
+
+        if resource_id == 0x0404:
+            new_iptc = _strip_iptc(data, remove_datasets)
+            if new_iptc is not None:
+                data = new_iptc
+        resources.append([resource_id, header, data])
+
+    if new_iptc is None:
+        return None
+
+    out = [PHOTOSHOP_HEADER]
+    for resource_id, header, data in resources:
+        if resource_id == 0x0425:
+            # The IPTC digest tracks the IPTC block, as ExifTool keeps it
+            data = hashlib.md5(new_iptc).digest()
+        out.append(header + struct.pack(">I", len(data)) + bytes(data) + (b"\x00" if len(data) & 1 else b""))
+    return b"".join(out)
+
+
+# ================================
+# JPEG: COPY EVERYTHING ELSE AS-IS
+# ================================
+def strip_jpeg(data: memoryview, remove_tags: Iterable[str]) -> List[Piece]:
+    """
+    The cleaned file as pieces: rewritten segments as bytes, everything
+    else (including all the image data) as (start, end) ranges of `data`.
+    """
+    if bytes(data[:3]) != b"\xff\xd8\xff":
+        raise Unsupported("Not a JPEG")
+
+    remove = expand_remove_tags(remove_tags)
+    groups = remove_groups(remove_tags)
+    if groups - NATIVE_GROUPS:
+        raise Unsupported("Group delete")
+    pieces: List[Piece] = []
+    copied_from = 0
+    mpf_seen = False
+
+    pos = 2
+    while True:
+        if pos + 4 > len(data) or data[pos] != 0xFF:
+            raise Unsupported("Bad JPEG marker")
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0xDA or marker == 0xD9:
+            break
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            raise Unsupported("Standalone marker before the scan")
+
+        length = int.from_bytes(data[pos + 2:pos + 4], "big")
+        end = pos + 2 + length
+        if length < 2 or end > len(data):
+            raise Unsupported("Truncated segment")
+        payload = data[pos + 4:end]
+
+        replacement = None
+        if marker == 0xE1 and bytes(payload[:len(EXIF_HEADER)]) == EXIF_HEADER:
+            replacement = strip_exif(payload, remove, groups)
+        elif marker == 0xE1 and bytes(payload[:len(XMP_HEADER)]) == XMP_HEADER:
+            replacement = strip_xmp(payload, remove)
+        elif marker == 0xE1 and bytes(payload[:len(EXTENDED_XMP_HEADER)]) == EXTENDED_XMP_HEADER:
+            raise Unsupported("Extended XMP")
+        elif marker == 0xED and bytes(payload[:len(PHOTOSHOP_HEADER)]) == PHOTOSHOP_HEADER:
+            replacement = strip_photoshop(payload, remove)
+        elif marker == 0xE2 and bytes(payload[:len(MPF_HEADER)]) == MPF_HEADER:
+            mpf_seen = True
+
+        if replacement is not None:
+            if mpf_seen and len(replacement) != len(payload):
+                # MPF image offsets would shift
+                raise Unsupported("Segment resized after MPF")
+            if len(replacement) > MAX_SEGMENT_PAYLOAD:
+                raise Unsupported("Segment too large")
+            if pos > copied_from:
+                pieces.append((copied_from, pos))
+            pieces.append(bytes([0xFF, marker]) + struct.pack(">H", len(replacement) + 2) + replacement)
+            copied_from = end
+        pos = end
+
+    # Scan data, EOI and any trailer go out untouched
+    pieces.append((copied_from, len(data)))
+    return pieces
+
+
+def strip_jpeg_upload(uploaded_file, remove_tags) -> Optional[Tuple[List[Piece], str]]:
+    """
+    ⚡ Clean a JPEG upload without ExifTool: (pieces, sha256 of the result),
+    or None when ExifTool has to do it. In-memory uploads come back as
+    memoryview slices of the upload's own buffer, disk uploads as ranges.
+    """
+    if not JPEG_NATIVE_CLEAN:
+        return None
+
+    with upload_buffer(uploaded_file) as data:
+        try:
+            pieces = strip_jpeg(data, remove_tags)
+        except (Unsupported, struct.error, IndexError, ValueError):
+            return None
+
+        digest = hashlib.sha256()
+        for piece in pieces:
+            digest.update(data[piece[0]:piece[1]] if isinstance(piece, tuple) else piece)
+
+        if not hasattr(uploaded_file, "temporary_file_path"):
+            pieces = [data[p[0]:p[1]] if isinstance(p, tuple) else p for p in pieces]
+
+    return pieces, digest.hexdigest()
@@ -0,0 +1,73 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from files.benchmarks import (
+    BENCHMARK_BASELINE_PATH,
+    BENCHMARK_TOLERANCE,
+    BaselineMismatch,
+    compare_to_baseline,
+    load_baseline,
+    run_benchmarks,
+    save_baseline,
+)
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark metadata scoring, analyze and clean against a synthetic corpus (no ExifTool needed)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--calls", type=int, default=200, help="Timed calls per benchmark")
+        parser.add_argument("--only", help="Run benchmarks whose name contains this")
+        parser.add_argument("--baseline", default=BENCHMARK_BASELINE_PATH, help="Local results file (not committed)")
+        parser.add_argument("--save-baseline", action="store_true", help="Store these results as this machine's baseline")
+        parser.add_argument("--tolerance", type=float, default=BENCHMARK_TOLERANCE)
+        parser.add_argument("--fail-on-regression", action="store_true")
+        parser.add_argument("--json", action="store_true", help="Print results and comparison as JSON")
+
+    def handle(self, *args, **options):
+        results = run_benchmarks(calls=options["calls"], only=options["only"])
+        if not results:
+            raise CommandError("No benchmark matches --only")
+
+        try:
+            baseline = load_baseline(options["baseline"])
+        except BaselineMismatch as e:
+            # Another machine's latencies: comparing would only report noise
+            self.stderr.write(f"{e}; not comparing. Run with --save-baseline on this machine first.")
+            baseline = {}
+        else:
+            if not baseline and not options["save_baseline"]:
+                self.stderr.write(f"No baseline at {options['baseline']}: run with --save-baseline to record one")
+
+        rows = compare_to_baseline(results, baseline, options["tolerance"])
+
+        if options["json"]:
+            self.stdout.write(json.dumps([
+                {**r.to_dict(), **row} for r, row in zip(results, rows)
+            ], indent=2))
+        else:
+            self.stdout.write(
+                f"{'benchmark':48} {'ops/s':>10} {'p50 us':>9} {'p95 us':>9} {'p99 us':>9} "
+                f"{'peak KB':>9} {'kept B':>8} {'speed':>7} {'alloc':>7}"
+            )
+            for r, row in zip(results, rows):
+                speed = f"{row['speed']:.2f}x" if row["speed"] is not None else "-"
+                alloc = f"{row['alloc']:.2f}x" if row["alloc"] is not None else "-"
+                line = (
+                    f"{r.name:48} {r.ops_per_sec:10.0f} {r.p50_us:9.1f} {r.p95_us:9.1f} {r.p99_us:9.1f} "
+                    f"{r.alloc_peak_kb:9.1f} {r.alloc_retained_b:8.0f} {speed:>7} {alloc:>7}"
+                )
+                self.stdout.write(self.style.ERROR(line) if row["regressed"] else line)
+
+        if options["save_baseline"]:
+            save_baseline(results, options["baseline"])
+            self.stdout.write(f"Baseline saved to {options['baseline']}")
+            return
+
+        regressed = [row["name"] for row in rows if row["regressed"]]
+        if regressed:
+            message = f"{len(regressed)} benchmark(s) regressed beyond {options['tolerance']:.0%}: {', '.join(regressed)}"
+            if options["fail_on_regression"]:
+                raise CommandError(message)
+            self.stderr.write(message)
@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from files.retention import (
+    RETENTION_BATCH_SIZE,
+    RETENTION_PAUSE_SECONDS,
+    apply_retention,
+    database_file_bytes,
+    database_free_bytes,
+    delete_user_data,
+    vacuum_database,
+)
+
+
+def _mb(size) -> str:
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+class Command(BaseCommand):
+    help = "Delete analyses past each user's retention policy (or all of one user's) in small batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, help="Only apply retention to this user id")
+        parser.add_argument("--delete-user", type=int, metavar="USER_ID",
+                            help="Delete all of this user's analyses, then the account")
+        parser.add_argument("--batch-size", type=int, default=RETENTION_BATCH_SIZE)
+        parser.add_argument("--pause", type=float, default=RETENTION_PAUSE_SECONDS,
+                            help="Seconds to sleep between batches")
+        parser.add_argument("--dry-run", action="store_true", help="Count what would be deleted")
+        parser.add_argument("--vacuum", action="store_true", help="Shrink the SQLite file afterwards")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1")
+        if options["delete_user"] is not None and (options["user"] is not None or options["dry_run"]):
+            raise CommandError("--delete-user can't be combined with --user or --dry-run")
+
+        free_before = database_free_bytes()
+
+        if options["delete_user"] is not None:
+            report = delete_user_data(
+                options["delete_user"], options["batch_size"], options["pause"], delete_account=True,
+            )
+            self.stdout.write(f"Deleted user {options['delete_user']}")
+        else:
+            report = apply_retention(
+                user_id=options["user"],
+                batch_size=options["batch_size"],
+                pause=options["pause"],
+                dry_run=options["dry_run"],
+            )
+            self.stdout.write(f"Users affected: {report['users']}")
+
+        verb = "Would delete" if options["dry_run"] else "Deleted"
+        self.stdout.write(
+            f"{verb} {report['analyses']} analyses, {report['metadata_fields']} metadata rows "
+            f"and {report['jobs']} job rows"
+        )
+        if not options["dry_run"]:
+            self.stdout.write(
+                f"Metadata values removed: {_mb(report['value_bytes'])} "
+                f"(from {_mb(report['upload_bytes'])} of uploads)"
+            )
+
+        if options["dry_run"] or free_before is None:
+            return
+
+        self.stdout.write(f"Freed database pages: {_mb(database_free_bytes() - free_before)}")
+        if options["vacuum"]:
+            size_before = database_file_bytes()
+            vacuum_database()
+            self.stdout.write(f"Database file: {_mb(size_before)} -> {_mb(database_file_bytes())}")
@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from files.rescore import (
+    RESCORE_CHUNK_SIZE,
+    RESCORE_STATE_FILE,
+    RESCORE_WORKERS,
+    clear_state,
+    load_state,
+    rescore_analyses,
+    scoring_fingerprint,
+)
+
+
+class Command(BaseCommand):
+    help = "Re-score stored analyses from their metadata after the scoring heuristics change"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=RESCORE_CHUNK_SIZE)
+        parser.add_argument("--workers", type=int, default=RESCORE_WORKERS, help="Scoring processes (1 = inline)")
+        parser.add_argument("--user", type=int, help="Only this user id's analyses")
+        parser.add_argument("--after-id", type=int, default=0, help="Start after this FileAnalysis id")
+        parser.add_argument("--resume", action="store_true", help="Continue from the last committed chunk")
+        parser.add_argument("--state-file", default=RESCORE_STATE_FILE)
+        parser.add_argument("--dry-run", action="store_true", help="Show what would change, write nothing")
+        parser.add_argument("--show", type=int, default=20, help="Changed analyses to list in a dry run")
+
+    def handle(self, *args, **options):
+        after_id = options["after_id"]
+        if options["resume"]:
+            state = load_state(options["state_file"])
+            if state is None:
+                raise CommandError(f"No saved state in {options['state_file']}")
+            if state["scoring"] != scoring_fingerprint():
+                raise CommandError("Scoring rules changed since the saved run: start over without --resume")
+            after_id = state["last_id"]
+            self.stdout.write(f"Resuming after analysis {after_id}")
+
+        shown = 0
+
+        def on_chunk(last_id, changed):
+            nonlocal shown
+            if options["dry_run"]:
+                for result in changed:
+                    if shown >= options["show"]:
+                        break
+                    shown += 1
+                    self.stdout.write(
+                        f"  #{result.id}: {result.old_risk} -> {result.new_risk} "
+                        f"({result.old_score} -> {result.new_score}), {len(result.fields)} field(s)"
+                    )
+            if options["verbosity"] > 1:
+                self.stdout.write(f"Up to analysis {last_id}: {len(changed)} changed")
+
+        report = rescore_analyses(
+            after_id=after_id,
+            chunk_size=options["chunk_size"],
+            workers=options["workers"],
+            dry_run=options["dry_run"],
+            user_id=options["user"],
+            state_path=options["state_file"],
+            on_chunk=on_chunk,
+        )
+
+        verb = "Would change" if options["dry_run"] else "Changed"
+        self.stdout.write(
+            f"Scanned {report['scanned']} analyses. {verb} {report['analyses_changed']} analyses "
+            f"and {report['fields_changed']} fields."
+        )
+        for (old, new), count in sorted(report["transitions"].items()):
+            self.stdout.write(f"  {old} -> {new}: {count}")
+
+        if not options["dry_run"]:
+            # The run reached the end: nothing left to resume
+            clear_state(options["state_file"])
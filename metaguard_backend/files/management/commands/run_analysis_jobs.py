@@ -0,0 +1,31 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from files.jobs import JOB_WORKERS, purge_finished_jobs, run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued async analyze/clean jobs on a local worker pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=JOB_WORKERS)
+        parser.add_argument("--poll-interval", type=float, default=1.0)
+        parser.add_argument("--once", action="store_true", help="Drain the queue and exit")
+
+    def handle(self, *args, **options):
+        workers = options["workers"]
+        self.stdout.write(f"Processing analysis jobs with {workers} worker(s)")
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analysis-job") as pool:
+            while True:
+                processed = sum(pool.map(lambda _: run_pending_jobs(), range(workers)))
+                if processed:
+                    self.stdout.write(f"Finished {processed} job(s)")
+
+                if options["once"]:
+                    break
+
+                purge_finished_jobs()
+                time.sleep(options["poll_interval"])
@@ -0,0 +1,284 @@
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+
+# Stage timings, Server-Timing headers and the metrics endpoint
+METRICS_ENABLED = getattr(settings, "METRICS_ENABLED", True)
+
+# Send a Server-Timing header on API responses
+SERVER_TIMING_HEADER = getattr(settings, "SERVER_TIMING_HEADER", True)
+
+# When set, /metrics/ needs "Authorization: Bearer <token>"
+METRICS_TOKEN = getattr(settings, "METRICS_TOKEN", None)
+
+# Seconds: 1 ms .. 60 s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TAG_COUNT_BUCKETS = (0, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+# ================================
+# METRIC TYPES (PROMETHEUS TEXT FORMAT)
+# ================================
+class Counter:
+    """Monotonic counter per label set"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *label_values):
+        key = tuple(str(v) for v in label_values)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            yield self.name, key, value
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram per label set. observe() is a bisect and three
+    additions under a lock, cheap enough for every request.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (+Inf last), sum]
+        self.values: Dict[Tuple[str, ...], list] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        key = tuple(str(v) for v in label_values)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self.lock:
+            items = sorted((k, (list(v[0]), v[1])) for k, v in self.values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", key + (("+Inf" if bound == float("inf") else _format(bound)),), cumulative
+            yield f"{self.name}_sum", key, total
+            yield f"{self.name}_count", key, cumulative
+
+
+def _format(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# ================================
+# REGISTRY
+# ================================
+STAGE_SECONDS = Histogram(
+    "metaguard_stage_seconds", "Time spent in each request stage", ["stage"],
+)
+REQUEST_SECONDS = Histogram(
+    "metaguard_request_seconds", "Total time per API request", ["endpoint", "status"],
+)
+EXIFTOOL_RUNS = Counter(
+    "metaguard_exiftool_runs_total", "ExifTool invocations by exit code", ["exit_code"],
+)
+BYTES_PROCESSED = Counter(
+    "metaguard_bytes_processed_total", "Upload bytes analyzed or cleaned", ["operation"],
+)
+TAG_COUNT = Histogram(
+    "metaguard_tag_count", "Metadata fields found per analyzed file", buckets=TAG_COUNT_BUCKETS,
+)
+
+CLEANED_ARTIFACTS = Counter(
+    "metaguard_cleaned_artifacts_total", "Cleans stored, streamed without storing, or answered from a kept cleaned file", ["result"],
+)
+
+REGISTRY = [STAGE_SECONDS, REQUEST_SECONDS, EXIFTOOL_RUNS, BYTES_PROCESSED, TAG_COUNT, CLEANED_ARTIFACTS]
+
+
+def render_metrics() -> str:
+    """
+    Everything in the registry in Prometheus text format (version 0.0.4).
+    Values are per process: each worker is its own scrape target.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        names = metric.labels + (("le",) if metric.kind == "histogram" else ())
+        for sample, key, value in metric.samples():
+            labels = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, key))
+            lines.append(f"{sample}{{{labels}}} {_format(value)}" if labels else f"{sample} {_format(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# ================================
+# PER-REQUEST STAGE TIMINGS
+# ================================
+# (stage, seconds) in the order they finished, for the request being served
+_request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+
+
+class StageTimer:
+    """
+    ⏱️ Time one step of a request: goes into the stage histogram and the
+    request's Server-Timing header. Nested stages are all reported.
+    Works as a context manager and as a decorator (sync or async functions).
+    """
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if not METRICS_ENABLED:
+            return False
+        elapsed = time.perf_counter() - self.start
+        STAGE_SECONDS.observe(elapsed, self.name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((self.name, elapsed))
+        return False
+
+    def __call__(self, func):
+        name = self.name
+
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with StageTimer(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with StageTimer(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def stage(name: str) -> StageTimer:
+    return StageTimer(name)
+
+
+def record_exiftool(exit_code: int):
+    if METRICS_ENABLED:
+        EXIFTOOL_RUNS.inc(1, exit_code)
+
+
+def record_bytes(operation: str, size: int):
+    if METRICS_ENABLED:
+        BYTES_PROCESSED.inc(size, operation)
+
+
+def record_tag_count(count: int):
+    if METRICS_ENABLED:
+        TAG_COUNT.observe(count)
+
+
+def record_artifact(result: str):
+    if METRICS_ENABLED:
+        CLEANED_ARTIFACTS.inc(1, result)
+
+
+def server_timing_value(timings: List[Tuple[str, float]], total: float) -> str:
+    """'extract;dur=12.3, score;dur=0.8, total;dur=15.1' (milliseconds)"""
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+# ================================
+# MIDDLEWARE
+# ================================
+class ServerTimingMiddleware:
+    """
+    🩺 Collects the stage timings of each /api/ request, adds them as a
+    Server-Timing header and records the request duration per endpoint.
+    Works under WSGI and ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not self.applies(request):
+            return self.get_response(request)
+
+        token = _request_timings.set([])
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+            self.finish(request, response, start)
+            return response
+        finally:
+            _request_timings.reset(token)
+
+    async def __acall__(self, request):
+        if not self.applies(request):
+            return await self.get_response(request)
+
+        token = _request_timings.set([])
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+            self.finish(request, response, start)
+            return response
+        finally:
+            _request_timings.reset(token)
+
+    @staticmethod
+    def applies(request) -> bool:
+        return METRICS_ENABLED and request.path.startswith("/api/")
+
+    @staticmethod
+    def finish(request, response, start):
+        total = time.perf_counter() - start
+        match = getattr(request, "resolver_match", None)
+        endpoint = (match.url_name or match.route) if match else "unmatched"
+        REQUEST_SECONDS.observe(total, endpoint, response.status_code)
+
+        if SERVER_TIMING_HEADER:
+            response["Server-Timing"] = server_timing_value(_request_timings.get() or [], total)
@@ -0,0 +1,107 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# files.services.calculate_overall_risk as it was when this migration was
+# written: kept here so later scoring changes can't alter the backfill
+# (manage.py rescore_analyses applies those)
+def calculate_overall_risk(metadata):
+    if not metadata:
+        return 'Low', 0.0, {'High': 0, 'Medium': 0, 'Low': 0}
+
+    total_score = 0.0
+    risk_counts = {'High': 0, 'Medium': 0, 'Low': 0}
+
+    for item in metadata:
+        risk_counts[item['risk']] += 1
+        total_score += item['risk_score']
+
+    if risk_counts['High'] >= 3:
+        total_score *= 1.5
+    elif risk_counts['High'] >= 2:
+        total_score *= 1.3
+    elif risk_counts['High'] == 1:
+        total_score *= 1.1
+
+    if risk_counts['Medium'] >= 5:
+        total_score *= 1.2
+
+    if total_score >= 25:
+        return 'High', round(total_score, 2), risk_counts
+    elif total_score >= 10:
+        return 'Medium', round(total_score, 2), risk_counts
+    else:
+        return 'Low', round(total_score, 2), risk_counts
+
+
+def backfill_scores_and_stats(apps, schema_editor):
+    """Scores from the stored metadata, then one stats row per user"""
+    FileAnalysis = apps.get_model('files', 'FileAnalysis')
+    UserRiskStats = apps.get_model('files', 'UserRiskStats')
+
+    stats = {}
+    batch = []
+    for analysis in FileAnalysis.objects.only(
+        'id', 'user_id', 'metadata_raw', 'risk_level', 'file_size', 'cleaned_at'
+    ).iterator(chunk_size=500):
+        metadata = analysis.metadata_raw if isinstance(analysis.metadata_raw, list) else []
+        scored = [m for m in metadata if isinstance(m, dict) and 'risk' in m and 'risk_score' in m]
+        _, analysis.total_risk_score, analysis.risk_counts = calculate_overall_risk(scored)
+        batch.append(analysis)
+        if len(batch) >= 500:
+            FileAnalysis.objects.bulk_update(batch, ['total_risk_score', 'risk_counts'])
+            batch = []
+
+        row = stats.setdefault(analysis.user_id, UserRiskStats(user_id=analysis.user_id))
+        row.files_scanned += 1
+        row.files_cleaned += analysis.cleaned_at is not None
+        row.high_risk_files += analysis.risk_level == 'High'
+        row.medium_risk_files += analysis.risk_level == 'Medium'
+        row.low_risk_files += analysis.risk_level == 'Low'
+        row.total_risk_score += analysis.total_risk_score
+        row.fields_found += len(metadata)
+        row.bytes_scanned += analysis.file_size
+
+    if batch:
+        FileAnalysis.objects.bulk_update(batch, ['total_risk_score', 'risk_counts'])
+    UserRiskStats.objects.bulk_create(stats.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('files', '0003_analysisjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserRiskStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='risk_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('files_scanned', models.PositiveIntegerField(default=0)),
+                ('files_cleaned', models.PositiveIntegerField(default=0)),
+                ('high_risk_files', models.PositiveIntegerField(default=0)),
+                ('medium_risk_files', models.PositiveIntegerField(default=0)),
+                ('low_risk_files', models.PositiveIntegerField(default=0)),
+                ('total_risk_score', models.FloatField(default=0.0)),
+                ('fields_found', models.PositiveBigIntegerField(default=0)),
+                ('bytes_scanned', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='fileanalysis',
+            name='risk_counts',
+            field=models.JSONField(blank=True, default=dict, help_text='Fields per risk level, e.g. {"High": 2, ...}'),
+        ),
+        migrations.AddField(
+            model_name='fileanalysis',
+            name='total_risk_score',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.RunPython(backfill_scores_and_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,220 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# metadata_raw labels -> MetadataField integer codes
+FIELD_CATEGORY_CODES = {'Technical': 0, 'Location': 1, 'Personal': 2, 'Device': 3, 'Time': 4, 'Network': 5}
+RISK_LEVEL_CODES = {'Low': 0, 'Medium': 1, 'High': 2}
+
+# Old MetadataField.category values, only used for rows with no metadata_raw
+OLD_CATEGORY_CODES = {'location': 1, 'personal': 2, 'device': 3}
+CATEGORY_OLD_VALUES = {1: 'location', 2: 'personal', 3: 'device'}
+
+# Categories a clean marked removed before policies existed
+CLEANED_CATEGORIES = {1, 2, 3}
+
+
+def move_metadata_into_fields(apps, schema_editor):
+    """
+    metadata_raw is the source of truth: rows written before it was split
+    out never had their tag or risk saved (the old view read keys the
+    metadata dicts don't have). Rows are matched to the JSON by position
+    when the counts agree, otherwise rebuilt from it. Only analyses with
+    no metadata_raw keep what their rows had.
+    """
+    FileAnalysis = apps.get_model('files', 'FileAnalysis')
+    MetadataField = apps.get_model('files', 'MetadataField')
+    MetadataTag = apps.get_model('files', 'MetadataTag')
+
+    tag_ids = {}
+
+    def tag_id(name):
+        name = str(name or '')[:255]
+        if name not in tag_ids:
+            tag_ids[name] = MetadataTag.objects.get_or_create(name=name)[0].id
+        return tag_ids[name]
+
+    for analysis in FileAnalysis.objects.only('id', 'metadata_raw', 'cleaned_at').iterator(chunk_size=200):
+        metadata = analysis.metadata_raw if isinstance(analysis.metadata_raw, list) else []
+        metadata = [m for m in metadata if isinstance(m, dict)]
+        rows = list(MetadataField.objects.filter(analysis_id=analysis.id).order_by('id'))
+
+        if not metadata:
+            for row in rows:
+                row.tag_ref_id = tag_id(row.tag)
+                row.category_code = OLD_CATEGORY_CODES.get(row.category, 0)
+                row.risk = RISK_LEVEL_CODES.get(row.risk_level, 0)
+                row.risk_score = 0.0
+                row.will_be_removed = row.removed
+            MetadataField.objects.bulk_update(
+                rows, ['tag_ref', 'category_code', 'risk', 'risk_score', 'will_be_removed'], batch_size=500,
+            )
+            continue
+
+        if len(rows) != len(metadata):
+            MetadataField.objects.filter(analysis_id=analysis.id).delete()
+            rows = [MetadataField(analysis_id=analysis.id, removed=False) for _ in metadata]
+
+        for row, m in zip(rows, metadata):
+            row.tag = str(m.get('field') or row.tag or '')[:255]
+            row.tag_ref_id = tag_id(row.tag)
+            value = m.get('value')
+            row.value = '' if value is None else str(value)
+            row.category_code = FIELD_CATEGORY_CODES.get(m.get('category'), 0)
+            row.risk = RISK_LEVEL_CODES.get(m.get('risk'), 0)
+            row.risk_score = float(m.get('risk_score') or 0.0)
+            row.will_be_removed = bool(m.get('will_be_removed'))
+            row.removed = row.removed or (analysis.cleaned_at is not None and row.category_code in CLEANED_CATEGORIES)
+            # Old columns are still NOT NULL until they are dropped below
+            row.category = CATEGORY_OLD_VALUES.get(row.category_code, 'other')
+            row.risk_level = m.get('risk') if m.get('risk') in RISK_LEVEL_CODES else 'Low'
+
+        if rows and rows[0].pk is None:
+            MetadataField.objects.bulk_create(rows, batch_size=500)
+        else:
+            MetadataField.objects.bulk_update(rows, [
+                'tag', 'tag_ref', 'value', 'category', 'risk_level', 'category_code', 'risk', 'risk_score',
+                'will_be_removed', 'removed',
+            ], batch_size=500)
+
+
+def move_fields_into_metadata(apps, schema_editor):
+    """Reverse: rebuild metadata_raw and the old text columns from the rows"""
+    FileAnalysis = apps.get_model('files', 'FileAnalysis')
+    MetadataField = apps.get_model('files', 'MetadataField')
+
+    category_labels = {code: label for label, code in FIELD_CATEGORY_CODES.items()}
+    risk_labels = {code: label for label, code in RISK_LEVEL_CODES.items()}
+
+    for analysis in FileAnalysis.objects.only('id').iterator(chunk_size=200):
+        rows = list(MetadataField.objects.filter(analysis_id=analysis.id).select_related('tag_ref').order_by('id'))
+        analysis.metadata_raw = []
+        for row in rows:
+            row.tag = row.tag_ref.name
+            row.category = CATEGORY_OLD_VALUES.get(row.category_code, 'other')
+            row.risk_level = risk_labels.get(row.risk, 'Low')
+            analysis.metadata_raw.append({
+                'field': row.tag,
+                'value': row.value,
+                'risk': row.risk_level,
+                'category': category_labels.get(row.category_code, 'Technical'),
+                'risk_score': row.risk_score,
+                'will_be_removed': row.will_be_removed,
+            })
+        MetadataField.objects.bulk_update(rows, ['tag', 'category', 'risk_level'], batch_size=500)
+        FileAnalysis.objects.filter(id=analysis.id).update(metadata_raw=analysis.metadata_raw)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0004_risk_scores_and_user_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetadataTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='metadatafield',
+            name='tag_ref',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='files.metadatatag'),
+        ),
+        migrations.AddField(
+            model_name='metadatafield',
+            name='category_code',
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='metadatafield',
+            name='risk',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Low'), (1, 'Medium'), (2, 'High')], null=True),
+        ),
+        migrations.AddField(
+            model_name='metadatafield',
+            name='risk_score',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='metadatafield',
+            name='will_be_removed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(move_metadata_into_fields, move_fields_into_metadata),
+        migrations.RemoveIndex(
+            model_name='metadatafield',
+            name='files_metad_analysi_efb07a_idx',
+        ),
+        # A default lets the reverse re-add the old columns to existing rows
+        migrations.AlterField(
+            model_name='metadatafield',
+            name='tag',
+            field=models.CharField(max_length=255, default=''),
+        ),
+        migrations.AlterField(
+            model_name='metadatafield',
+            name='category',
+            field=models.CharField(max_length=50, default='other'),
+        ),
+        migrations.AlterField(
+            model_name='metadatafield',
+            name='risk_level',
+            field=models.CharField(max_length=10, default='Low'),
+        ),
+        migrations.RemoveField(
+            model_name='metadatafield',
+            name='tag',
+        ),
+        migrations.RemoveField(
+            model_name='metadatafield',
+            name='category',
+        ),
+        migrations.RemoveField(
+            model_name='metadatafield',
+            name='risk_level',
+        ),
+        migrations.RemoveField(
+            model_name='fileanalysis',
+            name='metadata_raw',
+        ),
+        migrations.RenameField(
+            model_name='metadatafield',
+            old_name='tag_ref',
+            new_name='tag',
+        ),
+        migrations.RenameField(
+            model_name='metadatafield',
+            old_name='category_code',
+            new_name='category',
+        ),
+        migrations.AlterField(
+            model_name='metadatafield',
+            name='tag',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='files.metadatatag'),
+        ),
+        migrations.AlterField(
+            model_name='metadatafield',
+            name='category',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Technical'), (1, 'Location'), (2, 'Personal'), (3, 'Device'), (4, 'Time'), (5, 'Network')]),
+        ),
+        migrations.AlterField(
+            model_name='metadatafield',
+            name='risk',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Low'), (1, 'Medium'), (2, 'High')]),
+        ),
+        migrations.AlterField(
+            model_name='metadatafield',
+            name='risk_score',
+            field=models.FloatField(),
+        ),
+        migrations.AddIndex(
+            model_name='metadatafield',
+            index=models.Index(fields=['analysis', 'category'], name='files_metad_analysi_efb07a_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0005_compact_metadata_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usermetadatapolicy',
+            name='retention_days',
+            field=models.PositiveIntegerField(blank=True, help_text='Delete analyses older than this many days', null=True),
+        ),
+        migrations.AddField(
+            model_name='usermetadatapolicy',
+            name='retention_max_files',
+            field=models.PositiveIntegerField(blank=True, help_text='Keep only this many of the newest analyses', null=True),
+        ),
+    ]
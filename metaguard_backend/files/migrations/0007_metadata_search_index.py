@@ -0,0 +1,92 @@
+from django.db import migrations
+
+
+# The index as it was when this migration was written. Kept here rather
+# than imported from files.search, so later changes there can't alter it.
+SEARCH_INDEX_SQL = [
+    """
+    CREATE VIEW files_metadata_search_content AS
+    SELECT f.id AS id, t.name AS tag, f.value AS value, 'u' || a.user_id AS owner
+    FROM files_metadatafield f
+    JOIN files_metadatatag t ON t.id = f.tag_id
+    JOIN files_fileanalysis a ON a.id = f.analysis_id
+    """,
+    """
+    CREATE VIRTUAL TABLE files_metadata_search USING fts5(
+        tag, value, owner,
+        content='files_metadata_search_content', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER files_metadata_search_insert AFTER INSERT ON files_metadatafield BEGIN
+        INSERT INTO files_metadata_search(rowid, tag, value, owner) VALUES (
+            new.id,
+            (SELECT name FROM files_metadatatag WHERE id = new.tag_id),
+            new.value,
+            (SELECT 'u' || user_id FROM files_fileanalysis WHERE id = new.analysis_id)
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER files_metadata_search_delete AFTER DELETE ON files_metadatafield BEGIN
+        INSERT INTO files_metadata_search(files_metadata_search, rowid, tag, value, owner) VALUES (
+            'delete', old.id,
+            (SELECT name FROM files_metadatatag WHERE id = old.tag_id),
+            old.value,
+            (SELECT 'u' || user_id FROM files_fileanalysis WHERE id = old.analysis_id)
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER files_metadata_search_update AFTER UPDATE OF tag_id, value ON files_metadatafield BEGIN
+        INSERT INTO files_metadata_search(files_metadata_search, rowid, tag, value, owner) VALUES (
+            'delete', old.id,
+            (SELECT name FROM files_metadatatag WHERE id = old.tag_id),
+            old.value,
+            (SELECT 'u' || user_id FROM files_fileanalysis WHERE id = old.analysis_id)
+        );
+        INSERT INTO files_metadata_search(rowid, tag, value, owner) VALUES (
+            new.id,
+            (SELECT name FROM files_metadatatag WHERE id = new.tag_id),
+            new.value,
+            (SELECT 'u' || user_id FROM files_fileanalysis WHERE id = new.analysis_id)
+        );
+    END
+    """,
+    # Index the rows that already exist
+    "INSERT INTO files_metadata_search(files_metadata_search) VALUES ('rebuild')",
+]
+
+DROP_SEARCH_INDEX_SQL = [
+    "DROP TRIGGER IF EXISTS files_metadata_search_update",
+    "DROP TRIGGER IF EXISTS files_metadata_search_delete",
+    "DROP TRIGGER IF EXISTS files_metadata_search_insert",
+    "DROP TABLE IF EXISTS files_metadata_search",
+    "DROP VIEW IF EXISTS files_metadata_search_content",
+]
+
+
+def run_on_sqlite(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        with schema_editor.connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0006_policy_retention'),
+    ]
+
+    operations = [
+        # SQLite FTS5 index over MetadataField tag/value (no-op on other databases)
+        migrations.RunPython(
+            run_on_sqlite(DROP_SEARCH_INDEX_SQL + SEARCH_INDEX_SQL),
+            run_on_sqlite(DROP_SEARCH_INDEX_SQL),
+        ),
+    ]
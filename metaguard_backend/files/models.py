@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth import get_user_model
 
@@ -20,8 +22,7 @@ class FileAnalysis(models.Model):
     sha256_before = models.CharField(max_length=64)
     sha256_after = models.CharField(max_length=64, null=True, blank=True)
 
-    # 📊 METADATA STORAGE - Complete metadata snapshot stored as JSON
-    metadata_raw = models.JSONField(null=True, blank=True, default=dict, help_text="All extracted metadata before cleaning")
+    # 📊 METADATA STORAGE - One MetadataField row per tag (see metadata_raw)
     metadata_removed = models.JSONField(null=True, blank=True, default=dict, help_text="Metadata fields that were removed")
 
     risk_level = models.CharField(
@@ -29,6 +30,10 @@ class FileAnalysis(models.Model):
         choices=[("Low","Low"),("Medium","Medium"),("High","High")]
     )
 
+    # 📈 SCORES - Stored with the analysis so nothing has to re-score it
+    total_risk_score = models.FloatField(default=0.0)
+    risk_counts = models.JSONField(default=dict, blank=True, help_text="Fields per risk level, e.g. {\"High\": 2, ...}")
+
     # ⏰ TIMESTAMPS - Complete audit trail for this logged-in user
     scanned_at = models.DateTimeField(auto_now_add=True, help_text="When the file was scanned")
     cleaned_at = models.DateTimeField(null=True, blank=True, help_text="When the file was cleaned")
@@ -41,33 +46,69 @@ class FileAnalysis(models.Model):
             models.Index(fields=['user', '-scanned_at']),
         ]
 
+    @property
+    def metadata_raw(self):
+        """
+        All extracted metadata before cleaning, in the analyze response format.
+        Built from the field rows: prefetch them with history.with_metadata_fields().
+        """
+        return [field.as_metadata() for field in self.metadata_fields.all()]
+
+
+class MetadataTag(models.Model):
+    """
+    🏷️ INTERNED TAG NAMES - Each ExifTool tag/group name is stored once
+    """
+    name = models.CharField(max_length=255, unique=True)
+
+    def __str__(self):
+        return self.name
+
+
+class FieldCategory(models.IntegerChoices):
+    """Scoring categories from calculate_field_risk()"""
+    TECHNICAL = 0, "Technical"
+    LOCATION = 1, "Location"
+    PERSONAL = 2, "Personal"
+    DEVICE = 3, "Device"
+    TIME = 4, "Time"
+    NETWORK = 5, "Network"
+
+
+class RiskLevel(models.IntegerChoices):
+    LOW = 0, "Low"
+    MEDIUM = 1, "Medium"
+    HIGH = 2, "High"
+
+
+# Policy/API category names ("location", ...) -> scoring categories
+POLICY_FIELD_CATEGORIES = {
+    "location": [FieldCategory.LOCATION],
+    "personal": [FieldCategory.PERSONAL],
+    "device": [FieldCategory.DEVICE],
+    "software": [],
+}
+
 
 class MetadataField(models.Model):
+    """
+    One extracted tag of an analysis. The only place its value is stored:
+    FileAnalysis.metadata_raw and the history API are built from these rows.
+    """
     analysis = models.ForeignKey(
         FileAnalysis,
         on_delete=models.CASCADE,
         related_name="metadata_fields"
     )
 
-    tag = models.CharField(max_length=255)
+    tag = models.ForeignKey(MetadataTag, on_delete=models.PROTECT, related_name="+")
     value = models.TextField()
 
-    category = models.CharField(
-        max_length=50,
-        choices=[
-            ("location","Location"),
-            ("personal","Personal"),
-            ("device","Device"),
-            ("software","Software"),
-            ("other","Other"),
-        ]
-    )
-
-    risk_level = models.CharField(
-        max_length=10,
-        choices=[("Low","Low"),("Medium","Medium"),("High","High")]
-    )
+    category = models.PositiveSmallIntegerField(choices=FieldCategory.choices)
+    risk = models.PositiveSmallIntegerField(choices=RiskLevel.choices)
+    risk_score = models.FloatField()
 
+    will_be_removed = models.BooleanField(default=False)
     removed = models.BooleanField(default=False)
     
     class Meta:
@@ -76,6 +117,29 @@ class MetadataField(models.Model):
             models.Index(fields=['analysis', 'category']),
         ]
 
+    @property
+    def risk_level(self) -> str:
+        return RiskLevel(self.risk).label
+
+    @property
+    def category_name(self) -> str:
+        """Category as the history API reports it: location/personal/device/other"""
+        for name, codes in POLICY_FIELD_CATEGORIES.items():
+            if self.category in codes:
+                return name
+        return "other"
+
+    def as_metadata(self) -> dict:
+        """The field as analyze returned it (one item of `metadata`)"""
+        return {
+            "field": self.tag.name,
+            "value": self.value,
+            "risk": self.risk_level,
+            "category": FieldCategory(self.category).label,
+            "risk_score": self.risk_score,
+            "will_be_removed": self.will_be_removed,
+        }
+
 
 class UserMetadataPolicy(models.Model):
     """
@@ -93,9 +157,117 @@ class UserMetadataPolicy(models.Model):
     remove_software = models.BooleanField(default=False)
     remove_personal = models.BooleanField(default=True)
 
+    # 🗑️ Retention (empty = site default, 0 = keep forever)
+    retention_days = models.PositiveIntegerField(
+        null=True, blank=True, help_text="Delete analyses older than this many days"
+    )
+    retention_max_files = models.PositiveIntegerField(
+        null=True, blank=True, help_text="Keep only this many of the newest analyses"
+    )
+
     # Policy metadata
     created_at = models.DateTimeField(auto_now_add=True, null=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Policy for {self.user.email}"
+
+
+class UserRiskStats(models.Model):
+    """
+    📊 DASHBOARD COUNTERS - One row per user, kept up to date in the same
+    transaction as every analyze/clean so reading them is a single lookup
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="risk_stats"
+    )
+
+    files_scanned = models.PositiveIntegerField(default=0)
+    files_cleaned = models.PositiveIntegerField(default=0)
+
+    # Files per overall risk level
+    high_risk_files = models.PositiveIntegerField(default=0)
+    medium_risk_files = models.PositiveIntegerField(default=0)
+    low_risk_files = models.PositiveIntegerField(default=0)
+
+    # Sums over all files
+    total_risk_score = models.FloatField(default=0.0)
+    fields_found = models.PositiveBigIntegerField(default=0)
+    bytes_scanned = models.PositiveBigIntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Risk stats for {self.user.email}"
+
+
+class AnalysisJob(models.Model):
+    """
+    ⏳ ASYNC JOBS - Uploads queued for the background worker pool
+    The queue lives in the database so jobs survive worker restarts
+    """
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+
+    KIND_ANALYZE = "analyze"
+    KIND_CLEAN = "clean"
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="analysis_jobs"
+    )
+    file_analysis = models.ForeignKey(
+        FileAnalysis,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="jobs",
+        help_text="Analysis being cleaned (clean jobs only)"
+    )
+
+    kind = models.CharField(
+        max_length=10,
+        choices=[(KIND_ANALYZE, "Analyze"), (KIND_CLEAN, "Clean")]
+    )
+    status = models.CharField(
+        max_length=10,
+        default=STATUS_QUEUED,
+        choices=[
+            (STATUS_QUEUED, "Queued"),
+            (STATUS_RUNNING, "Running"),
+            (STATUS_DONE, "Done"),
+            (STATUS_FAILED, "Failed"),
+        ]
+    )
+
+    # 📁 Spooled upload, kept on disk until the job finishes
+    file_name = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True)
+    file_size = models.BigIntegerField()
+    upload_path = models.CharField(max_length=500)
+
+    # 📊 Result: API payload for analyze, cleaned file for clean
+    result = models.JSONField(null=True, blank=True)
+    result_path = models.CharField(max_length=500, blank=True)
+    error = models.TextField(blank=True)
+
+    # 🔁 Lease: a running job whose lease expired is picked up again
+    attempts = models.PositiveSmallIntegerField(default=0)
+    locked_until = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["created_at"]
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
@@ -1,25 +1,40 @@
 # files/permissions.py
+from rest_framework import status
 from rest_framework.permissions import BasePermission
 from .models import FileAnalysis
+from .ratelimit import take_guest_token
 
-MAX_GUEST_UPLOADS = 1
 MAX_GUEST_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 
 
-def enforce_guest_limits(request, uploaded_file):
-    session = request.session
+class GuestLimitExceeded(Exception):
+    """
+    🚦 A guest request over its limits: 413 for size, 429 for rate.
+    The views turn it into a response with headers().
+    """
 
-    # Upload count
-    uploads = session.get("guest_uploads", 0)
-    if uploads >= MAX_GUEST_UPLOADS:
-        raise PermissionError("Guest upload limit reached")
+    def __init__(self, message: str, status_code: int, retry_after: int = 0):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
 
-    # File size
-    if uploaded_file.size > MAX_GUEST_FILE_SIZE:
-        raise PermissionError("File too large for guest mode")
+    def headers(self) -> dict:
+        return {"Retry-After": str(self.retry_after)} if self.retry_after else {}
 
-    session["guest_uploads"] = uploads + 1
-    session.modified = True
+
+def enforce_guest_limits(request, uploaded_file):
+    # File size (checked first: a rejected file costs no token)
+    if uploaded_file.size > MAX_GUEST_FILE_SIZE:
+        raise GuestLimitExceeded(
+            "File too large for guest mode", status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+
+    # Upload rate: token buckets per client and per IP, no session writes
+    retry_after = take_guest_token(request)
+    if retry_after:
+        raise GuestLimitExceeded(
+            "Guest upload limit reached, try again later", status.HTTP_429_TOO_MANY_REQUESTS, retry_after
+        )
 
 
 # ================================
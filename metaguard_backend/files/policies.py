@@ -1,3 +1,11 @@
+import hashlib
+import json
+from functools import lru_cache
+from typing import FrozenSet, NamedTuple, Tuple
+
+from .removal import build_clean_args
+
+
 GUEST_METADATA_POLICY = {
     "remove": [
         # 🔴 Personal Identity
@@ -34,3 +42,115 @@ GUEST_METADATA_POLICY = {
         "C2PA",
     ]
 }
+
+
+# ================================
+# PER-USER POLICIES (COMPILED)
+# ================================
+# Bump when the category lists below change
+POLICY_COMPILER_VERSION = 1
+
+# UserMetadataPolicy flag -> (MetadataField category, what a clean deletes).
+# "group:all" deletes a whole -g1 group in one argument.
+POLICY_CATEGORIES = {
+    "remove_location": ("location", [
+        "gps:all",
+        # Location tags outside the EXIF GPS IFD (XMP, IPTC, QuickTime)
+        "GPSLatitude", "GPSLongitude", "GPSAltitude", "GPSPosition", "GPSCoordinates",
+        "City", "State", "Province-State", "Country", "Country-PrimaryLocationName",
+        "Location", "Sub-location",
+    ]),
+    "remove_device": ("device", [
+        "Make", "Model", "SerialNumber", "InternalSerialNumber",
+        "LensMake", "LensModel", "LensSerialNumber", "LensInfo", "HostComputer",
+    ]),
+    "remove_software": ("software", [
+        "Software", "CreatorTool", "ProcessingSoftware", "HistorySoftwareAgent",
+    ]),
+    "remove_personal": ("personal", [
+        "Author", "Creator", "Artist", "By-line", "Owner", "OwnerName", "CameraOwnerName",
+        "LastModifiedBy", "Company", "Manager", "UserComment", "XPAuthor", "Contact",
+    ]),
+}
+
+# Tags a group delete already takes with it
+COVERED_BY_GROUP = {
+    "gps": {"gpsposition"},
+}
+
+class CompiledPolicy(NamedTuple):
+    version: str
+    remove: Tuple[str, ...]        # remove specs: tag names and group:all
+    args: Tuple[str, ...]          # ExifTool arguments for a clean
+    categories: Tuple[str, ...]    # MetadataField categories a clean removes
+
+
+def policy_flags(policy) -> FrozenSet[str]:
+    """Enabled flags of a UserMetadataPolicy (or the model defaults when None)"""
+    from .models import UserMetadataPolicy
+
+    if policy is None:
+        return frozenset(
+            name for name in POLICY_CATEGORIES
+            if UserMetadataPolicy._meta.get_field(name).default
+        )
+    return frozenset(name for name in POLICY_CATEGORIES if getattr(policy, name))
+
+
+@lru_cache(maxsize=64)
+def compile_policy(flags: FrozenSet[str]) -> CompiledPolicy:
+    """
+    Flags -> one deduplicated remove list and its ExifTool arguments.
+    Group deletes go first; tags they already cover are dropped.
+    """
+    specs = []
+    for flag in POLICY_CATEGORIES:
+        if flag in flags:
+            specs.extend(POLICY_CATEGORIES[flag][1])
+
+    groups = [s for s in specs if s.lower().endswith(":all")]
+    covered = set()
+    for group in groups:
+        covered |= COVERED_BY_GROUP.get(group.split(":")[0].lower(), set())
+
+    remove, seen = [], set()
+    for spec in groups + [s for s in specs if s not in groups]:
+        if spec.lower() in seen or spec.lower() in covered:
+            continue
+        seen.add(spec.lower())
+        remove.append(spec)
+
+    version = hashlib.sha256(json.dumps(
+        [POLICY_COMPILER_VERSION, sorted(flags)]
+    ).encode()).hexdigest()[:12]
+
+    return CompiledPolicy(
+        version=version,
+        remove=tuple(remove),
+        args=tuple(build_clean_args(remove)),
+        categories=tuple(POLICY_CATEGORIES[flag][0] for flag in POLICY_CATEGORIES if flag in flags),
+    )
+
+
+GUEST_COMPILED_POLICY = CompiledPolicy(
+    version="guest",
+    remove=tuple(GUEST_METADATA_POLICY["remove"]),
+    args=tuple(build_clean_args(GUEST_METADATA_POLICY["remove"])),
+    categories=("location", "personal", "device"),
+)
+
+
+def compiled_policy_for_user(user, policy=None) -> CompiledPolicy:
+    """
+    🛡️ The user's cleaning policy. Users with the same flags share one
+    compiled policy (compile_policy's cache), so a saved policy needs no
+    invalidation. Without `policy` it reads user.metadata_policy, so
+    select_related it.
+    """
+    if policy is None:
+        try:
+            policy = user.metadata_policy
+        except user._meta.model.metadata_policy.RelatedObjectDoesNotExist:
+            policy = None
+
+    return compile_policy(policy_flags(policy))
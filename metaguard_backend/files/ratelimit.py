@@ -0,0 +1,256 @@
+import hashlib
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+DEFAULT_RATE_LIMIT_STORE = {
+    "BACKEND": "files.ratelimit.LocMemRateLimitStore",
+    "OPTIONS": {
+        "max_entries": 10000,
+    },
+}
+
+# Buckets every guest upload draws one token from. "client" is one browser
+# session on one IP; "ip" still applies when the session cookie is dropped.
+DEFAULT_GUEST_RATE_LIMITS = {
+    "client": {"burst": 5, "per_minute": 1},
+    "ip": {"burst": 20, "per_minute": 10},
+}
+
+GUEST_RATE_LIMITS = getattr(settings, "GUEST_RATE_LIMITS", DEFAULT_GUEST_RATE_LIMITS)
+
+# Only behind a reverse proxy that sets it: otherwise clients pick their own IP
+TRUST_X_FORWARDED_FOR = getattr(settings, "GUEST_RATE_LIMIT_TRUST_X_FORWARDED_FOR", False)
+
+
+class Bucket(NamedTuple):
+    key: str
+    burst: float
+    per_second: float
+
+    @property
+    def ttl(self) -> float:
+        """Seconds until an untouched bucket is full again, so forgettable"""
+        return self.burst / self.per_second
+
+
+def refill(tokens: float, updated_at: float, bucket: Bucket, now: float) -> float:
+    return min(bucket.burst, tokens + (now - updated_at) * bucket.per_second)
+
+
+# ================================
+# BASE STORE
+# ================================
+class BaseRateLimitStore:
+    """
+    🪣 Token buckets keyed by client
+    ✅ take() checks and updates every bucket in one atomic step
+    ✅ Idle buckets expire once they would be full again
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+
+    def take(self, buckets: Sequence[Bucket], cost: float = 1.0) -> float:
+        """
+        Take `cost` tokens from every bucket, or from none of them.
+        Returns 0 when allowed, otherwise seconds until it would be.
+        """
+        now = time.time()
+        with self._transaction() as state:
+            current = []
+            for bucket in buckets:
+                stored = state.load(bucket.key)
+                tokens = bucket.burst if stored is None else refill(stored[0], stored[1], bucket, now)
+                current.append(tokens)
+
+            wait = max(
+                ((cost - tokens) / bucket.per_second for bucket, tokens in zip(buckets, current) if tokens < cost),
+                default=0.0,
+            )
+            if wait:
+                return wait
+
+            for bucket, tokens in zip(buckets, current):
+                state.save(bucket.key, tokens - cost, now, now + bucket.ttl)
+            return 0.0
+
+    def _transaction(self):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+# ================================
+# IN-PROCESS STORE
+# ================================
+class LocMemRateLimitStore(BaseRateLimitStore):
+    """Per process: with N workers a client gets up to N times the rate"""
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self._data: "OrderedDict[str, Tuple[float, float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _transaction(self):
+        return _LocMemTransaction(self)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class _LocMemTransaction:
+
+    def __init__(self, store: LocMemRateLimitStore):
+        self.store = store
+
+    def __enter__(self):
+        self.store._lock.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.store._lock.release()
+        return False
+
+    def load(self, key) -> Optional[Tuple[float, float]]:
+        entry = self.store._data.get(key)
+        if entry is None or entry[2] < time.time():
+            return None
+        return entry[0], entry[1]
+
+    def save(self, key, tokens, updated_at, expires_at):
+        data = self.store._data
+        data[key] = (tokens, updated_at, expires_at)
+        data.move_to_end(key)
+        while len(data) > self.store.max_entries:
+            data.popitem(last=False)
+
+
+# ================================
+# SHARED SQLITE STORE
+# ================================
+class SQLiteRateLimitStore(BaseRateLimitStore):
+    """
+    💾 One SQLite file for every worker process on the host.
+    BEGIN IMMEDIATE makes each take() a single atomic read-modify-write.
+    """
+
+    def __init__(self, path=None, **options):
+        super().__init__(**options)
+        self.path = str(path or settings.BASE_DIR / "rate_limits.sqlite3")
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit ("
+                " key TEXT PRIMARY KEY,"
+                " tokens REAL NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS rate_limit_expires ON rate_limit (expires_at)")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _SQLiteTransaction(self._connection(), self.max_entries)
+
+    def clear(self):
+        self._connection().execute("DELETE FROM rate_limit")
+
+
+class _SQLiteTransaction:
+
+    def __init__(self, conn: sqlite3.Connection, max_entries: int):
+        self.conn = conn
+        self.max_entries = max_entries
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is not None:
+            self.conn.execute("ROLLBACK")
+            return False
+        # Expired rows are dropped as we go; the cap only bites under a flood
+        self.conn.execute("DELETE FROM rate_limit WHERE expires_at < ?", (time.time(),))
+        self.conn.execute(
+            "DELETE FROM rate_limit WHERE key IN ("
+            " SELECT key FROM rate_limit ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        self.conn.execute("COMMIT")
+        return False
+
+    def load(self, key) -> Optional[Tuple[float, float]]:
+        return self.conn.execute(
+            "SELECT tokens, updated_at FROM rate_limit WHERE key = ? AND expires_at >= ?", (key, time.time())
+        ).fetchone()
+
+    def save(self, key, tokens, updated_at, expires_at):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO rate_limit (key, tokens, updated_at, expires_at) VALUES (?, ?, ?, ?)",
+            (key, tokens, updated_at, expires_at),
+        )
+
+
+_store: Optional[BaseRateLimitStore] = None
+_store_lock = threading.Lock()
+
+
+def get_rate_limit_store() -> BaseRateLimitStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = getattr(settings, "GUEST_RATE_LIMIT_STORE", DEFAULT_RATE_LIMIT_STORE)
+                backend = import_string(config["BACKEND"])
+                _store = backend(**config.get("OPTIONS", {}))
+    return _store
+
+
+# ================================
+# GUEST BUCKETS
+# ================================
+def client_ip(request) -> str:
+    if TRUST_X_FORWARDED_FOR:
+        forwarded = request.META.get("HTTP_X_FORWARDED_FOR", "")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def guest_buckets(request) -> list:
+    """
+    The client's buckets. The session id is read from the cookie only:
+    nothing is created or written in the session store.
+    """
+    ip = client_ip(request)
+    session = request.COOKIES.get(settings.SESSION_COOKIE_NAME, "")
+    client = hashlib.sha256(f"{ip}|{session}".encode()).hexdigest()[:32]
+
+    keys = {"client": f"guest:client:{client}", "ip": f"guest:ip:{ip}"}
+    return [
+        Bucket(keys[name], float(limit["burst"]), limit["per_minute"] / 60.0)
+        for name, limit in GUEST_RATE_LIMITS.items()
+    ]
+
+
+def take_guest_token(request) -> int:
+    """0 when the guest may go ahead, else whole seconds for Retry-After"""
+    wait = get_rate_limit_store().take(guest_buckets(request))
+    return math.ceil(wait) if wait else 0
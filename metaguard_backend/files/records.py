@@ -0,0 +1,306 @@
+import threading
+from typing import Dict, Iterable, List
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .delivery import cleaned_artifact
+from .metrics import stage
+from .models import (
+    POLICY_FIELD_CATEGORIES,
+    FieldCategory,
+    FileAnalysis,
+    MetadataField,
+    MetadataTag,
+    RiskLevel,
+    UserMetadataPolicy,
+    UserRiskStats,
+)
+from .policies import compiled_policy_for_user
+from .services import CleanedFile, analyze_metadata_cached, clean_metadata_guest
+from .uploads import upload_sha256
+
+
+# Scoring labels -> MetadataField integer codes
+FIELD_CATEGORY_CODES = {c.label: c.value for c in FieldCategory}
+RISK_LEVEL_CODES = {r.label: r.value for r in RiskLevel}
+
+REMOVED_CATEGORIES = ["location", "personal", "device"]
+
+# FileAnalysis.risk_level -> UserRiskStats counter
+RISK_LEVEL_STATS = {
+    "High": "high_risk_files",
+    "Medium": "medium_risk_files",
+    "Low": "low_risk_files",
+}
+
+
+# ================================
+# INTERNED TAG NAMES
+# ================================
+TAG_ID_CACHE_SIZE = 50000
+TAG_LOOKUP_BATCH = 500
+
+# name -> MetadataTag id, only for tags known to be committed
+_tag_ids: Dict[str, int] = {}
+_tag_ids_lock = threading.Lock()
+
+
+def _remember_tags(found: Dict[str, int]):
+    with _tag_ids_lock:
+        if len(_tag_ids) + len(found) > TAG_ID_CACHE_SIZE:
+            _tag_ids.clear()
+        _tag_ids.update(found)
+
+
+def clear_tag_cache():
+    with _tag_ids_lock:
+        _tag_ids.clear()
+
+
+def _lookup_tags(names: List[str]) -> Dict[str, int]:
+    found = {}
+    for i in range(0, len(names), TAG_LOOKUP_BATCH):
+        found.update(MetadataTag.objects.filter(name__in=names[i:i + TAG_LOOKUP_BATCH]).values_list("name", "id"))
+    return found
+
+
+def intern_tags(names: Iterable[str]) -> Dict[str, int]:
+    """
+    Tag name -> MetadataTag id, creating the names we haven't seen.
+    Names seen before come from a per-process cache; unknown ones cost
+    one SELECT, plus an INSERT and a SELECT for names that are truly new.
+    """
+    wanted = set(names)
+    ids = {name: _tag_ids[name] for name in wanted if name in _tag_ids}
+    missing = sorted(wanted - ids.keys())
+    if not missing:
+        return ids
+
+    found = _lookup_tags(missing)
+    new = [name for name in missing if name not in found]
+    if new:
+        # A concurrent request may insert the same names: skip those
+        MetadataTag.objects.bulk_create(
+            [MetadataTag(name=name) for name in new], ignore_conflicts=True, batch_size=TAG_LOOKUP_BATCH
+        )
+        found.update(_lookup_tags(new))
+
+    # Ids from a transaction that rolls back must not be reused
+    transaction.on_commit(lambda: _remember_tags(found))
+    ids.update(found)
+    return ids
+
+
+def build_metadata_fields(analysis: FileAnalysis, metadata: List[Dict], tag_ids: Dict[str, int]) -> List[MetadataField]:
+    return [
+        MetadataField(
+            analysis=analysis,
+            tag_id=tag_ids[field_data.get("field", "")],
+            value=field_data.get("value", ""),
+            category=FIELD_CATEGORY_CODES.get(field_data.get("category"), FieldCategory.TECHNICAL),
+            risk=RISK_LEVEL_CODES.get(field_data.get("risk"), RiskLevel.LOW),
+            risk_score=field_data.get("risk_score", 0.0),
+            will_be_removed=bool(field_data.get("will_be_removed")),
+            removed=False,
+        )
+        for field_data in metadata
+    ]
+
+
+def metadata_tag_names(metadata: List[Dict]) -> List[str]:
+    return [field_data.get("field", "") for field_data in metadata]
+
+
+# ================================
+# PER-USER STATS (SAME TRANSACTION)
+# ================================
+def scan_stats_deltas(analyses: List[FileAnalysis], fields_found: int) -> Dict:
+    deltas = {
+        "files_scanned": len(analyses),
+        "total_risk_score": sum(a.total_risk_score for a in analyses),
+        "fields_found": fields_found,
+        "bytes_scanned": sum(a.file_size for a in analyses),
+    }
+    for analysis in analyses:
+        counter = RISK_LEVEL_STATS.get(analysis.risk_level)
+        if counter:
+            deltas[counter] = deltas.get(counter, 0) + 1
+    return deltas
+
+
+def bump_user_stats(user_id: int, **deltas):
+    """
+    Add to a user's counters with one UPDATE ... SET x = x + n, so
+    concurrent requests never overwrite each other. The row is created
+    on first use. Call it inside the transaction that wrote the change.
+    """
+    deltas = {name: value for name, value in deltas.items() if value}
+    if not deltas:
+        return
+
+    increments = {name: F(name) + value for name, value in deltas.items()}
+    if UserRiskStats.objects.filter(user_id=user_id).update(updated_at=timezone.now(), **increments):
+        return
+
+    try:
+        with transaction.atomic():
+            UserRiskStats.objects.create(user_id=user_id, **deltas)
+    except IntegrityError:
+        # Created by a concurrent request in the meantime
+        UserRiskStats.objects.filter(user_id=user_id).update(updated_at=timezone.now(), **increments)
+
+
+# ================================
+# SAVE ANALYSIS (ONE TRANSACTION)
+# ================================
+@stage("db")
+@transaction.atomic
+def save_file_analysis(user, uploaded_file, sha256_before: str, metadata: List[Dict], overall_risk: str,
+                       total_score: float = 0.0, risk_counts: Dict = None) -> FileAnalysis:
+    """
+    💾 FileAnalysis + all its MetadataField rows in one transaction
+    ✅ Fields are written with batched INSERTs, not one query per tag
+    ✅ The user's stats row is updated in the same transaction
+    """
+    file_analysis = FileAnalysis.objects.create(
+        user=user,  # 👤 Isolated to current user
+        file_name=uploaded_file.name,
+        file_type=uploaded_file.content_type or "unknown",
+        file_size=uploaded_file.size,
+        sha256_before=sha256_before,
+        sha256_after=None,  # Will be set after cleaning
+        risk_level=overall_risk,
+        total_risk_score=total_score,
+        risk_counts=risk_counts or {},
+        scanned_at=timezone.now(),
+    )
+
+    # 💾 ALL metadata, one compact row per tag
+    tag_ids = intern_tags(metadata_tag_names(metadata))
+    MetadataField.objects.bulk_create(build_metadata_fields(file_analysis, metadata, tag_ids))
+    bump_user_stats(user.id, **scan_stats_deltas([file_analysis], len(metadata)))
+
+    return file_analysis
+
+
+@transaction.atomic
+def save_file_analyses_bulk(user, items) -> List[FileAnalysis]:
+    """
+    Many analyses at once: one INSERT batch for the FileAnalysis rows and
+    one for all of their fields, then one stats UPDATE for the lot.
+    items = (uploaded_file, sha256, metadata, overall_risk, total_score, risk_counts)
+    """
+    now = timezone.now()
+    analyses = FileAnalysis.objects.bulk_create([
+        FileAnalysis(
+            user=user,
+            file_name=uploaded_file.name,
+            file_type=uploaded_file.content_type or "unknown",
+            file_size=uploaded_file.size,
+            sha256_before=sha256_before,
+            risk_level=overall_risk,
+            total_risk_score=total_score,
+            risk_counts=risk_counts,
+            scanned_at=now,
+        )
+        for uploaded_file, sha256_before, metadata, overall_risk, total_score, risk_counts in items
+    ])
+
+    tag_ids = intern_tags(name for item in items for name in metadata_tag_names(item[2]))
+    fields = []
+    for analysis, item in zip(analyses, items):
+        fields.extend(build_metadata_fields(analysis, item[2], tag_ids))
+    MetadataField.objects.bulk_create(fields)
+    bump_user_stats(user.id, **scan_stats_deltas(analyses, len(fields)))
+
+    return analyses
+
+
+# ================================
+# MARK CLEANED (ONE TRANSACTION)
+# ================================
+@stage("db")
+@transaction.atomic
+def mark_file_cleaned(file_analysis: FileAnalysis, sha256_after: str, categories=REMOVED_CATEGORIES) -> FileAnalysis:
+    first_clean = file_analysis.cleaned_at is None
+    file_analysis.sha256_after = sha256_after
+    file_analysis.cleaned_at = timezone.now()
+    file_analysis.save(update_fields=["sha256_after", "cleaned_at", "updated_at"])
+
+    # One set-based UPDATE instead of a save() per field
+    codes = [code for name in categories for code in POLICY_FIELD_CATEGORIES.get(name, [])]
+    file_analysis.metadata_fields.filter(category__in=codes).update(removed=True)
+
+    if first_clean:
+        bump_user_stats(file_analysis.user_id, files_cleaned=1)
+
+    return file_analysis
+
+
+# ================================
+# ANALYZE + RECORD (AUTHENTICATED)
+# ================================
+def analyze_and_save(user, uploaded_file) -> Dict:
+    """
+    Analyze an upload for a user, store it, and return the API payload.
+    Shared by the analyze view and the background job worker.
+    """
+    # Calculate SHA-256 hash BEFORE processing
+    with stage("hash"):
+        sha256_before = upload_sha256(uploaded_file)
+
+    # Get user's policy (the "after" counts follow what their clean removes)
+    policy, _ = UserMetadataPolicy.objects.get_or_create(user=user)
+    compiled = compiled_policy_for_user(user, policy)
+
+    # Analyze metadata (reuses the result for content we have seen before)
+    result = analyze_metadata_cached(uploaded_file, sha256_before, list(compiled.remove))
+    metadata, privacy_count, overall_risk, total_score, risk_counts, remaining_count = result
+
+    # Create FileAnalysis record + metadata fields for THIS user in one transaction
+    file_analysis = save_file_analysis(
+        user, uploaded_file, sha256_before, metadata, overall_risk, total_score, risk_counts
+    )
+
+    return analysis_payload(
+        file_analysis, metadata, privacy_count, overall_risk, total_score, risk_counts, remaining_count, result.scan
+    )
+
+
+def analysis_payload(file_analysis, metadata, privacy_count, overall_risk, total_score, risk_counts, remaining_count, scan=None) -> Dict:
+    return {
+        "id": file_analysis.id,
+        "file_name": file_analysis.file_name,
+        "metadata": metadata,
+        "before": {
+            "total": len(metadata),
+            "privacy": privacy_count,
+        },
+        "after": {
+            "remaining": remaining_count,
+            "removed": len(metadata) - remaining_count,
+        },
+        "overall_risk": overall_risk,
+        "total_risk_score": total_score,
+        "risk_counts": risk_counts,
+        "partial_read": scan is not None,
+        "scan": scan,
+        "sha256_before": file_analysis.sha256_before,
+        "scanned_at": file_analysis.scanned_at,
+    }
+
+
+def clean_and_save(file_analysis: FileAnalysis, uploaded_file, keep=False) -> CleanedFile:
+    # The owner's policy, compiled once and reused across their cleans
+    policy = compiled_policy_for_user(file_analysis.user)
+
+    # SHA-256 AFTER cleaning is computed once by the clean service;
+    # a retry within the artifact TTL reuses a kept cleaned file
+    cleaned = cleaned_artifact(uploaded_file, upload_sha256(uploaded_file), policy, clean=clean_metadata_guest, keep=keep)
+
+    # Update file record with after-cleaning data and mark removed metadata
+    mark_file_cleaned(file_analysis, cleaned.sha256_after, policy.categories)
+
+    return cleaned
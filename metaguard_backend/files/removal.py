@@ -0,0 +1,94 @@
+import re
+from typing import Dict, Iterable, List, NamedTuple, Set
+
+
+# Keys ExifTool adds to every result that are not metadata of the file
+IGNORED_KEYS = {"SourceFile", "ExifTool"}
+
+# Deleting one of these tags also deletes the tags it is written from
+IMPLIED_REMOVALS = {
+    "gpsposition": ["gpslatitude", "gpslatituderef", "gpslongitude", "gpslongituderef"],
+}
+
+DUPLICATE_SUFFIX_REGEX = re.compile(r"\s\(\d+\)$")
+
+
+class RemovalPrediction(NamedTuple):
+    remaining: int
+    removed: int
+    removed_fields: Set[str]
+
+
+def normalize_tag(tag: str) -> str:
+    """'XMP-photoshop:City (1)' -> 'city'"""
+    tag = DUPLICATE_SUFFIX_REGEX.sub("", tag)
+    return tag.rsplit(":", 1)[-1].lower()
+
+
+def is_group_delete(tag: str) -> bool:
+    """'gps:all' deletes every tag of a -g1 group"""
+    return tag.lower().endswith(":all")
+
+
+def remove_groups(remove_tags: Iterable[str]) -> Set[str]:
+    return {tag.rsplit(":", 1)[0].lower() for tag in remove_tags if is_group_delete(tag)}
+
+
+def expand_remove_tags(remove_tags: Iterable[str]) -> Set[str]:
+    expanded = set()
+    for tag in remove_tags:
+        if is_group_delete(tag):
+            continue
+        name = normalize_tag(tag)
+        expanded.add(name)
+        expanded.update(IMPLIED_REMOVALS.get(name, []))
+    return expanded
+
+
+# ================================
+# DRY-RUN REMOVAL
+# ================================
+def field_will_be_removed(key: str, value, remove_set: Set[str], groups: Set[str] = frozenset()) -> bool:
+    """
+    A plain tag goes away when it is on the remove list.
+    A -g1 group goes away when it is deleted as a whole (gps:all),
+    otherwise only when every tag inside it does.
+    """
+    if key.lower() in groups:
+        return True
+    if isinstance(value, dict):
+        tags = [k for k in value.keys() if k not in IGNORED_KEYS]
+        return bool(tags) and all(normalize_tag(k) in remove_set for k in tags)
+    return normalize_tag(key) in remove_set
+
+
+def predict_removal(raw: Dict, remove_tags: Iterable[str]) -> RemovalPrediction:
+    """
+    Predict what an ExifTool clean with `-TAG=` for every remove tag
+    leaves behind, using only the metadata already extracted.
+    """
+    remove_set = expand_remove_tags(remove_tags)
+    groups = remove_groups(remove_tags)
+
+    total = 0
+    removed_fields = set()
+    for key, value in raw.items():
+        if key in IGNORED_KEYS:
+            continue
+        total += 1
+        if field_will_be_removed(key, value, remove_set, groups):
+            removed_fields.add(key)
+
+    return RemovalPrediction(
+        remaining=total - len(removed_fields),
+        removed=len(removed_fields),
+        removed_fields=removed_fields,
+    )
+
+
+def count_fields(raw: Dict) -> int:
+    return len([k for k in raw.keys() if k not in IGNORED_KEYS])
+
+
+def build_clean_args(remove_tags: Iterable[str]) -> List[str]:
+    return [f"-{tag}=" for tag in remove_tags]
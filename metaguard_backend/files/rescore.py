@@ -0,0 +1,242 @@
+import hashlib
+import json
+import os
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import django
+from django.conf import settings
+from django.db import transaction
+
+from .models import FileAnalysis, MetadataField
+from .records import FIELD_CATEGORY_CODES, RISK_LEVEL_CODES, RISK_LEVEL_STATS, bump_user_stats
+from .services import FIELD_HINT_CLASSES, SCORING_VERSION, calculate_field_risk, calculate_overall_risk
+
+
+# Analyses per chunk: one SELECT for them, one for their fields, one transaction
+RESCORE_CHUNK_SIZE = getattr(settings, "RESCORE_CHUNK_SIZE", 500)
+RESCORE_WORKERS = getattr(settings, "RESCORE_WORKERS", os.cpu_count() or 1)
+
+# Where --resume picks up after the last committed chunk
+RESCORE_STATE_FILE = str(getattr(settings, "RESCORE_STATE_FILE", settings.BASE_DIR / "rescore_state.json"))
+
+BULK_UPDATE_BATCH = 500
+
+
+class FieldRow(NamedTuple):
+    id: int
+    tag: str
+    value: str
+    category: int
+    risk: int
+    risk_score: float
+
+
+class AnalysisRow(NamedTuple):
+    id: int
+    user_id: int
+    risk_level: str
+    total_risk_score: float
+    risk_counts: Dict
+    fields: List[FieldRow]
+
+
+class Rescored(NamedTuple):
+    """What changed for one analysis (fields: (id, category, risk, risk_score))"""
+    id: int
+    user_id: int
+    old_risk: str
+    new_risk: str
+    old_score: float
+    new_score: float
+    risk_counts: Dict
+    fields: List[Tuple[int, int, int, float]]
+
+
+def scoring_fingerprint() -> str:
+    """Changes whenever the hint lists or SCORING_VERSION do"""
+    fingerprint = json.dumps({"scoring": SCORING_VERSION, "hints": FIELD_HINT_CLASSES})
+    return hashlib.sha256(fingerprint.encode()).hexdigest()[:16]
+
+
+# ================================
+# STREAMING READS (KEYSET CHUNKS)
+# ================================
+def iter_chunks(after_id: int = 0, chunk_size: int = RESCORE_CHUNK_SIZE,
+                user_id: Optional[int] = None) -> Iterator[List[AnalysisRow]]:
+    """
+    Analyses in id order, chunk_size at a time, with their field rows.
+    Each chunk is a fresh `WHERE id > last` query, so only one chunk is
+    ever in memory and a run can restart from any id.
+    """
+    last_id = after_id
+    while True:
+        analyses = FileAnalysis.objects.filter(id__gt=last_id)
+        if user_id is not None:
+            analyses = analyses.filter(user_id=user_id)
+        analyses = list(
+            analyses.order_by("id").values_list("id", "user_id", "risk_level", "total_risk_score", "risk_counts")[:chunk_size]
+        )
+        if not analyses:
+            return
+
+        fields = MetadataField.objects.filter(analysis_id__gte=analyses[0][0], analysis_id__lte=analyses[-1][0])
+        if user_id is not None:
+            fields = fields.filter(analysis__user_id=user_id)
+        fields = (
+            fields.order_by("analysis_id", "id")
+            .values_list("analysis_id", "id", "tag__name", "value", "category", "risk", "risk_score")
+            .iterator(chunk_size=2000)
+        )
+        by_analysis = {
+            analysis_id: [FieldRow(*row[1:]) for row in rows]
+            for analysis_id, rows in groupby(fields, key=lambda row: row[0])
+        }
+
+        yield [AnalysisRow(*row, by_analysis.get(row[0], [])) for row in analyses]
+        last_id = analyses[-1][0]
+
+
+# ================================
+# SCORING (RUNS IN WORKER PROCESSES)
+# ================================
+def rescore_chunk(chunk: List[AnalysisRow]) -> List[Rescored]:
+    """Pure function of the stored tags and values: no database access"""
+    changed = []
+    for analysis in chunk:
+        metadata, fields = [], []
+        for field in analysis.fields:
+            risk, category, score = calculate_field_risk(field.tag, field.value)
+            metadata.append({"risk": risk, "risk_score": score})
+            codes = (FIELD_CATEGORY_CODES[category], RISK_LEVEL_CODES[risk], score)
+            if codes != (field.category, field.risk, field.risk_score):
+                fields.append((field.id,) + codes)
+
+        overall_risk, total_score, risk_counts = calculate_overall_risk(metadata)
+        if (fields or overall_risk != analysis.risk_level or total_score != analysis.total_risk_score
+                or risk_counts != analysis.risk_counts):
+            changed.append(Rescored(
+                analysis.id, analysis.user_id, analysis.risk_level, overall_risk,
+                analysis.total_risk_score, total_score, risk_counts, fields,
+            ))
+    return changed
+
+
+def _init_worker():
+    # Spawned (non-fork) workers start without Django configured
+    django.setup()
+
+
+# ================================
+# BATCHED WRITES (ONE TRANSACTION PER CHUNK)
+# ================================
+@transaction.atomic
+def apply_rescored(changed: List[Rescored]):
+    """
+    Changed analyses and fields go out as bulk UPDATEs, and each user's
+    stats move by the difference in the same transaction.
+    """
+    analyses, fields, stats = [], [], {}
+    for result in changed:
+        analyses.append(FileAnalysis(
+            id=result.id, risk_level=result.new_risk,
+            total_risk_score=result.new_score, risk_counts=result.risk_counts,
+        ))
+        fields.extend(
+            MetadataField(id=field_id, category=category, risk=risk, risk_score=score)
+            for field_id, category, risk, score in result.fields
+        )
+
+        deltas = stats.setdefault(result.user_id, Counter())
+        deltas["total_risk_score"] += result.new_score - result.old_score
+        if result.old_risk != result.new_risk:
+            deltas[RISK_LEVEL_STATS[result.old_risk]] -= 1
+            deltas[RISK_LEVEL_STATS[result.new_risk]] += 1
+
+    FileAnalysis.objects.bulk_update(
+        analyses, ["risk_level", "total_risk_score", "risk_counts"], batch_size=BULK_UPDATE_BATCH
+    )
+    MetadataField.objects.bulk_update(fields, ["category", "risk", "risk_score"], batch_size=BULK_UPDATE_BATCH)
+    for user_id, deltas in stats.items():
+        bump_user_stats(user_id, **deltas)
+
+
+# ================================
+# RESUME STATE
+# ================================
+def load_state(path: str = RESCORE_STATE_FILE) -> Optional[Dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_state(last_id: int, path: str = RESCORE_STATE_FILE):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"last_id": last_id, "scoring": scoring_fingerprint()}, f)
+    os.replace(tmp, path)
+
+
+def clear_state(path: str = RESCORE_STATE_FILE):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# ================================
+# RE-SCORE RUN
+# ================================
+def rescore_analyses(after_id: int = 0, chunk_size: int = RESCORE_CHUNK_SIZE, workers: int = RESCORE_WORKERS,
+                     dry_run: bool = False, user_id: Optional[int] = None, state_path: Optional[str] = None,
+                     on_chunk=None) -> Dict:
+    """
+    🔁 Recompute field and overall risk for stored analyses.
+
+    Chunks are read in the main process, scored in `workers` processes
+    (inline when workers <= 1) and written back in id order, so the saved
+    state always points at a fully committed prefix. At most two chunks
+    per worker are in flight. `on_chunk(last_id, changed)` sees every
+    chunk's changes, including in a dry run, where nothing is written.
+    """
+    report = {"scanned": 0, "analyses_changed": 0, "fields_changed": 0, "last_id": after_id, "transitions": Counter()}
+
+    def finish(chunk: List[AnalysisRow], changed: List[Rescored]):
+        last_id = chunk[-1].id
+        if changed and not dry_run:
+            apply_rescored(changed)
+        if state_path and not dry_run:
+            save_state(last_id, state_path)
+
+        report["scanned"] += len(chunk)
+        report["analyses_changed"] += len(changed)
+        report["fields_changed"] += sum(len(result.fields) for result in changed)
+        report["transitions"].update(
+            (result.old_risk, result.new_risk) for result in changed if result.old_risk != result.new_risk
+        )
+        report["last_id"] = last_id
+        if on_chunk:
+            on_chunk(last_id, changed)
+
+    chunks = iter_chunks(after_id, chunk_size, user_id)
+    if workers <= 1:
+        for chunk in chunks:
+            finish(chunk, rescore_chunk(chunk))
+        return report
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append((chunk, pool.submit(rescore_chunk, chunk)))
+            if len(pending) >= workers * 2:
+                done, future = pending.popleft()
+                finish(done, future.result())
+        while pending:
+            done, future = pending.popleft()
+            finish(done, future.result())
+
+    return report
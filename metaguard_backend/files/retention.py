@@ -0,0 +1,227 @@
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from .models import AnalysisJob, FileAnalysis, MetadataField, UserMetadataPolicy
+from .records import RISK_LEVEL_STATS, bump_user_stats
+
+
+RETENTION_DAYS = getattr(settings, "RETENTION_DAYS", None)
+RETENTION_MAX_FILES = getattr(settings, "RETENTION_MAX_FILES", None)
+
+# Analyses per delete transaction: keeps each write lock short
+RETENTION_BATCH_SIZE = getattr(settings, "RETENTION_BATCH_SIZE", 200)
+
+# Sleep between batches so live requests get the database in between
+RETENTION_PAUSE_SECONDS = getattr(settings, "RETENTION_PAUSE_SECONDS", 0.05)
+
+ACTIVE_JOB_STATUSES = [AnalysisJob.STATUS_QUEUED, AnalysisJob.STATUS_RUNNING]
+
+
+class RetentionRule(NamedTuple):
+    """None = no limit"""
+    days: Optional[int]
+    max_files: Optional[int]
+
+    @property
+    def keeps_everything(self) -> bool:
+        return self.days is None and self.max_files is None
+
+
+def retention_rule(policy: Optional[UserMetadataPolicy]) -> RetentionRule:
+    """The user's settings, falling back to the site defaults; 0 turns a limit off"""
+    days = policy.retention_days if policy and policy.retention_days is not None else RETENTION_DAYS
+    max_files = policy.retention_max_files if policy and policy.retention_max_files is not None else RETENTION_MAX_FILES
+    return RetentionRule(days or None, max_files or None)
+
+
+def expired_analyses(user_id: int, rule: RetentionRule, now: Optional[datetime] = None):
+    """
+    The user's analyses outside the rule: older than `days`, or past the
+    newest `max_files`. Both are plain index walks on (user, -scanned_at).
+    """
+    expired = Q()
+    if rule.days is not None:
+        expired |= Q(scanned_at__lt=(now or timezone.now()) - timedelta(days=rule.days))
+    if rule.max_files is not None:
+        newest_first = FileAnalysis.objects.filter(user_id=user_id).order_by("-scanned_at", "-id")
+        expired |= Q(id__in=newest_first.values("id")[rule.max_files:])
+    if not expired:
+        return FileAnalysis.objects.none()
+    return FileAnalysis.objects.filter(expired, user_id=user_id)
+
+
+# ================================
+# RECLAIM REPORT
+# ================================
+def empty_report() -> Dict:
+    return {"analyses": 0, "metadata_fields": 0, "jobs": 0, "value_bytes": 0, "upload_bytes": 0}
+
+
+def add_report(total: Dict, batch: Dict) -> Dict:
+    for key, value in batch.items():
+        total[key] = total.get(key, 0) + value
+    return total
+
+
+def database_free_bytes() -> Optional[int]:
+    """Bytes on SQLite's free list: deleted pages the file can reuse"""
+    if connection.vendor != "sqlite":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA freelist_count")
+        free_pages = cursor.fetchone()[0]
+        cursor.execute("PRAGMA page_size")
+        return free_pages * cursor.fetchone()[0]
+
+
+def database_file_bytes() -> Optional[int]:
+    if connection.vendor != "sqlite":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA page_count")
+        page_count = cursor.fetchone()[0]
+        cursor.execute("PRAGMA page_size")
+        return page_count * cursor.fetchone()[0]
+
+
+def vacuum_database():
+    """Give the free pages back to the filesystem (rewrites the whole file)"""
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute("VACUUM")
+
+
+# ================================
+# BATCHED SET-BASED DELETES
+# ================================
+def _delete_in(cursor, model, column: str, ids: List[int]) -> int:
+    placeholders = ", ".join(["%s"] * len(ids))
+    table = connection.ops.quote_name(model._meta.db_table)
+    cursor.execute(f"DELETE FROM {table} WHERE {connection.ops.quote_name(column)} IN ({placeholders})", ids)
+    return cursor.rowcount
+
+
+def _remove_files(paths: List[str]):
+    for path in paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+@transaction.atomic
+def delete_analyses(user_id: int, ids: List[int]) -> Dict:
+    """
+    🗑️ Delete one batch of a user's analyses with three DELETE ... WHERE IN
+    statements (fields, finished jobs, analyses) instead of Django's
+    cascade, which loads every related row first. The user's stats drop by
+    what was removed, in the same transaction.
+    """
+    analyses = FileAnalysis.objects.filter(id__in=ids, user_id=user_id)
+    totals = analyses.aggregate(
+        count=Count("id"),
+        cleaned=Count("id", filter=Q(cleaned_at__isnull=False)),
+        score=Sum("total_risk_score"),
+        size=Sum("file_size"),
+        **{level: Count("id", filter=Q(risk_level=level)) for level in RISK_LEVEL_STATS},
+    )
+    fields = MetadataField.objects.filter(analysis_id__in=ids).aggregate(value_bytes=Sum(Length("value")))
+    job_files = [
+        path
+        for paths in AnalysisJob.objects.filter(file_analysis_id__in=ids).values_list("upload_path", "result_path")
+        for path in paths
+    ]
+
+    with connection.cursor() as cursor:
+        report = {
+            "metadata_fields": _delete_in(cursor, MetadataField, "analysis_id", ids),
+            "jobs": _delete_in(cursor, AnalysisJob, "file_analysis_id", ids),
+            "analyses": _delete_in(cursor, FileAnalysis, "id", ids),
+            "value_bytes": fields["value_bytes"] or 0,
+            "upload_bytes": totals["size"] or 0,
+        }
+
+    bump_user_stats(
+        user_id,
+        files_scanned=-totals["count"],
+        files_cleaned=-totals["cleaned"],
+        total_risk_score=-(totals["score"] or 0.0),
+        fields_found=-report["metadata_fields"],
+        bytes_scanned=-(totals["size"] or 0),
+        **{counter: -totals[level] for level, counter in RISK_LEVEL_STATS.items()},
+    )
+    transaction.on_commit(lambda: _remove_files(job_files))
+    return report
+
+
+def purge_queryset(user_id: int, queryset, batch_size: int = RETENTION_BATCH_SIZE,
+                   pause: float = RETENTION_PAUSE_SECONDS, dry_run: bool = False) -> Dict:
+    """
+    Delete everything `queryset` matches, batch_size analyses per
+    transaction. Analyses with a queued or running job are left alone.
+    """
+    queryset = queryset.exclude(jobs__status__in=ACTIVE_JOB_STATUSES)
+    if dry_run:
+        totals = queryset.aggregate(analyses=Count("id"), upload_bytes=Sum("file_size"))
+        report = empty_report()
+        report["analyses"] = totals["analyses"]
+        report["upload_bytes"] = totals["upload_bytes"] or 0
+        report["metadata_fields"] = MetadataField.objects.filter(analysis__in=queryset).count()
+        return report
+
+    report = empty_report()
+    while True:
+        ids = list(queryset.order_by("id").values_list("id", flat=True)[:batch_size])
+        if not ids:
+            return report
+        add_report(report, delete_analyses(user_id, ids))
+        if len(ids) < batch_size:
+            return report
+        if pause:
+            time.sleep(pause)
+
+
+# ================================
+# RETENTION RUNS
+# ================================
+def apply_retention(user_id: Optional[int] = None, batch_size: int = RETENTION_BATCH_SIZE,
+                    pause: float = RETENTION_PAUSE_SECONDS, dry_run: bool = False) -> Dict:
+    """Enforce every user's retention rule (or one user's); returns the totals"""
+    policies = UserMetadataPolicy.objects.all()
+    users = FileAnalysis.objects.order_by("user_id").values_list("user_id", flat=True).distinct()
+    if user_id is not None:
+        policies = policies.filter(user_id=user_id)
+        users = users.filter(user_id=user_id)
+    policies = {policy.user_id: policy for policy in policies}
+
+    now = timezone.now()
+    report = {**empty_report(), "users": 0}
+    for uid in list(users):
+        rule = retention_rule(policies.get(uid))
+        if rule.keeps_everything:
+            continue
+        batch = purge_queryset(uid, expired_analyses(uid, rule, now), batch_size, pause, dry_run)
+        report["users"] += bool(batch["analyses"])
+        add_report(report, batch)
+    return report
+
+
+def delete_user_data(user_id: int, batch_size: int = RETENTION_BATCH_SIZE,
+                     pause: float = RETENTION_PAUSE_SECONDS, delete_account: bool = False) -> Dict:
+    """
+    All of a user's analyses in batches, then (optionally) the account:
+    its cascade only has the policy, stats and job rows left to remove.
+    """
+    report = purge_queryset(user_id, FileAnalysis.objects.filter(user_id=user_id), batch_size, pause)
+    if delete_account:
+        for job in AnalysisJob.objects.filter(user_id=user_id).values_list("upload_path", "result_path"):
+            _remove_files(job)
+        User.objects.filter(id=user_id).delete()
+    return report
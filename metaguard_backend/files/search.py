@@ -0,0 +1,265 @@
+import base64
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import FieldCategory, FileAnalysis, MetadataField, RiskLevel
+
+
+DEFAULT_SEARCH_PAGE_SIZE = 50
+MAX_SEARCH_PAGE_SIZE = 200
+MAX_SEARCH_TERMS = 8
+
+SEARCH_TABLE = "files_metadata_search"
+SEARCH_CONTENT_VIEW = "files_metadata_search_content"
+
+# Filter names accepted by ?category= / ?risk=
+SEARCH_CATEGORIES = {c.label.lower(): c.value for c in FieldCategory}
+SEARCH_RISKS = {r.label.lower(): r.value for r in RiskLevel}
+
+SEARCH_TERM_REGEX = re.compile(r"[^\s\"]+\*?|\"[^\"]+\"")
+
+
+class InvalidSearchQuery(ValueError):
+    pass
+
+
+# ================================
+# FTS5 INDEX (SQLITE ONLY)
+# ================================
+# Tag and value are not copied: the index reads them back through a view
+# over MetadataField/MetadataTag. "owner" holds "u<user id>" so a user's
+# matches come straight out of the index instead of being filtered later.
+# Migrations that rebuild files_metadatafield drop its triggers: such a
+# migration must re-create them from its own copy of this SQL (see 0007).
+SEARCH_INDEX_SQL = [
+    f"""
+    CREATE VIEW {SEARCH_CONTENT_VIEW} AS
+    SELECT f.id AS id, t.name AS tag, f.value AS value, 'u' || a.user_id AS owner
+    FROM files_metadatafield f
+    JOIN files_metadatatag t ON t.id = f.tag_id
+    JOIN files_fileanalysis a ON a.id = f.analysis_id
+    """,
+    f"""
+    CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(
+        tag, value, owner,
+        content='{SEARCH_CONTENT_VIEW}', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER files_metadata_search_insert AFTER INSERT ON files_metadatafield BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, tag, value, owner) VALUES (
+            new.id,
+            (SELECT name FROM files_metadatatag WHERE id = new.tag_id),
+            new.value,
+            (SELECT 'u' || user_id FROM files_fileanalysis WHERE id = new.analysis_id)
+        );
+    END
+    """,
+    # Runs before the analysis row goes: fields are always deleted first
+    f"""
+    CREATE TRIGGER files_metadata_search_delete AFTER DELETE ON files_metadatafield BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, tag, value, owner) VALUES (
+            'delete', old.id,
+            (SELECT name FROM files_metadatatag WHERE id = old.tag_id),
+            old.value,
+            (SELECT 'u' || user_id FROM files_fileanalysis WHERE id = old.analysis_id)
+        );
+    END
+    """,
+    f"""
+    CREATE TRIGGER files_metadata_search_update AFTER UPDATE OF tag_id, value ON files_metadatafield BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, tag, value, owner) VALUES (
+            'delete', old.id,
+            (SELECT name FROM files_metadatatag WHERE id = old.tag_id),
+            old.value,
+            (SELECT 'u' || user_id FROM files_fileanalysis WHERE id = old.analysis_id)
+        );
+        INSERT INTO {SEARCH_TABLE}(rowid, tag, value, owner) VALUES (
+            new.id,
+            (SELECT name FROM files_metadatatag WHERE id = new.tag_id),
+            new.value,
+            (SELECT 'u' || user_id FROM files_fileanalysis WHERE id = new.analysis_id)
+        );
+    END
+    """,
+    # Index the rows that already exist
+    f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')",
+]
+
+DROP_SEARCH_INDEX_SQL = [
+    "DROP TRIGGER IF EXISTS files_metadata_search_update",
+    "DROP TRIGGER IF EXISTS files_metadata_search_delete",
+    "DROP TRIGGER IF EXISTS files_metadata_search_insert",
+    f"DROP TABLE IF EXISTS {SEARCH_TABLE}",
+    f"DROP VIEW IF EXISTS {SEARCH_CONTENT_VIEW}",
+]
+
+
+def search_index_enabled(conn=connection) -> bool:
+    return conn.vendor == "sqlite"
+
+
+def create_search_index(apps=None, schema_editor=None):
+    """Migration helper: (re)create the index, view and triggers"""
+    conn = schema_editor.connection if schema_editor else connection
+    if not search_index_enabled(conn):
+        return
+    with conn.cursor() as cursor:
+        for sql in DROP_SEARCH_INDEX_SQL + SEARCH_INDEX_SQL:
+            cursor.execute(sql)
+
+
+def drop_search_index(apps=None, schema_editor=None):
+    conn = schema_editor.connection if schema_editor else connection
+    if not search_index_enabled(conn):
+        return
+    with conn.cursor() as cursor:
+        for sql in DROP_SEARCH_INDEX_SQL:
+            cursor.execute(sql)
+
+
+# ================================
+# QUERY PARSING
+# ================================
+def search_terms(query: str) -> List[str]:
+    """Words and "quoted phrases"; a trailing * keeps prefix matching"""
+    terms = [t for t in SEARCH_TERM_REGEX.findall(query or "") if t.strip('"').rstrip("*")]
+    if not terms:
+        raise InvalidSearchQuery("q is required")
+    if len(terms) > MAX_SEARCH_TERMS:
+        raise InvalidSearchQuery(f"At most {MAX_SEARCH_TERMS} search terms")
+    return terms
+
+
+def fts_match_expression(user_id: int, terms: Sequence[str]) -> str:
+    """Every term must appear in the tag or value; each is quoted so user input is never FTS syntax"""
+    parts = []
+    for term in terms:
+        prefix = term.endswith("*") and not term.startswith('"')
+        text = term.strip('"').rstrip("*")
+        parts.append('"' + text.replace('"', '""') + '"' + ("*" if prefix else ""))
+    return f"owner:u{int(user_id)} AND {{tag value}} : ({' AND '.join(parts)})"
+
+
+def parse_choices(raw: Optional[str], choices: Dict[str, int], name: str) -> List[int]:
+    if not raw:
+        return []
+    codes = []
+    for value in raw.split(","):
+        value = value.strip().lower()
+        if value not in choices:
+            raise InvalidSearchQuery(f"Unknown {name}: {value} (use {', '.join(choices)})")
+        codes.append(choices[value])
+    return codes
+
+
+def encode_search_cursor(field_id: int) -> str:
+    return base64.urlsafe_b64encode(str(field_id).encode()).decode()
+
+
+def decode_search_cursor(cursor: str) -> int:
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidSearchQuery("Invalid cursor")
+
+
+# ================================
+# SEARCH
+# ================================
+def _search_rows_fts(user_id, terms, categories, risks, before_id, limit) -> List[Tuple]:
+    """
+    The FTS index yields the user's matches newest field first (rowid
+    order, no sort step); each match is one primary-key lookup per table.
+    """
+    sql = [
+        f"SELECT f.id, f.analysis_id, a.file_name, a.scanned_at, t.name, f.value, f.category, f.risk, f.removed",
+        f"FROM {SEARCH_TABLE}",
+        f"JOIN files_metadatafield f ON f.id = {SEARCH_TABLE}.rowid",
+        "JOIN files_metadatatag t ON t.id = f.tag_id",
+        "JOIN files_fileanalysis a ON a.id = f.analysis_id",
+        f"WHERE {SEARCH_TABLE} MATCH %s AND a.user_id = %s",
+    ]
+    params = [fts_match_expression(user_id, terms), user_id]
+    if categories:
+        sql.append(f"AND f.category IN ({', '.join(['%s'] * len(categories))})")
+        params += categories
+    if risks:
+        sql.append(f"AND f.risk IN ({', '.join(['%s'] * len(risks))})")
+        params += risks
+    if before_id is not None:
+        sql.append(f"AND {SEARCH_TABLE}.rowid < %s")
+        params.append(before_id)
+    sql.append(f"ORDER BY {SEARCH_TABLE}.rowid DESC LIMIT %s")
+    params.append(limit)
+
+    with connection.cursor() as cursor:
+        cursor.execute("\n".join(sql), params)
+        rows = cursor.fetchall()
+
+    # Raw SQL skips the ORM's column conversions (SQLite returns text dates)
+    scanned_at = FileAnalysis._meta.get_field("scanned_at").get_col(FileAnalysis._meta.db_table)
+    converters = connection.ops.get_db_converters(scanned_at)
+    converted = []
+    for row in rows:
+        value = row[3]
+        for converter in converters:
+            value = converter(value, scanned_at, connection)
+        converted.append(row[:3] + (value,) + row[4:])
+    return converted
+
+
+def _search_rows_orm(user_id, terms, categories, risks, before_id, limit) -> List[Tuple]:
+    """Other databases: same filters as LIKE scans"""
+    fields = MetadataField.objects.filter(analysis__user_id=user_id)
+    for term in terms:
+        text = term.strip('"').rstrip("*")
+        fields = fields.filter(Q(tag__name__icontains=text) | Q(value__icontains=text))
+    if categories:
+        fields = fields.filter(category__in=categories)
+    if risks:
+        fields = fields.filter(risk__in=risks)
+    if before_id is not None:
+        fields = fields.filter(id__lt=before_id)
+    return list(fields.order_by("-id").values_list(
+        "id", "analysis_id", "analysis__file_name", "analysis__scanned_at",
+        "tag__name", "value", "category", "risk", "removed",
+    )[:limit])
+
+
+def search_metadata(user, query: str, category: Optional[str] = None, risk: Optional[str] = None,
+                    limit: int = DEFAULT_SEARCH_PAGE_SIZE, cursor: Optional[str] = None):
+    """
+    🔎 The user's metadata fields whose tag or value contain every term,
+    newest first, with a keyset cursor. Returns (results, next_cursor).
+    """
+    terms = search_terms(query)
+    categories = parse_choices(category, SEARCH_CATEGORIES, "category")
+    risks = parse_choices(risk, SEARCH_RISKS, "risk")
+    limit = max(1, min(limit, MAX_SEARCH_PAGE_SIZE))
+    before_id = decode_search_cursor(cursor) if cursor else None
+
+    search_rows = _search_rows_fts if search_index_enabled() else _search_rows_orm
+    # One extra row tells us whether there is a next page
+    rows = search_rows(user.id, terms, categories, risks, before_id, limit + 1)
+    next_cursor = encode_search_cursor(rows[limit - 1][0]) if len(rows) > limit else None
+
+    results = [
+        {
+            "field_id": field_id,
+            "file_id": file_id,
+            "file_name": file_name,
+            "scanned_at": scanned_at,
+            "field": tag,
+            "value": value,
+            "category": FieldCategory(category_code).label,
+            "risk": RiskLevel(risk_code).label,
+            "removed": bool(removed),
+        }
+        for field_id, file_id, file_name, scanned_at, tag, value, category_code, risk_code, removed in rows[:limit]
+    ]
+    return results, next_cursor
@@ -3,6 +3,9 @@ from .models import FileAnalysis, MetadataField, UserMetadataPolicy
 
 
 class MetadataFieldSerializer(serializers.ModelSerializer):
+    tag = serializers.CharField(source="tag.name", read_only=True)
+    category = serializers.CharField(source="category_name", read_only=True)
+
     class Meta:
         model = MetadataField
         fields = ['id', 'tag', 'value', 'category', 'risk_level', 'removed']
@@ -52,6 +55,8 @@ class UserMetadataPolicySerializer(serializers.ModelSerializer):
             'remove_device',
             'remove_software',
             'remove_personal',
+            'retention_days',
+            'retention_max_files',
             'created_at',
             'updated_at',
         ]
@@ -1,15 +1,33 @@
-import subprocess
+import bisect
 import tempfile
+import io
 import json
 import os
 import hashlib
 import re
-from typing import List, Dict, Tuple
-from .policies import GUEST_METADATA_POLICY
+from contextlib import asynccontextmanager, contextmanager
+from functools import lru_cache
+from typing import List, Dict, FrozenSet, Tuple
+from asgiref.sync import sync_to_async
+from .cache import get_analysis_cache
+from .exiftool import (
+    EXIFTOOL_PIPE_MAX_BYTES,
+    ExifToolError,
+    run_exiftool,
+    pipe_uploads,
+    run_exiftool_async,
+    run_exiftool_pipe,
+    run_exiftool_stream,
+)
+from .fastpath import FAST_PATH_VERSION, METADATA_FAST_PATH, extract_metadata_fast
+from .jpegclean import strip_jpeg_upload
+from .metrics import record_bytes, record_tag_count, stage
+from .fastscan import FAST_SCAN_EXIFTOOL_OPTION, FAST_SCAN_MIN_BYTES, header_only, plan_fast_scan, scan_args
+from .policies import GUEST_COMPILED_POLICY, GUEST_METADATA_POLICY
+from .removal import build_clean_args, count_fields, predict_removal
+from .uploads import file_sha256, upload_sha256
 
 
-EXIFTOOL_PATH = r"C:\exiftool\exiftool.exe"
-
 # ================================
 # REGEX & HEURISTICS
 # ================================
@@ -42,25 +60,69 @@ SAFE_TECH_HINTS = [
     "heic", "jpeg", "hevc", "profile"
 ]
 
+LOCATION_HINTS = [
+    "gps", "latitude", "longitude",
+    "gpscoordinates", "location", "position"
+]
+
+# Order matters: it is the order calculate_field_risk checks them in
+FIELD_HINT_CLASSES = [
+    ("safe", SAFE_TECH_HINTS),
+    ("location", LOCATION_HINTS),
+    ("name", NAME_FIELD_HINTS),
+    ("device", DEVICE_HINTS),
+    ("time", TIME_HINTS),
+]
+
+# One pattern for every hint list: at each position of the tag name an
+# optional lookahead per class records which hints start there
+FIELD_HINT_REGEX = re.compile("".join(
+    f"(?:(?=(?P<{cls}>{'|'.join(re.escape(h) for h in hints)})))?"
+    for cls, hints in FIELD_HINT_CLASSES
+))
+
+DIGIT_RUN_REGEX = re.compile(r"\d{3,}")
+
+FIELD_CLASS_CACHE_SIZE = 8192
+
+# Bump when the scoring rules change in a way the hint lists don't capture
+SCORING_VERSION = 1
+
+
+# ================================
+# TAG NAME CLASSIFIER
+# ================================
+@lru_cache(maxsize=FIELD_CLASS_CACHE_SIZE)
+def classify_field_name(field: str) -> FrozenSet[str]:
+    """
+    Which hint classes appear anywhere in the tag name.
+    ExifTool's tag names are a finite set, so this runs once per name.
+    """
+    found = set()
+    for match in FIELD_HINT_REGEX.finditer(field.lower()):
+        for cls, hit in match.groupdict().items():
+            if hit is not None:
+                found.add(cls)
+    return frozenset(found)
+
+
 # ================================
 # FIELD RISK CALCULATION
 # ================================
 def calculate_field_risk(field: str, value: str):
-    field_l = field.lower()
-    value_s = str(value).strip()
-    value_l = value_s.lower()
+    hints = classify_field_name(field)
 
     # 🟢 HARD SAFE EXIT
-    if any(x in field_l for x in SAFE_TECH_HINTS):
+    if "safe" in hints:
         return "Low", "Technical", 1.0
 
     # 🔴 LOCATION (ALWAYS HIGH)
-    if "gps" in field_l or any(x in field_l for x in [
-        "latitude", "longitude","gps","GPSLongitude", "GPSLatitude","GPS",
-        "gpscoordinates", "location", "position"
-    ]):
+    if "location" in hints:
         return "High", "Location", 9.5
 
+    value_s = str(value).strip()
+    value_l = value_s.lower()
+
     # 🔴 EMAIL / PHONE
     if EMAIL_REGEX.search(value_l) or PHONE_REGEX.search(value_l):
         return "High", "Personal", 9.5
@@ -68,13 +130,13 @@ def calculate_field_risk(field: str, value: str):
     # 🧠 NAME CONFIDENCE SCORING
     name_confidence = 0
 
-    if any(x in field_l for x in NAME_FIELD_HINTS):
+    if "name" in hints:
         name_confidence += 2
 
     if HUMAN_NAME_REGEX.search(value_s):
         name_confidence += 2
 
-    if value_s and len(value_s) < 40 and not re.search(r"\d{3,}", value_s):
+    if value_s and len(value_s) < 40 and not DIGIT_RUN_REGEX.search(value_s):
         name_confidence += 1
 
     if name_confidence >= 4:
@@ -85,11 +147,11 @@ def calculate_field_risk(field: str, value: str):
         return "Medium", "Personal", 4.5
 
     # 🟠 DEVICE / SOFTWARE
-    if any(x in field_l for x in DEVICE_HINTS):
+    if "device" in hints:
         return "Medium", "Device", 4.0
 
     # 🟠 TIME (CONTEXT ONLY)
-    if any(x in field_l for x in TIME_HINTS):
+    if "time" in hints:
         return "Low", "Time", 2.5
 
     # 🟢 DEFAULT SAFE
@@ -131,24 +193,48 @@ def calculate_overall_risk(metadata: List[Dict]) -> Tuple[str, float, Dict[str,
 # ================================
 # ANALYZE METADATA (GUEST)
 # ================================
-def analyze_metadata_guest(uploaded_file):
-
-    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        for chunk in uploaded_file.chunks():
-            tmp.write(chunk)
-        tmp_path = tmp.name
-
-    try:
-        result = subprocess.run(
-            [EXIFTOOL_PATH, "-j", "-a", "-u", "-g1", tmp_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            shell=False,
-        )
-
-        raw = json.loads(result.stdout)[0]
-
+def analyze_metadata_guest(uploaded_file, remove_tags=None):
+    if remove_tags is None:
+        remove_tags = GUEST_METADATA_POLICY["remove"]
+
+    record_bytes("analyze", uploaded_file.size)
+
+    scan = None
+    with stage("extract"):
+        # Plain JPEG/PNG/TIFF headers are read in-process, the rest goes to ExifTool.
+        # Not header-only uploads: the in-process reader would see a truncated file.
+        raw = None if header_only(uploaded_file) else extract_metadata_fast(uploaded_file)
+        if raw is None:
+            # Large media: ExifTool only sees the header atoms/segments
+            plan = plan_fast_scan(uploaded_file)
+            if plan is not None:
+                raw = _parse_json_output(run_exiftool_stream(scan_args(), plan.chunks))
+                scan = plan.report()
+            else:
+                raw = extract_metadata_upload(uploaded_file)
+
+    return AnalysisResult(score_metadata(raw, remove_tags), scan=scan)
+
+
+class AnalysisResult(tuple):
+    """
+    (metadata, privacy_count, overall_risk, total_score, risk_counts, remaining_count)
+    plus `scan`: None after a full read, the partial-read report otherwise
+    """
+
+    def __new__(cls, values, scan=None):
+        result = super().__new__(cls, values)
+        result.scan = scan
+        return result
+
+
+def score_metadata(raw: Dict, remove_tags):
+    """Risk-score ExifTool output and predict what a clean leaves behind"""
+    # Dry-run the selective clean against the tags we already have
+    with stage("simulate_clean"):
+        prediction = predict_removal(raw, remove_tags)
+
+    with stage("score"):
         metadata = []
         privacy_count = 0
 
@@ -167,69 +253,413 @@ def analyze_metadata_guest(uploaded_file):
                 "risk": risk,
                 "category": category,
                 "risk_score": score,
+                "will_be_removed": key in prediction.removed_fields,
             })
 
         overall_risk, total_score, risk_counts = calculate_overall_risk(metadata)
 
-        # Simulate selective cleaning
-        clean_path = tmp_path + "_clean"
-        clean_args = [EXIFTOOL_PATH]
+    record_tag_count(len(metadata))
 
-        for tag in GUEST_METADATA_POLICY["remove"]:
-            clean_args.append(f"-{tag}=")
+    return metadata, privacy_count, overall_risk, total_score, risk_counts, prediction.remaining
 
-        clean_args.extend(["-o", clean_path, tmp_path])
 
-        subprocess.run(clean_args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+# ================================
+# ANALYZE METADATA (CACHED)
+# ================================
+def policy_version(remove_tags) -> str:
+    """Fingerprint of everything besides the file bytes that shapes a result"""
+    fingerprint = json.dumps({
+        "scoring": SCORING_VERSION,
+        "hints": FIELD_HINT_CLASSES,
+        "remove": sorted(remove_tags),
+        "fast_path": FAST_PATH_VERSION if METADATA_FAST_PATH else None,
+        "system_tags": sorted(UPLOAD_SYSTEM_TAGS),
+        "fast_scan": [FAST_SCAN_MIN_BYTES, FAST_SCAN_EXIFTOOL_OPTION],
+    })
+    return hashlib.sha256(fingerprint.encode()).hexdigest()[:16]
+
+
+def analysis_cache_key(file_hash: str, remove_tags) -> str:
+    return f"{file_hash}:{policy_version(remove_tags)}"
+
+
+def result_to_cache_entry(result) -> Dict:
+    metadata, privacy_count, overall_risk, total_score, risk_counts, remaining_count = result
+    return {
+        "metadata": metadata,
+        "privacy_count": privacy_count,
+        "overall_risk": overall_risk,
+        "total_risk_score": total_score,
+        "risk_counts": risk_counts,
+        "remaining_count": remaining_count,
+        "scan": getattr(result, "scan", None),
+    }
+
+
+def result_from_cache_entry(cached: Dict):
+    return AnalysisResult((
+        cached["metadata"],
+        cached["privacy_count"],
+        cached["overall_risk"],
+        cached["total_risk_score"],
+        cached["risk_counts"],
+        cached["remaining_count"],
+    ), scan=cached.get("scan"))
+
+
+def analyze_metadata_cached(uploaded_file, file_hash: str, remove_tags=None):
+    """
+    analyze_metadata_guest() with results reused for files we have seen before
+    """
+    if remove_tags is None:
+        remove_tags = GUEST_METADATA_POLICY["remove"]
+
+    cache = get_analysis_cache()
+    key = analysis_cache_key(file_hash, remove_tags)
+
+    with stage("cache"):
+        cached = cache.get(key)
+    if cached is not None:
+        return result_from_cache_entry(cached)
+
+    result = analyze_metadata_guest(uploaded_file, remove_tags)
+    cache.set(key, result_to_cache_entry(result))
+    return result
 
-        result_clean = subprocess.run(
-            [EXIFTOOL_PATH, "-j", "-a", "-u", "-g1", clean_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-        )
 
-        remaining_count = 0
-        if result_clean.stdout.strip():
-            clean_meta = json.loads(result_clean.stdout)[0]
-            remaining_count = len([
-                k for k in clean_meta.keys()
-                if k not in ["SourceFile", "ExifTool"]
-            ])
+# ================================
+# EXIFTOOL I/O
+# ================================
+@contextmanager
+def spooled_upload(uploaded_file):
+    """
+    Path to the upload on disk. Reuses the temp file Django already wrote
+    for large uploads and only spools in-memory ones.
+    """
+    if hasattr(uploaded_file, "temporary_file_path"):
+        yield uploaded_file.temporary_file_path()
+        return
 
-        return metadata, privacy_count, overall_risk, total_score, risk_counts, remaining_count
+    with tempfile.NamedTemporaryFile(delete=False) as tmp:
+        for chunk in uploaded_file.chunks():
+            tmp.write(chunk)
+        tmp_path = tmp.name
 
+    try:
+        yield tmp_path
     finally:
         if os.path.exists(tmp_path):
             os.remove(tmp_path)
-        if os.path.exists(tmp_path + "_clean"):
-            os.remove(tmp_path + "_clean")
+
+
+@asynccontextmanager
+async def aspooled_upload(uploaded_file):
+    """spooled_upload() with the copy to disk and the removal in a worker thread"""
+    spool = spooled_upload(uploaded_file)
+    path = await sync_to_async(spool.__enter__, thread_sensitive=False)()
+    try:
+        yield path
+    finally:
+        await sync_to_async(spool.__exit__, thread_sensitive=False)(None, None, None)
+
+
+# ExifTool's System group describes the file it opened: for a spooled upload
+# that's our temp file (name, directory, dates, permissions), and none of it
+# is there when the upload is piped or read by the fast path
+UPLOAD_SYSTEM_TAGS = {"FileSize"}
+
+
+def upload_metadata(raw: Dict) -> Dict:
+    """Drop the System tags that describe the temp file rather than the upload"""
+    system = raw.get("System")
+    if isinstance(system, dict):
+        kept = {tag: value for tag, value in system.items() if tag in UPLOAD_SYSTEM_TAGS}
+        if kept:
+            raw["System"] = kept
+        else:
+            del raw["System"]
+    return raw
+
+
+def _parse_json_output(result) -> Dict:
+    if not result.stdout.strip():
+        return {}
+    return upload_metadata(json.loads(result.stdout)[0])
+
+
+def extract_metadata(path: str) -> Dict:
+    return _parse_json_output(run_exiftool(["-j", "-a", "-u", "-g1", path]))
+
+
+def extract_metadata_stream(chunks) -> Dict:
+    return _parse_json_output(run_exiftool_stream(["-j", "-a", "-u", "-g1", "-"], chunks))
+
+
+def extract_metadata_upload(uploaded_file) -> Dict:
+    """ExifTool on an upload: piped when small and there is no pool, from disk otherwise"""
+    if uploaded_file.size <= EXIFTOOL_PIPE_MAX_BYTES and pipe_uploads():
+        return extract_metadata_stream(uploaded_file.chunks())
+    with spooled_upload(uploaded_file) as path:
+        return extract_metadata(path)
 
 
 # ================================
 # CLEAN METADATA (GUEST)
 # ================================
-def clean_metadata_guest(uploaded_file):
+class PiecesReader(io.RawIOBase):
+    """
+    Read-only, seekable file over a list of pieces: bytes/memoryviews, or
+    (start, end) ranges read from `source` on demand. Nothing is joined.
+    """
+
+    def __init__(self, pieces, source=None):
+        super().__init__()
+        self.pieces = pieces
+        self.source = source
+        self.starts = []
+        total = 0
+        for piece in pieces:
+            self.starts.append(total)
+            total += piece[1] - piece[0] if isinstance(piece, tuple) else len(piece)
+        self.total = total
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.pos, io.SEEK_END: self.total}[whence]
+        self.pos = max(0, base + offset)
+        return self.pos
+
+    def readinto(self, buffer):
+        if self.pos >= self.total:
+            return 0
+        index = bisect.bisect_right(self.starts, self.pos) - 1
+        piece, skip = self.pieces[index], self.pos - self.starts[index]
+
+        if isinstance(piece, tuple):
+            start, end = piece
+            self.source.seek(start + skip)
+            data = self.source.read(min(len(buffer), end - start - skip))
+        else:
+            data = piece[skip:skip + len(buffer)]
+
+        n = len(data)
+        buffer[:n] = data
+        self.pos += n
+        return n
+
+
+class CleanedFile:
+    """
+    🧹 Result of a clean: bytes in memory for piped cleans,
+    a temp file for spooled ones, pieces of the upload for native JPEG cleans.
+    Call cleanup() when the response is done.
+    """
+
+    def __init__(self, sha256_before, sha256_after, data=None, path=None, temp_paths=(), pieces=None, source=None):
+        self.sha256_before = sha256_before
+        self.sha256_after = sha256_after
+        self.data = data
+        self.path = path
+        self.temp_paths = list(temp_paths)
+        self.pieces = pieces
+        self.source = source
+
+    @property
+    def hash_changed(self) -> bool:
+        return self.sha256_before != self.sha256_after
+
+    @property
+    def size(self) -> int:
+        if self.pieces is not None:
+            return PiecesReader(self.pieces).total
+        if self.data is not None:
+            return len(self.data)
+        return os.path.getsize(self.path)
+
+    def open(self):
+        if self.pieces is not None:
+            return PiecesReader(self.pieces, self.source)
+        if self.data is not None:
+            return io.BytesIO(self.data)
+        return open(self.path, "rb")
+
+    def cleanup(self):
+        for path in self.temp_paths:
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def clean_jpeg_native(uploaded_file, original_hash, remove_tags):
+    """Plain JPEGs: rewrite only the metadata segments, stream the rest as-is"""
+    stripped = strip_jpeg_upload(uploaded_file, remove_tags)
+    if stripped is None:
+        return None
+    pieces, new_hash = stripped
+    return CleanedFile(original_hash, new_hash, pieces=pieces, source=uploaded_file)
+
+
+@stage("clean")
+def clean_metadata_guest(uploaded_file, original_hash=None, policy=None) -> CleanedFile:
+    record_bytes("clean", uploaded_file.size)
+    if original_hash is None:
+        original_hash = upload_sha256(uploaded_file)
+    if policy is None:
+        policy = GUEST_COMPILED_POLICY
+
+    cleaned = clean_jpeg_native(uploaded_file, original_hash, policy.remove)
+    if cleaned is not None:
+        return cleaned
+
+    args = list(policy.args)
+
+    if uploaded_file.size <= EXIFTOOL_PIPE_MAX_BYTES and pipe_uploads():
+        # No pool: upload in through stdin, cleaned bytes out through stdout
+        result = run_exiftool_pipe(args + ["-o", "-", "-"], uploaded_file.chunks())
+        if not result.stdout:
+            raise ExifToolError(result.stderr.decode("utf-8", errors="replace").strip() or "ExifTool produced no output")
+        new_hash = hashlib.sha256(result.stdout).hexdigest()
+        return CleanedFile(original_hash, new_hash, data=result.stdout)
+
+    temp_paths = []
+    if hasattr(uploaded_file, "temporary_file_path"):
+        original_path = uploaded_file.temporary_file_path()
+    else:
+        with tempfile.NamedTemporaryFile(delete=False) as original:
+            for chunk in uploaded_file.chunks():
+                original.write(chunk)
+            original_path = original.name
+        temp_paths.append(original_path)
 
-    with tempfile.NamedTemporaryFile(delete=False) as original:
-        for chunk in uploaded_file.chunks():
-            original.write(chunk)
-        original_path = original.name
+    clean_path = original_path + "_cleaned"
+    temp_paths.append(clean_path)
 
-    with open(original_path, "rb") as f:
-        original_hash = hashlib.sha256(f.read()).hexdigest()
+    run_exiftool(args + ["-o", clean_path, original_path])
 
-    clean_path = original_path + "_cleaned"
+    new_hash = file_sha256(clean_path)
+
+    return CleanedFile(original_hash, new_hash, path=clean_path, temp_paths=temp_paths)
+
+
+# ================================
+# ASYNC VARIANTS (ASGI VIEWS)
+# ================================
+async def aanalyze_metadata_guest(uploaded_file, remove_tags=None):
+    if remove_tags is None:
+        remove_tags = GUEST_METADATA_POLICY["remove"]
 
-    args = [EXIFTOOL_PATH]
-    for tag in GUEST_METADATA_POLICY["remove"]:
-        args.append(f"-{tag}=")
+    record_bytes("analyze", uploaded_file.size)
 
-    args.extend(["-o", clean_path, original_path])
+    scan = None
+    with stage("extract"):
+        # Header parsing reads (and may map) the upload: not on the event loop
+        if header_only(uploaded_file):
+            raw = None
+        else:
+            raw = await sync_to_async(extract_metadata_fast, thread_sensitive=False)(uploaded_file)
+        if raw is None:
+            plan = await sync_to_async(plan_fast_scan, thread_sensitive=False)(uploaded_file)
+            if plan is not None:
+                raw = _parse_json_output(await run_exiftool_async(scan_args(), plan.chunks))
+                scan = plan.report()
+            elif uploaded_file.size <= EXIFTOOL_PIPE_MAX_BYTES:
+                raw = _parse_json_output(await run_exiftool_async(["-j", "-a", "-u", "-g1", "-"], uploaded_file.chunks()))
+            else:
+                async with aspooled_upload(uploaded_file) as path:
+                    raw = _parse_json_output(await run_exiftool_async(["-j", "-a", "-u", "-g1", path]))
 
-    subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return AnalysisResult(score_metadata(raw, remove_tags), scan=scan)
+
+
+async def aanalyze_metadata_cached(uploaded_file, file_hash: str, remove_tags=None):
+    if remove_tags is None:
+        remove_tags = GUEST_METADATA_POLICY["remove"]
+
+    cache = get_analysis_cache()
+    key = analysis_cache_key(file_hash, remove_tags)
+
+    with stage("cache"):
+        cached = await sync_to_async(cache.get, thread_sensitive=False)(key)
+    if cached is not None:
+        return result_from_cache_entry(cached)
+
+    result = await aanalyze_metadata_guest(uploaded_file, remove_tags)
+    await sync_to_async(cache.set, thread_sensitive=False)(key, result_to_cache_entry(result))
+    return result
+
+
+@stage("clean")
+async def aclean_metadata_guest(uploaded_file, original_hash=None, policy=None) -> CleanedFile:
+    record_bytes("clean", uploaded_file.size)
+    if original_hash is None:
+        original_hash = await sync_to_async(upload_sha256, thread_sensitive=False)(uploaded_file)
+    if policy is None:
+        policy = GUEST_COMPILED_POLICY
+
+    cleaned = await sync_to_async(clean_jpeg_native, thread_sensitive=False)(uploaded_file, original_hash, policy.remove)
+    if cleaned is not None:
+        return cleaned
+
+    args = list(policy.args)
+
+    if uploaded_file.size <= EXIFTOOL_PIPE_MAX_BYTES:
+        result = await run_exiftool_async(args + ["-o", "-", "-"], uploaded_file.chunks())
+        if not result.stdout:
+            raise ExifToolError(result.stderr.decode("utf-8", errors="replace").strip() or "ExifTool produced no output")
+        return CleanedFile(original_hash, hashlib.sha256(result.stdout).hexdigest(), data=result.stdout)
+
+    temp_paths = []
+    async with aspooled_upload(uploaded_file) as original_path:
+        clean_path = original_path + "_cleaned"
+        temp_paths.append(clean_path)
+        await run_exiftool_async(args + ["-o", clean_path, original_path])
+
+    new_hash = await sync_to_async(file_sha256, thread_sensitive=False)(clean_path)
+
+    return CleanedFile(original_hash, new_hash, path=clean_path, temp_paths=temp_paths)
+
+
+# ================================
+# VERIFY REMOVAL PREDICTION
+# ================================
+def verify_removal_prediction(path: str, remove_tags=None) -> Dict:
+    """
+    Run a real clean next to the dry-run prediction and compare them.
+    Used by tests to keep predict_removal() honest against ExifTool.
+    """
+    if remove_tags is None:
+        remove_tags = GUEST_METADATA_POLICY["remove"]
+
+    raw = extract_metadata(path)
+    prediction = predict_removal(raw, remove_tags)
+
+    clean_path = path + "_verify"
+    try:
+        args = build_clean_args(remove_tags)
+        args.extend(["-o", clean_path, path])
+        run_exiftool(args)
+
+        clean_raw = extract_metadata(clean_path) if os.path.exists(clean_path) else {}
+    finally:
+        if os.path.exists(clean_path):
+            os.remove(clean_path)
 
-    with open(clean_path, "rb") as f:
-        new_hash = hashlib.sha256(f.read()).hexdigest()
+    actually_removed = {k for k in raw.keys() if k not in clean_raw} - {"SourceFile", "ExifTool"}
 
-    return clean_path, original_path, (original_hash != new_hash)
+    return {
+        "predicted_remaining": prediction.remaining,
+        "actual_remaining": count_fields(clean_raw),
+        "match": prediction.removed_fields == actually_removed,
+        "unexpected": sorted(prediction.removed_fields ^ actually_removed),
+    }
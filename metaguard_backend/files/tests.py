@@ -1,3 +1,1981 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import io
+import json
+import math
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .batch import BATCH_MAX_FILES, stream_batch_analysis
+from .benchmarks import BaselineMismatch, build_corpus, compare_to_baseline, load_baseline, run_benchmarks, save_baseline
+from .cache import LocMemResultCache, SQLiteResultCache, get_analysis_cache
+from .delivery import CLEANED_ARTIFACT_TTL, load_artifact, purge_expired_artifacts, save_artifact
+from .exiftool import (
+    EXIFTOOL_PATH,
+    ExifToolCrashed,
+    ExifToolPool,
+    ExifToolResult,
+    ExifToolTimeout,
+    run_exiftool,
+    run_exiftool_async,
+    run_exiftool_pipe,
+    run_exiftool_stream,
+)
+from .fastpath import extract_metadata_fast, parse_buffer
+from .fastscan import HeaderCollector, plan_fast_scan
+from .metrics import EXIFTOOL_RUNS, record_exiftool, render_metrics
+from .jobs import claim_next_job, enqueue_job, renew_lease, run_job, wait_for_job
+from .models import AnalysisJob, FieldCategory, FileAnalysis, MetadataField, MetadataTag, UserMetadataPolicy
+from .policies import GUEST_METADATA_POLICY, compile_policy, compiled_policy_for_user
+from .records import build_metadata_fields, clear_tag_cache, intern_tags, metadata_tag_names
+from .ratelimit import Bucket, SQLiteRateLimitStore, get_rate_limit_store
+from .rescore import rescore_analyses, save_state
+from .retention import apply_retention, delete_user_data
+from .services import (
+    AnalysisResult,
+    CleanedFile,
+    aanalyze_metadata_guest,
+    aclean_metadata_guest,
+    analyze_metadata_cached,
+    analyze_metadata_guest,
+    calculate_field_risk,
+    classify_field_name,
+    clean_jpeg_native,
+    extract_metadata,
+    extract_metadata_stream,
+    score_metadata,
+    spooled_upload,
+    upload_metadata,
+    verify_removal_prediction,
+)
+from .uploads import Sha256UploadMixin, upload_sha256
+
+
+def fake_analysis(tag_count):
+    metadata = [
+        {
+            "field": f"Tag{i}",
+            "value": f"value {i}",
+            "risk": "High" if i % 3 == 0 else "Low",
+            "category": "Location" if i % 3 == 0 else "Technical",
+            "risk_score": 9.5 if i % 3 == 0 else 1.0,
+        }
+        for i in range(tag_count)
+    ]
+    return AnalysisResult((metadata, 0, "High", 100.0, {"High": 0, "Medium": 0, "Low": 0}, tag_count))
+
+
+def use_temp_artifact_dir(test):
+    """Each test gets its own cleaned-artifact store"""
+    path = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, path, True)
+    patcher = mock.patch("files.delivery.CLEANED_ARTIFACT_DIR", path)
+    patcher.start()
+    test.addCleanup(patcher.stop)
+    return path
+
+
+class MetadataPersistenceQueryTests(APITestCase):
+    """
+    ✅ Analyze/clean write a fixed number of queries, whatever the tag count
+    """
+
+    def setUp(self):
+        clear_tag_cache()
+        self.addCleanup(clear_tag_cache)
+        use_temp_artifact_dir(self)
+        self.user = User.objects.create_user(username="a@example.com", password="x")
+        self.client.force_authenticate(self.user)
+
+    def analyze(self, tag_count):
+        upload = SimpleUploadedFile("photo.jpg", b"\xff\xd8\xff\xd9", content_type="image/jpeg")
+        with mock.patch("files.records.analyze_metadata_cached", return_value=fake_analysis(tag_count)):
+            with self.captureOnCommitCallbacks(execute=True):
+                return self.client.post("/api/files/user/analyze/", {"file": upload}, format="multipart")
+
+    def test_analyze_query_count_does_not_grow_with_tags(self):
+        self.analyze(5)  # creates the user's policy and stats rows
+
+        # Unknown tag names: one SELECT, one INSERT and one SELECT more
+        with self.assertNumQueries(9):
+            response = self.analyze(10)
+        self.assertEqual(response.status_code, 200)
+
+        # Known tag names come from the process cache
+        with self.assertNumQueries(6):
+            response = self.analyze(10)
+        self.assertEqual(response.status_code, 200)
+
+        # 2,000 rows still go out in a handful of multi-row INSERTs
+        self.analyze(2000)
+        fields = [f for f in MetadataField._meta.concrete_fields if not f.primary_key]
+        batches = math.ceil(2000 / connection.ops.bulk_batch_size(fields, [None] * 2000))
+        with self.assertNumQueries(5 + batches):
+            response = self.analyze(2000)
+        self.assertEqual(response.status_code, 200)
+
+        analysis = FileAnalysis.objects.get(id=response.data["id"])
+        self.assertEqual(analysis.total_risk_score, 100.0)
+        self.assertEqual(analysis.risk_counts, {"High": 0, "Medium": 0, "Low": 0})
+        self.assertEqual(analysis.metadata_fields.count(), 2000)
+        self.assertEqual(analysis.metadata_fields.filter(category=FieldCategory.LOCATION).count(), 667)
+        self.assertEqual(MetadataTag.objects.count(), 2000)
+
+    def test_details_rebuild_metadata_from_field_rows(self):
+        metadata = fake_analysis(4)[0]
+        first = self.analyze(4).data["id"]
+        second = self.analyze(4).data["id"]
+        self.assertEqual(MetadataTag.objects.count(), 4)
+
+        # The analysis, then every field row joined to its tag
+        with self.assertNumQueries(2):
+            response = self.client.get(f"/api/files/user/history/{first}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [{k: m[k] for k in ("field", "value", "risk", "category", "risk_score")} for m in response.data["metadata_raw"]],
+            metadata,
+        )
+
+        response = self.client.get("/api/files/user/history/", {"view": "full"})
+        fields = {f["id"]: f["metadata_fields"] for f in response.data["files"]}
+        self.assertEqual([f["tag"] for f in fields[second]], ["Tag0", "Tag1", "Tag2", "Tag3"])
+        self.assertEqual([f["category"] for f in fields[second]], ["location", "other", "other", "location"])
+
+    def test_clean_marks_fields_with_one_update(self):
+        analysis_id = self.analyze(2000).data["id"]
+        upload = SimpleUploadedFile("photo.jpg", b"\xff\xd8\xff\xd9", content_type="image/jpeg")
+        cleaned = CleanedFile("a" * 64, "b" * 64, data=b"\xff\xd8\xff\xd9")
+
+        with mock.patch("files.records.clean_metadata_guest", return_value=cleaned):
+            with self.assertNumQueries(6):
+                response = self.client.post(
+                    "/api/files/user/clean/",
+                    {"file_id": analysis_id, "file": upload},
+                    format="multipart",
+                )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            MetadataField.objects.filter(analysis_id=analysis_id, removed=True).count(), 667
+        )
+
+
+class FileHistoryPaginationTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="b@example.com", password="x")
+        self.client.force_authenticate(self.user)
+        for i in range(5):
+            FileAnalysis.objects.create(
+                user=self.user, file_name=f"f{i}.jpg", file_type="image/jpeg", file_size=1,
+                sha256_before="0" * 64, risk_level="Low",
+            )
+
+    def test_cursor_walks_every_file_once(self):
+        seen, cursor = [], None
+        while True:
+            params = {"limit": 2, "view": "summary"}
+            if cursor:
+                params["cursor"] = cursor
+            response = self.client.get("/api/files/user/history/", params)
+            self.assertEqual(response.status_code, 200)
+            seen += [f["id"] for f in response.data["files"]]
+            self.assertNotIn("metadata_raw", response.data["files"][0])
+            cursor = response.data["next_cursor"]
+            if not cursor:
+                break
+
+        self.assertEqual(seen, list(FileAnalysis.objects.order_by("-scanned_at", "-id").values_list("id", flat=True)))
+
+    def test_history_is_always_paged(self):
+        with mock.patch("files.views.DEFAULT_PAGE_SIZE", 2):
+            response = self.client.get("/api/files/user/history/")
+            self.assertEqual(len(response.data["files"]), 2)
+            self.assertIsNotNone(response.data["next_cursor"])
+
+        # Oversized pages are capped
+        with mock.patch("files.history.MAX_PAGE_SIZE", 3):
+            response = self.client.get("/api/files/user/history/", {"limit": 10 ** 6})
+            self.assertEqual(len(response.data["files"]), 3)
+
+
+# (tag, value) -> (risk, category, score), as scored before the hint regex
+FIELD_RISK_BASELINE = [
+    # Location
+    ("GPSLatitude", "51 deg 30' 26.00\"", ("High", "Location", 9.5)),
+    ("GPSPosition", "51 deg N, 0 deg W", ("High", "Location", 9.5)),
+    ("Location", "Kitchen", ("High", "Location", 9.5)),
+    ("Sub-location", "Soho", ("High", "Location", 9.5)),
+    ("GPS", {"GPSLatitude": "51 deg"}, ("High", "Location", 9.5)),
+    # Name tags and human-name values
+    ("Artist", "Jane Doe", ("High", "Personal", 8.5)),
+    ("Author", "Jane Doe 2024 edition of the annual report", ("High", "Personal", 8.5)),
+    ("Creator", "jane", ("Medium", "Personal", 6.0)),
+    ("OwnerName", "12345678", ("Medium", "Personal", 4.5)),
+    ("Description", "Jane Doe", ("Medium", "Personal", 6.0)),
+    ("City", "London", ("Medium", "Personal", 6.0)),
+    ("Make", "Apple", ("Medium", "Personal", 6.0)),
+    ("Orientation", "Horizontal (normal)", ("Medium", "Personal", 6.0)),
+    # Email / phone values, whatever the tag
+    ("Comment", "mail me at jane@example.com", ("High", "Personal", 9.5)),
+    ("UserComment", "call 07700900123", ("High", "Personal", 9.5)),
+    # Device
+    ("Model", "iPhone 13", ("Medium", "Device", 4.0)),
+    ("Software", "17.1", ("Medium", "Device", 4.0)),
+    ("LensModel", "iPhone 13 back camera 5.1mm f/1.6", ("Medium", "Device", 4.0)),
+    ("SerialNumber", "C02XK0ABJG5H", ("Low", "Technical", 1.0)),
+    # Time
+    ("DateTimeOriginal", "2024:05:01 10:00:00", ("Low", "Time", 2.5)),
+    ("CreateDate", "2024:05:01 10:00:00", ("Low", "Time", 2.5)),
+    ("OffsetTime", "+01:00", ("Low", "Technical", 1.0)),
+    # Safe technical tags
+    ("ImageWidth", 640, ("Low", "Technical", 1.0)),
+    ("FileType", "JPEG", ("Low", "Technical", 1.0)),
+    ("MIMEType", "image/jpeg", ("Low", "Technical", 1.0)),
+    ("ColorSpace", "sRGB", ("Low", "Technical", 1.0)),
+    ("ProfileDescription", "Display P3", ("Low", "Technical", 1.0)),
+    ("ExposureTime", "1/120", ("Low", "Technical", 1.0)),
+    ("Rating", "", ("Low", "Technical", 1.0)),
+    # List and group (dict) values are scored on their str()
+    ("Keywords", ["travel", "uk"], ("Low", "Technical", 1.0)),
+    ("Subject", ["Jane Doe"], ("High", "Personal", 8.5)),
+    ("IFD0", {"Make": "Apple", "Artist": "Jane Doe"}, ("Medium", "Personal", 6.0)),
+    ("XMP-dc", {"Creator": "Jane Doe"}, ("Medium", "Personal", 6.0)),
+    ("File", {"FileType": "JPEG"}, ("Low", "Technical", 1.0)),
+    ("System", {"FileSize": "589 bytes"}, ("Low", "Technical", 1.0)),
+]
+
+
+class FieldRiskBaselineTests(TestCase):
+    """
+    ✅ The one-pass hint classifier scores tags exactly like the
+       original substring checks did
+    """
+
+    def test_representative_tags_keep_their_baseline_score(self):
+        for field, value, expected in FIELD_RISK_BASELINE:
+            with self.subTest(field=field, value=value):
+                self.assertEqual(calculate_field_risk(field, value), expected)
+
+    def test_classifier_finds_every_hint_class(self):
+        self.assertEqual(classify_field_name("GPSLatitude"), frozenset({"location"}))
+        self.assertEqual(classify_field_name("DateTimeOriginal"), frozenset({"time"}))
+        self.assertIn("name", classify_field_name("OwnerName"))
+        self.assertIn("device", classify_field_name("LensModel"))
+        self.assertIn("safe", classify_field_name("ColorSpace"))
+        # Several classes at once: the score order decides (safe wins here)
+        self.assertEqual(classify_field_name("ProfileDescription"), frozenset({"safe", "name"}))
+        self.assertEqual(classify_field_name("ImageWidth"), frozenset())
+
+
+# ================================
+# FIXTURE CORPUS (BUILT IN CODE)
+# ================================
+def tiff_bytes(ifd0, exif=None, gps=None, endian=">"):
+    """A TIFF structure with IFD0 and optional Exif/GPS IFDs. Entries are (tag, type, value)."""
+    ifds = [list(ifd0)]
+    if exif is not None:
+        ifds[0].append((0x8769, 4, None))
+        ifds.append(list(exif))
+    if gps is not None:
+        ifds[0].append((0x8825, 4, None))
+        ifds.append(list(gps))
+
+    offsets, position = [], 8
+    for entries in ifds:
+        offsets.append(position)
+        position += 2 + 12 * len(entries) + 4
+    data = bytearray()
+
+    def encode(type_id, value):
+        if type_id == 2:
+            return value.encode() + b"\x00", len(value) + 1
+        if type_id == 7:
+            return value, len(value)
+        if type_id == 5:
+            return b"".join(struct.pack(endian + "II", *v) for v in value), len(value)
+        fmt = {1: "B", 3: "H", 4: "I"}[type_id]
+        values = value if isinstance(value, (list, tuple)) else [value]
+        return struct.pack(f"{endian}{len(values)}{fmt}", *values), len(values)
+
+    body = bytearray(b"MM\x00*" if endian == ">" else b"II*\x00")
+    body += struct.pack(endian + "I", 8)
+    pointer_targets = {0x8769: offsets[1] if exif is not None else 0,
+                       0x8825: offsets[-1] if gps is not None else 0}
+
+    for entries in ifds:
+        body += struct.pack(endian + "H", len(entries))
+        for tag, type_id, value in sorted(entries, key=lambda e: e[0]):
+            if value is None:
+                body += struct.pack(endian + "HHII", tag, 4, 1, pointer_targets[tag])
+                continue
+            raw, count = encode(type_id, value)
+            if len(raw) <= 4:
+                body += struct.pack(endian + "HHI", tag, type_id, count) + raw.ljust(4, b"\x00")
+            else:
+                body += struct.pack(endian + "HHII", tag, type_id, count, position + len(data))
+                data += raw + (b"\x00" if len(raw) % 2 else b"")
+        body += struct.pack(endian + "I", 0)
+
+    return bytes(body + data)
+
+
+def segment(marker, payload):
+    return bytes([0xFF, marker]) + struct.pack(">H", len(payload) + 2) + payload
+
+
+def jpeg_bytes(*segments):
+    sof = segment(0xC0, bytes([8]) + struct.pack(">HH", 480, 640) + b"\x03\x01\x22\x00\x02\x11\x01\x03\x11\x01")
+    sos = segment(0xDA, b"\x03\x01\x00\x02\x11\x03\x11\x00\x3f\x00")
+    return b"\xff\xd8" + b"".join(segments) + sof + sos + b"\x00" * 16 + b"\xff\xd9"
+
+
+def png_bytes(*chunks):
+    out = b"\x89PNG\r\n\x1a\n"
+    for kind, data in (
+        (b"IHDR", struct.pack(">IIBBBBB", 640, 480, 8, 2, 0, 0, 0)),
+        *chunks,
+        (b"IDAT", zlib.compress(b"\x00" * 16)),
+        (b"IEND", b""),
+    ):
+        out += struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    return out
+
+
+PHONE_EXIF = dict(
+    ifd0=[
+        (0x010F, 2, "Apple"), (0x0110, 2, "iPhone 13"), (0x0112, 3, 1),
+        (0x011A, 5, [(72, 1)]), (0x011B, 5, [(72, 1)]), (0x0128, 3, 2),
+        (0x0131, 2, "17.1"), (0x0132, 2, "2024:05:01 10:00:00"), (0x013B, 2, "Jane Doe"),
+    ],
+    exif=[
+        (0x829A, 5, [(1, 120)]), (0x829D, 5, [(16, 10)]), (0x8827, 3, 50),
+        (0x9000, 7, b"0232"), (0x9003, 2, "2024:05:01 10:00:00"),
+        (0x9004, 2, "2024:05:01 10:00:00"), (0x920A, 5, [(51, 10)]),
+        (0x9291, 2, "123"), (0xA001, 3, 1),
+    ],
+    gps=[
+        (0x01, 2, "N"), (0x02, 5, [(51, 1), (30, 1), (2600, 100)]),
+        (0x03, 2, "W"), (0x04, 5, [(0, 1), (7, 1), (4000, 100)]),
+        (0x05, 1, 0), (0x06, 5, [(35, 1)]),
+    ],
+)
+
+XMP_PACKET = (
+    b'<x:xmpmeta xmlns:x="adobe:ns:meta/" x:xmptk="XMP Core 6.0.0">'
+    b'<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+    b'<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/"'
+    b' xmlns:photoshop="http://ns.adobe.com/photoshop/1.0/" photoshop:City="London">'
+    b'<dc:creator><rdf:Seq><rdf:li>Jane Doe</rdf:li></rdf:Seq></dc:creator>'
+    b'</rdf:Description></rdf:RDF></x:xmpmeta>'
+)
+
+
+def iptc_segment():
+    datasets = b"".join(
+        b"\x1c\x02" + bytes([dataset]) + struct.pack(">H", len(value)) + value
+        for dataset, value in ((80, b"Jane Doe"), (90, b"London"), (25, b"travel"), (25, b"uk"))
+    )
+    block = b"8BIM\x04\x04\x00\x00" + struct.pack(">I", len(datasets)) + datasets
+    return segment(0xED, b"Photoshop 3.0\x00" + block + (b"\x00" if len(datasets) % 2 else b""))
+
+
+FIXTURES = {
+    "phone.jpg": jpeg_bytes(
+        segment(0xE1, b"Exif\x00\x00" + tiff_bytes(**PHONE_EXIF)),
+    ),
+    "tagged.jpg": jpeg_bytes(
+        segment(0xE0, b"JFIF\x00\x01\x01\x01\x00\x48\x00\x48\x00\x00"),
+        segment(0xE1, b"Exif\x00\x00" + tiff_bytes(**PHONE_EXIF, endian="<")),
+        segment(0xE1, b"http://ns.adobe.com/xap/1.0/\x00" + XMP_PACKET),
+        iptc_segment(),
+        segment(0xFE, b"holiday"),
+    ),
+    "plain.jpg": jpeg_bytes(segment(0xE0, b"JFIF\x00\x01\x02\x00\x00\x01\x00\x01\x00\x00")),
+    "text.png": png_bytes(
+        (b"pHYs", struct.pack(">IIB", 2835, 2835, 1)),
+        (b"tEXt", b"Author\x00Jane Doe"),
+        (b"iTXt", b"XML:com.adobe.xmp\x00\x00\x00\x00\x00" + XMP_PACKET),
+    ),
+    "scan.tif": tiff_bytes([
+        (0x0100, 3, 4), (0x0101, 3, 4), (0x0102, 3, 8), (0x0103, 3, 1), (0x0106, 3, 1),
+        (0x0111, 4, 8), (0x0115, 3, 1), (0x0116, 3, 4), (0x0117, 4, 16), (0x010F, 2, "Scanner Co"),
+    ]),
+}
+
+
+# `exiftool -j -a -u -g1` on FIXTURES["phone.jpg"] spooled to a temp file:
+# System describes the temp file, everything else is the upload's
+PHONE_JPG_EXIFTOOL_SPOOLED = r"""[{
+  "SourceFile": "/tmp/tmpk3v9q2xa",
+  "ExifTool": {"ExifToolVersion": 12.76},
+  "System": {
+    "FileName": "tmpk3v9q2xa",
+    "Directory": "/tmp",
+    "FileSize": "589 bytes",
+    "FileModifyDate": "2024:05:02 09:14:51+00:00",
+    "FileAccessDate": "2024:05:02 09:14:51+00:00",
+    "FileInodeChangeDate": "2024:05:02 09:14:51+00:00",
+    "FilePermissions": "-rw-------"
+  },
+  "File": {
+    "FileType": "JPEG",
+    "FileTypeExtension": "jpg",
+    "MIMEType": "image/jpeg",
+    "ExifByteOrder": "Big-endian (Motorola, MM)",
+    "ImageWidth": 640,
+    "ImageHeight": 480,
+    "EncodingProcess": "Baseline DCT, Huffman coding",
+    "BitsPerSample": 8,
+    "ColorComponents": 3,
+    "YCbCrSubSampling": "YCbCr4:2:0 (2 2)"
+  },
+  "IFD0": {
+    "Make": "Apple",
+    "Model": "iPhone 13",
+    "Orientation": "Horizontal (normal)",
+    "XResolution": 72,
+    "YResolution": 72,
+    "ResolutionUnit": "inches",
+    "Software": "17.1",
+    "ModifyDate": "2024:05:01 10:00:00",
+    "Artist": "Jane Doe"
+  },
+  "ExifIFD": {
+    "ExposureTime": "1/120",
+    "FNumber": 1.6,
+    "ISO": 50,
+    "ExifVersion": "0232",
+    "DateTimeOriginal": "2024:05:01 10:00:00",
+    "CreateDate": "2024:05:01 10:00:00",
+    "FocalLength": "5.1 mm",
+    "SubSecTimeOriginal": "123",
+    "ColorSpace": "sRGB"
+  },
+  "GPS": {
+    "GPSLatitudeRef": "North",
+    "GPSLatitude": "51 deg 30' 26.00\"",
+    "GPSLongitudeRef": "West",
+    "GPSLongitude": "0 deg 7' 40.00\"",
+    "GPSAltitudeRef": "Above Sea Level",
+    "GPSAltitude": "35 m"
+  },
+  "Composite": {
+    "ImageSize": "640x480",
+    "Megapixels": 0.307,
+    "Aperture": 1.6,
+    "ShutterSpeed": "1/120",
+    "LightValue": 9.3,
+    "FocalLength35efl": "5.1 mm",
+    "SubSecDateTimeOriginal": "2024:05:01 10:00:00.123",
+    "GPSLatitude": "51 deg 30' 26.00\" N",
+    "GPSLongitude": "0 deg 7' 40.00\" W",
+    "GPSPosition": "51 deg 30' 26.00\" N, 0 deg 7' 40.00\" W",
+    "GPSAltitude": "35 m Above Sea Level"
+  }
+}]"""
+
+
+class FastPathExtractorTests(TestCase):
+    """
+    ✅ Header-only JPEG/PNG/TIFF reader: ExifTool's -g1 groups and tag names
+    ✅ Anything it does not fully understand is left to ExifTool
+    """
+
+    def test_phone_jpeg_groups(self):
+        raw = parse_buffer(memoryview(FIXTURES["phone.jpg"]))
+
+        self.assertEqual(raw["IFD0"]["Make"], "Apple")
+        self.assertEqual(raw["IFD0"]["Orientation"], "Horizontal (normal)")
+        self.assertEqual(raw["ExifIFD"]["ExposureTime"], "1/120")
+        self.assertEqual(raw["ExifIFD"]["FNumber"], 1.6)
+        self.assertEqual(raw["GPS"]["GPSLatitude"], "51 deg 30' 26.00\"")
+        self.assertEqual(raw["Composite"]["GPSPosition"], "51 deg 30' 26.00\" N, 0 deg 7' 40.00\" W")
+        self.assertEqual(raw["Composite"]["SubSecDateTimeOriginal"], "2024:05:01 10:00:00.123")
+        self.assertEqual(raw["File"]["ImageWidth"], 640)
+        self.assertEqual(raw["File"]["YCbCrSubSampling"], "YCbCr4:2:0 (2 2)")
+
+    def test_xmp_iptc_and_png_text(self):
+        raw = parse_buffer(memoryview(FIXTURES["tagged.jpg"]))
+        self.assertEqual(raw["XMP-dc"]["Creator"], "Jane Doe")
+        self.assertEqual(raw["XMP-photoshop"]["City"], "London")
+        self.assertEqual(raw["IPTC"]["Keywords"], ["travel", "uk"])
+        self.assertEqual(raw["File"]["Comment"], "holiday")
+
+        raw = parse_buffer(memoryview(FIXTURES["scan.tif"]))
+        self.assertEqual(raw["IFD0"]["Make"], "Scanner Co")
+        self.assertEqual(raw["Composite"]["ImageSize"], "4x4")
+
+        raw = parse_buffer(memoryview(FIXTURES["text.png"]))
+        self.assertEqual(raw["PNG"]["Author"], "Jane Doe")
+        self.assertEqual(raw["PNG-pHYs"]["PixelUnits"], "meters")
+        self.assertEqual(raw["XMP-dc"]["Creator"], "Jane Doe")
+
+    def test_scoring_sees_the_same_fields(self):
+        metadata = score_metadata(parse_buffer(memoryview(FIXTURES["phone.jpg"])), ["GPSLatitude"])[0]
+        by_field = {m["field"]: m for m in metadata}
+        self.assertEqual(by_field["GPS"]["risk"], "High")
+        self.assertEqual(by_field["IFD0"]["category"], "Personal")
+
+    def test_unsupported_files_fall_back(self):
+        with_makernote = dict(PHONE_EXIF, exif=PHONE_EXIF["exif"] + [(0x927C, 7, b"Apple iOS\x00\x00\x01MM")])
+        for data in (
+            jpeg_bytes(segment(0xE1, b"Exif\x00\x00" + tiff_bytes(**with_makernote))),
+            jpeg_bytes(segment(0xE2, b"ICC_PROFILE\x00\x01\x01" + b"\x00" * 128)),
+            FIXTURES["phone.jpg"] + b"trailer",
+            png_bytes((b"iCCP", b"icc\x00\x00" + zlib.compress(b"\x00" * 32))),
+            b"GIF89a" + b"\x00" * 32,
+            b"\xff\xd8\xff",
+        ):
+            upload = SimpleUploadedFile("x.bin", data)
+            self.assertIsNone(extract_metadata_fast(upload))
+
+    def test_hostile_values_fall_back_instead_of_raising(self):
+        huge_aperture = tiff_bytes([(0x0112, 3, 1)], exif=[(0x9202, 5, [(4294967295, 1)])])
+        bomb = zlib.compress(b"\x00" * (8 * 1024 * 1024))
+        for data in (
+            huge_aperture,
+            jpeg_bytes(segment(0xE1, b"Exif\x00\x00" + huge_aperture)),
+            png_bytes((b"zTXt", b"Comment\x00\x00" + bomb)),
+            png_bytes((b"iTXt", b"Comment\x00\x01\x00\x00\x00" + bomb)),
+        ):
+            self.assertIsNone(extract_metadata_fast(SimpleUploadedFile("x.bin", data)))
+
+    def test_in_memory_and_temp_file_uploads(self):
+        data = FIXTURES["phone.jpg"]
+        upload = SimpleUploadedFile("photo.jpg", data, content_type="image/jpeg")
+        self.assertEqual(extract_metadata_fast(upload)["IFD0"]["Model"], "iPhone 13")
+        # No view of the upload's buffer outlives the read, even while an
+        # error's traceback still holds the parser's frames
+        with mock.patch("files.fastpath.parse_buffer", side_effect=RuntimeError("parser bug")):
+            try:
+                extract_metadata_fast(upload)
+            except RuntimeError:
+                upload.file.truncate(0)
+        upload.close()
+
+        temp = TemporaryUploadedFile("photo.jpg", "image/jpeg", len(data), None)
+        temp.write(data)
+        temp.flush()
+        try:
+            self.assertEqual(extract_metadata_fast(temp)["IFD0"]["Model"], "iPhone 13")
+        finally:
+            temp.close()
+
+
+class ExifToolOutputTests(TestCase):
+    """
+    ✅ ExifTool on a spooled temp file, ExifTool on stdin and the fast path
+       report the same groups and tags for one upload, and score the same
+    """
+
+    def scored(self, raw):
+        return {m["field"]: (m["value"], m["risk"], m["category"]) for m in score_metadata(raw, ["GPSLatitude"])[0]}
+
+    def test_spooled_output_matches_the_fast_path(self):
+        result = subprocess.CompletedProcess([], 0, stdout=PHONE_JPG_EXIFTOOL_SPOOLED, stderr="")
+        with mock.patch("files.services.run_exiftool", return_value=result):
+            real = extract_metadata("/tmp/tmpk3v9q2xa")
+        fast = parse_buffer(memoryview(FIXTURES["phone.jpg"]))
+
+        self.assertEqual(real["System"], {"FileSize": "589 bytes"})
+        self.assertEqual(
+            {group: values for group, values in real.items() if group not in ("SourceFile", "ExifTool")},
+            {group: values for group, values in fast.items() if group != "SourceFile"},
+        )
+        self.assertEqual(self.scored(real), self.scored(fast))
+
+    def test_piped_output_has_no_temp_file_tags(self):
+        raw = upload_metadata({"SourceFile": "-", "System": {"FileSize": "589 bytes"}, "File": {"FileType": "JPEG"}})
+        self.assertEqual(raw["System"], {"FileSize": "589 bytes"})
+
+        raw = upload_metadata({"SourceFile": "/tmp/x", "System": {"FileName": "x", "Directory": "/tmp"}})
+        self.assertNotIn("System", raw)
+
+
+def exiftool_available() -> bool:
+    try:
+        return subprocess.run([EXIFTOOL_PATH, "-ver"], capture_output=True, timeout=10).returncode == 0
+    except (OSError, subprocess.SubprocessError):
+        return False
+
+
+@skipUnless(exiftool_available(), "ExifTool is not installed")
+class FastPathExifToolEquivalenceTests(TestCase):
+    """
+    ✅ On the fixture corpus the fast path reports the same groups and tags
+       as ExifTool, and every field scores the same
+    """
+
+    def test_fixture_corpus_matches_exiftool(self):
+        for name, data in FIXTURES.items():
+            with self.subTest(fixture=name):
+                fast = parse_buffer(memoryview(data))
+                real = extract_metadata_stream([data])
+                with tempfile.NamedTemporaryFile(suffix=".upload") as tmp:
+                    tmp.write(data)
+                    tmp.flush()
+                    spooled = extract_metadata(tmp.name)
+
+                def tags(raw):
+                    return {
+                        group: set(values) for group, values in raw.items()
+                        if isinstance(values, dict) and group != "ExifTool"
+                    }
+
+                self.assertEqual(tags(fast), tags(real))
+                self.assertEqual(tags(fast), tags(spooled))
+
+                def scored(raw):
+                    return {
+                        m["field"]: (m["risk"], m["category"], m["will_be_removed"])
+                        for m in score_metadata(raw, ["GPSLatitude", "GPSLongitude", "Creator"])[0]
+                    }
+
+                self.assertEqual(scored(fast), scored(real))
+                self.assertEqual(scored(fast), scored(spooled))
+
+
+@skipUnless(exiftool_available(), "ExifTool is not installed")
+class RemovalPredictionExifToolTests(TestCase):
+    """
+    ✅ The dry-run removal agrees with a real ExifTool clean on the fixture corpus
+    """
+
+    def test_prediction_matches_a_real_clean(self):
+        for name, data in FIXTURES.items():
+            with self.subTest(fixture=name):
+                directory = tempfile.mkdtemp()
+                self.addCleanup(shutil.rmtree, directory, True)
+                path = os.path.join(directory, name)
+                with open(path, "wb") as f:
+                    f.write(data)
+
+                report = verify_removal_prediction(path)
+                self.assertEqual(report["unexpected"], [])
+                self.assertTrue(report["match"])
+                self.assertEqual(report["predicted_remaining"], report["actual_remaining"])
+
+
+def atom(kind, payload):
+    return struct.pack(">I", len(payload) + 8) + kind + payload
+
+
+class FastScanTests(APITestCase):
+    """
+    ✅ Large media: ExifTool is fed the header atoms only, never the media data
+    ✅ The response says the result came from a partial read
+    ✅ On the analyze endpoints the media data isn't even stored while uploading
+    """
+
+    def setUp(self):
+        get_analysis_cache().clear()
+        for target in ("files.fastscan.FAST_SCAN_MIN_BYTES", "files.uploads.FAST_SCAN_MIN_BYTES"):
+            patcher = mock.patch(target, 1024)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def camera_clip(self):
+        ftyp = atom(b"ftyp", b"qt  \x00\x00\x02\x00qt  ")
+        # 64-bit size, as for media data over 4 GB
+        mdat = struct.pack(">I4sQ", 1, b"mdat", 16 + 50000) + b"\xaa" * 50000
+        moov = atom(b"moov", atom(b"mvhd", b"\x00" * 100))
+        return ftyp + mdat + moov
+
+    def test_quicktime_skips_media_data(self):
+        ftyp = atom(b"ftyp", b"qt  \x00\x00\x02\x00qt  ")
+        moov = atom(b"moov", atom(b"mvhd", b"\x00" * 100))
+        # moov after mdat, as cameras write it
+        data = ftyp + atom(b"mdat", b"\xaa" * 50000) + moov
+        plan = plan_fast_scan(SimpleUploadedFile("clip.mov", data))
+
+        self.assertEqual(plan.mode, "quicktime-atoms")
+        self.assertEqual(b"".join(plan.chunks), ftyp + b"\x00\x00\x00\x08mdat" + moov)
+        self.assertEqual(plan.report()["bytes_read"], len(ftyp) + 8 + len(moov))
+
+    def test_partial_read_is_reported(self):
+        data = b"\xff\xd8\xff\xe1" + b"\x00" * 5000
+        output = ExifToolResult(0, b'[{"SourceFile": "-", "File": {"FileType": "JPEG"}}]', b"")
+
+        with mock.patch("files.services.extract_metadata_fast", return_value=None), \
+                mock.patch("files.services.run_exiftool_stream", return_value=output) as run:
+            result = analyze_metadata_guest(SimpleUploadedFile("big.jpg", data))
+
+        self.assertEqual(run.call_args[0][0][0], "-fast")
+        self.assertEqual(result.scan["mode"], "head")
+        self.assertEqual(result.scan["file_size"], len(data))
+
+    def test_streamed_upload_keeps_what_a_read_from_disk_would(self):
+        data = self.camera_clip()
+        expected = b"".join(plan_fast_scan(SimpleUploadedFile("clip.mov", data)).chunks)
+        for chunk_size in (1, 7, 4096):
+            collector = HeaderCollector("quicktime-atoms")
+            for start in range(0, len(data), chunk_size):
+                collector.feed(data[start:start + chunk_size])
+            self.assertEqual(b"".join(collector.plan(len(data)).chunks), expected)
+
+        with mock.patch("files.fastscan.FAST_SCAN_HEAD_BYTES", 10):
+            collector = HeaderCollector("head")
+            collector.feed(b"\xff\xd8\xff" + b"\x00" * 100)
+        self.assertEqual(collector.plan(103).bytes_read, 10)
+
+    def test_analyze_upload_never_stores_the_media_data(self):
+        self.client.force_authenticate(User.objects.create_user(username="f@example.com", password="x"))
+        data = self.camera_clip()
+        output = ExifToolResult(0, b'[{"SourceFile": "-", "File": {"FileType": "MOV"}}]', b"")
+
+        with mock.patch.object(Sha256UploadMixin, "receive_data_chunk") as stored, \
+                mock.patch("files.services.run_exiftool_stream", return_value=output) as run:
+            upload = SimpleUploadedFile("clip.mov", data, content_type="video/quicktime")
+            response = self.client.post("/api/files/user/analyze/", {"file": upload}, format="multipart")
+
+        self.assertEqual(response.status_code, 200)
+        stored.assert_not_called()
+        self.assertEqual(b"".join(run.call_args[0][1]), b"".join(plan_fast_scan(SimpleUploadedFile("c", data)).chunks))
+        self.assertTrue(response.data["partial_read"])
+        self.assertEqual(response.data["scan"]["file_size"], len(data))
+        self.assertEqual(response.data["sha256_before"], hashlib.sha256(data).hexdigest())
+        self.assertEqual(FileAnalysis.objects.get(id=response.data["id"]).file_size, len(data))
+
+    def test_other_formats_and_small_files_get_a_full_scan(self):
+        self.assertIsNone(plan_fast_scan(SimpleUploadedFile("a.bin", b"\x00" * 4096)))
+        self.assertIsNone(plan_fast_scan(SimpleUploadedFile("a.mov", atom(b"ftyp", b"qt  "))))
+        # Truncated atom sizes can't be trusted
+        self.assertIsNone(plan_fast_scan(SimpleUploadedFile("a.mp4", atom(b"ftyp", b"isom") + b"\x00\x10\x00\x00mdat" + b"\x00" * 2000)))
+
+
+class NativeJpegCleanTests(TestCase):
+    """
+    ✅ Guest policy tags leave EXIF, XMP and IPTC; the image data is copied untouched
+    ✅ Anything else is left to ExifTool
+    """
+
+    def clean(self, upload):
+        cleaned = clean_jpeg_native(upload, upload_sha256(upload), GUEST_METADATA_POLICY["remove"])
+        self.assertIsNotNone(cleaned)
+        with cleaned.open() as f:
+            output = f.read()
+        self.assertEqual(hashlib.sha256(output).hexdigest(), cleaned.sha256_after)
+        self.assertEqual(len(output), cleaned.size)
+        return output
+
+    def test_policy_tags_are_removed(self):
+        data = FIXTURES["tagged.jpg"]
+        output = self.clean(SimpleUploadedFile("photo.jpg", data, content_type="image/jpeg"))
+        raw = parse_buffer(memoryview(output))
+
+        self.assertNotIn("GPSLatitude", raw["GPS"])
+        self.assertNotIn("GPSLongitude", raw["GPS"])
+        self.assertNotIn("GPSAltitude", raw["GPS"])
+        # GPSPosition on the list takes the refs with it, as ExifTool does
+        self.assertEqual(raw["GPS"], {"GPSAltitudeRef": "Above Sea Level"})
+        self.assertNotIn("XMP-dc", raw)
+        self.assertNotIn("XMP-photoshop", raw)
+        self.assertEqual(raw["IPTC"], {"By-line": "Jane Doe", "Keywords": ["travel", "uk"]})
+        self.assertEqual(raw["IFD0"]["Artist"], "Jane Doe")  # not on the guest list
+        self.assertEqual(raw["File"]["CurrentIPTCDigest"], hashlib.md5(b"".join(
+            b"\x1c\x02" + bytes([d]) + struct.pack(">H", len(v)) + v
+            for d, v in ((80, b"Jane Doe"), (25, b"travel"), (25, b"uk"))
+        )).hexdigest())
+
+        # Coordinates are zeroed, not just unlinked
+        self.assertNotIn(struct.pack("<II", 2600, 100), output)
+        # Scan data and EOI come through byte for byte
+        scan = data.index(b"\xff\xda")
+        self.assertTrue(output.endswith(data[scan:]))
+
+    def test_disk_uploads_stream_ranges(self):
+        data = FIXTURES["phone.jpg"]
+        temp = TemporaryUploadedFile("photo.jpg", "image/jpeg", len(data), None)
+        temp.write(data)
+        temp.flush()
+        temp.seek(0)
+        try:
+            output = self.clean(temp)
+        finally:
+            temp.close()
+        self.assertNotIn("GPSLatitude", parse_buffer(memoryview(output))["GPS"])
+
+    def test_nothing_to_remove_keeps_the_file(self):
+        data = FIXTURES["plain.jpg"]
+        self.assertEqual(self.clean(SimpleUploadedFile("p.jpg", data)), data)
+
+    def test_unsupported_jpegs_fall_back(self):
+        extended = jpeg_bytes(segment(0xE1, b"http://ns.adobe.com/xmp/extension/\x00" + b"0" * 40))
+        for data in (extended, FIXTURES["text.png"], b"\xff\xd8\xff"):
+            upload = SimpleUploadedFile("x.jpg", data)
+            self.assertIsNone(clean_jpeg_native(upload, "0" * 64, GUEST_METADATA_POLICY["remove"]))
+
+
+class CompiledPolicyTests(APITestCase):
+    """
+    ✅ A user's flags compile to one remove list with group deletes
+    ✅ Saving the policy drops the cached compile, cleans follow it
+    """
+
+    def setUp(self):
+        use_temp_artifact_dir(self)
+        self.user = User.objects.create_user(username="p@example.com", password="x")
+        self.client.force_authenticate(self.user)
+
+    def test_compile_uses_group_deletes(self):
+        compiled = compile_policy(frozenset({"remove_location", "remove_personal"}))
+        self.assertIn("-gps:all=", compiled.args)
+        # Covered by the group, and listed by more than one category once
+        self.assertNotIn("-GPSPosition=", compiled.args)
+        self.assertEqual(len(compiled.args), len({a.lower() for a in compiled.args}))
+        self.assertNotIn("-Make=", compiled.args)
+        self.assertEqual(compiled.categories, ("location", "personal"))
+        self.assertIs(compile_policy(frozenset({"remove_personal", "remove_location"})), compiled)
+
+    def test_policy_put_changes_the_compiled_policy(self):
+        before = compiled_policy_for_user(self.user)
+        self.assertIn("device", before.categories)
+
+        response = self.client.put("/api/files/user/policy/", {"remove_device": False}, format="json")
+        self.assertEqual(response.status_code, 200)
+
+        user = User.objects.select_related("metadata_policy").get(id=self.user.id)
+        after = compiled_policy_for_user(user)
+        self.assertNotEqual(after.version, before.version)
+        self.assertNotIn("device", after.categories)
+        self.assertNotIn("-Model=", after.args)
+
+    def test_clean_marks_only_policy_categories(self):
+        UserMetadataPolicy.objects.create(user=self.user, remove_device=False)
+        upload = SimpleUploadedFile("photo.jpg", b"\xff\xd8\xff\xd9", content_type="image/jpeg")
+        with mock.patch("files.records.analyze_metadata_cached", return_value=fake_analysis(30)) as analyze:
+            analysis_id = self.client.post("/api/files/user/analyze/", {"file": upload}, format="multipart").data["id"]
+        self.assertIn("gps:all", analyze.call_args.args[2])
+
+        cleaned = CleanedFile("a" * 64, "b" * 64, data=b"\xff\xd8\xff\xd9")
+        upload = SimpleUploadedFile("photo.jpg", b"\xff\xd8\xff\xd9", content_type="image/jpeg")
+        with mock.patch("files.records.clean_metadata_guest", return_value=cleaned) as clean:
+            self.client.post("/api/files/user/clean/", {"file_id": analysis_id, "file": upload}, format="multipart")
+
+        policy = clean.call_args.args[2]
+        self.assertIn("-gps:all=", policy.args)
+        self.assertEqual(policy.categories, ("location", "personal"))
+        removed = MetadataField.objects.filter(analysis_id=analysis_id, removed=True)
+        self.assertEqual(removed.count(), 10)
+
+    def test_native_clean_drops_the_gps_ifd(self):
+        compiled = compile_policy(frozenset({"remove_location"}))
+        upload = SimpleUploadedFile("photo.jpg", FIXTURES["tagged.jpg"], content_type="image/jpeg")
+        cleaned = clean_jpeg_native(upload, upload_sha256(upload), compiled.remove)
+        with cleaned.open() as f:
+            output = f.read()
+
+        raw = parse_buffer(memoryview(output))
+        self.assertNotIn("GPS", raw)
+        self.assertEqual(raw["IFD0"]["Artist"], "Jane Doe")
+        self.assertNotIn(struct.pack("<II", 2600, 100), output)
+
+
+# Stands in for ExifTool: -stay_open mode answers each job with its own
+# arguments; one-shot mode answers with the byte count read from stdin.
+# "crash", "crash-once <flag file>", "hang" and "noise" misbehave on purpose.
+FAKE_EXIFTOOL = """
+import os, sys, time
+
+def act(args):
+    if "crash" in args:
+        sys.exit(1)
+    if "crash-once" in args:
+        flag = args[args.index("crash-once") + 1]
+        if os.path.exists(flag):
+            os.remove(flag)
+            sys.exit(1)
+    if "hang" in args:
+        time.sleep(60)
+    if "noise" in args:
+        sys.stderr.write("warning " * 200000)
+        sys.stderr.flush()
+
+if "-stay_open" not in sys.argv:
+    act(sys.argv[1:])
+    sys.stdout.write(str(len(sys.stdin.buffer.read())))
+    sys.exit(0)
+
+args = []
+while True:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    line = line.rstrip("\\n")
+    if line.startswith("-execute"):
+        seq = line[len("-execute"):]
+        act(args)
+        job = [a for a in args if a != "-echo4" and not a.startswith("=$")]
+        sys.stdout.write(" ".join(job) + "\\n{ready" + seq + "}\\n")
+        sys.stdout.flush()
+        sys.stderr.write("=0=post" + seq + "\\n")
+        sys.stderr.flush()
+        args = []
+    elif line == "False" and args[-1:] == ["-stay_open"]:
+        break
+    else:
+        args.append(line)
+"""
+
+
+def fake_exiftool(test) -> str:
+    """Path to an executable fake ExifTool, removed after the test"""
+    directory = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, directory, True)
+    path = os.path.join(directory, "exiftool")
+    with open(path, "w") as f:
+        f.write(f"#!{sys.executable}\n" + FAKE_EXIFTOOL)
+    os.chmod(path, 0o755)
+    return path
+
+
+@skipUnless(os.name == "posix", "Fake ExifTool is a shebang script")
+class ExifToolPoolTests(TestCase):
+    """
+    ✅ Workers are recycled after max_jobs and after a crash
+    ✅ A crash is retried once on a fresh worker, a timeout is not
+    ✅ A hung worker is killed at the job deadline
+    """
+
+    def setUp(self):
+        self.executable = fake_exiftool(self)
+
+    def pool(self, **options):
+        pool = ExifToolPool(executable=self.executable, **options)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_workers_are_recycled(self):
+        pool = self.pool(size=1, max_jobs=2)
+        self.assertEqual([pool.execute(["-j", str(n)]).text for n in range(3)], ["-j 0", "-j 1", "-j 2"])
+        self.assertEqual(pool.recycled, 1)
+
+        with self.assertRaises(ExifToolCrashed):
+            pool.execute(["crash"])
+        self.assertEqual(pool.recycled, 2)
+        self.assertEqual(pool.execute(["-ver"]).text, "-ver")
+
+    def test_crash_is_retried_once(self):
+        flag = os.path.join(os.path.dirname(self.executable), "crash")
+        open(flag, "w").close()
+        pool = self.pool(size=1)
+        with mock.patch("files.exiftool._pool", pool):
+            result = run_exiftool(["crash-once", flag])
+        self.assertEqual(result.text, f"crash-once {flag}")
+        self.assertEqual(pool.recycled, 1)
+
+    def test_hung_worker_is_killed_at_the_deadline(self):
+        pool = self.pool(size=1, timeout=1)
+        started = time.monotonic()
+        with mock.patch("files.exiftool._pool", pool), self.assertRaises(ExifToolTimeout):
+            run_exiftool(["hang"])
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(pool.recycled, 1)
+        self.assertEqual(pool.execute(["-ver"]).text, "-ver")
+
+    def test_timeouts_are_counted(self):
+        before = EXIFTOOL_RUNS.values.get(("timeout",), 0)
+        with mock.patch("files.exiftool._pool", self.pool(size=1, timeout=1)), self.assertRaises(ExifToolTimeout):
+            run_exiftool(["hang"])
+        with mock.patch("files.exiftool.EXIFTOOL_POOL_SIZE", 0), \
+                mock.patch("files.exiftool.EXIFTOOL_PATH", self.executable), \
+                mock.patch("files.exiftool.EXIFTOOL_TIMEOUT", 1), \
+                self.assertRaises(ExifToolTimeout):
+            run_exiftool(["hang"])
+        self.assertEqual(EXIFTOOL_RUNS.values[("timeout",)], before + 2)
+
+    def test_chatty_stderr_does_not_block(self):
+        result = self.pool(size=1, timeout=10).execute(["noise"])
+        self.assertEqual(result.text, "noise")
+        self.assertEqual(len(result.stderr), len("warning " * 200000))
+
+
+@skipUnless(os.name == "posix", "Fake ExifTool is a shebang script")
+class ExifToolPipeTests(TestCase):
+    """
+    ✅ Streamed reads go through the stay-open pool when there is one
+    ✅ Without a pool they are piped, and the pipe's deadline holds
+    """
+
+    def setUp(self):
+        self.executable = fake_exiftool(self)
+        patcher = mock.patch("files.exiftool.EXIFTOOL_PATH", self.executable)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stream_uses_the_pool(self):
+        pool = ExifToolPool(size=1, executable=self.executable)
+        self.addCleanup(pool.close)
+        with mock.patch("files.exiftool._pool", pool), \
+                mock.patch("files.exiftool.run_exiftool_pipe") as pipe:
+            result = run_exiftool_stream(["-j", "-"], [b"abc", b"def"])
+        pipe.assert_not_called()
+        args = result.text.split()
+        self.assertEqual(args[0], "-j")
+        self.assertTrue(os.path.isabs(args[1]))
+        self.assertFalse(os.path.exists(args[1]))
+
+    def test_pipe_without_pool(self):
+        with mock.patch("files.exiftool.EXIFTOOL_POOL_SIZE", 0):
+            result = run_exiftool_stream(["-j", "-"], [b"x" * 100000, b"y"])
+        self.assertEqual((result.status, result.text), (0, "100001"))
+
+    def test_pipe_deadline_kills_exiftool(self):
+        started = time.monotonic()
+        with mock.patch("files.exiftool.EXIFTOOL_TIMEOUT", 1), self.assertRaises(ExifToolTimeout):
+            run_exiftool_pipe(["hang", "-"], [b"x" * 1000])
+        self.assertLess(time.monotonic() - started, 5)
+
+
+@skipUnless(os.name == "posix", "Fake ExifTool is a shebang script")
+class ExifToolAsyncTests(TestCase):
+    """
+    ✅ Chunks are piped to an asyncio subprocess
+    ✅ At the deadline the process is killed and reaped, and the timeout counted
+    """
+
+    def setUp(self):
+        patcher = mock.patch("files.exiftool.EXIFTOOL_PATH", fake_exiftool(self))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_chunks_are_piped(self):
+        result = asyncio.run(run_exiftool_async(["-j", "-"], [b"x" * 100000, b"y"]))
+        self.assertEqual((result.status, result.text), (0, "100001"))
+
+    def test_hung_process_is_killed_at_the_deadline(self):
+        processes = []
+        spawn = asyncio.create_subprocess_exec
+
+        async def tracked(*args, **kwargs):
+            processes.append(await spawn(*args, **kwargs))
+            return processes[-1]
+
+        before = EXIFTOOL_RUNS.values.get(("timeout",), 0)
+        started = time.monotonic()
+        with mock.patch("files.exiftool.EXIFTOOL_TIMEOUT", 1), \
+                mock.patch("files.exiftool.asyncio.create_subprocess_exec", tracked), \
+                self.assertRaises(ExifToolTimeout):
+            asyncio.run(run_exiftool_async(["hang", "-"], [b"x" * 1000]))
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertIsNotNone(processes[0].returncode)
+        self.assertEqual(EXIFTOOL_RUNS.values[("timeout",)], before + 1)
+
+
+class AsyncViewTests(APITestCase):
+    """
+    ✅ POST only; guest endpoints refuse a JWT, user endpoints require one
+    ✅ Guest buckets and upload size limits apply as on the DRF views
+    ✅ An authenticated analyze is stored for that user
+    """
+
+    def setUp(self):
+        get_rate_limit_store().clear()
+        self.addCleanup(get_rate_limit_store().clear)
+        self.user = User.objects.create_user(username="a@example.com", password="x")
+        patcher = mock.patch("files.async_views.aanalyze_metadata_cached", new=mock.AsyncMock(return_value=fake_analysis(3)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def bearer(self):
+        return {"HTTP_AUTHORIZATION": f"Bearer {RefreshToken.for_user(self.user).access_token}"}
+
+    def post(self, url, data=None, **extra):
+        if data is None:
+            data = {"file": SimpleUploadedFile("photo.jpg", b"\xff\xd8\xff\xd9", content_type="image/jpeg")}
+        return self.client.post(url, data, format="multipart", **extra)
+
+    def test_auth_wrapper(self):
+        self.assertEqual(self.client.get("/api/files/async/guest/analyze/").status_code, 405)
+        self.assertEqual(self.post("/api/files/async/guest/analyze/", **self.bearer()).status_code, 400)
+        self.assertEqual(self.post("/api/files/async/user/analyze/").status_code, 401)
+        self.assertEqual(self.post("/api/files/async/user/analyze/", HTTP_AUTHORIZATION="Bearer junk").status_code, 401)
+
+    def test_guest_analyze_limits(self):
+        self.assertEqual(self.post("/api/files/async/guest/analyze/", {}).status_code, 400)
+        responses = [self.post("/api/files/async/guest/analyze/") for _ in range(6)]
+        self.assertEqual([r.status_code for r in responses], [200] * 5 + [429])
+        self.assertEqual(len(responses[0].json()["metadata"]), 3)
+        self.assertEqual(responses[-1]["Retry-After"], "60")
+
+    def test_upload_errors(self):
+        with mock.patch.dict("files.uploads.UPLOAD_LIMITS", {"*": {"guest": 8, "user": 8}}, clear=True):
+            self.assertEqual(self.post("/api/files/async/guest/analyze/", {"file": SimpleUploadedFile("a.jpg", b"\0" * 64)}).status_code, 413)
+            response = self.post("/api/files/async/user/analyze/", {"file": SimpleUploadedFile("a.jpg", b"\0" * 64)}, **self.bearer())
+        self.assertEqual(response.status_code, 413)
+        self.assertIn("limit", response.json()["error"])
+        self.assertEqual(self.post("/api/files/async/user/analyze/", {}, **self.bearer()).status_code, 400)
+
+    def test_user_analyze_is_stored(self):
+        response = self.post("/api/files/async/user/analyze/", **self.bearer())
+        self.assertEqual(response.status_code, 200)
+        analysis = FileAnalysis.objects.get(id=response.json()["id"])
+        self.assertEqual(analysis.user, self.user)
+        self.assertEqual(analysis.sha256_before, hashlib.sha256(b"\xff\xd8\xff\xd9").hexdigest())
+
+
+class AsyncServiceTests(TestCase):
+    """
+    ✅ Header parsing, hashing, native cleans and spooling run in worker
+       threads, never on the event loop
+    """
+
+    def test_blocking_steps_run_off_the_event_loop(self):
+        threads = {}
+
+        def recording(name, func):
+            def wrapper(*args, **kwargs):
+                threads[name] = threading.get_ident()
+                return func(*args, **kwargs)
+            return wrapper
+
+        @contextmanager
+        def recording_spool(uploaded_file):
+            threads["spool"] = threading.get_ident()
+            with spooled_upload(uploaded_file) as path:
+                yield path
+
+        async def run():
+            jpeg = SimpleUploadedFile("photo.jpg", FIXTURES["phone.jpg"], content_type="image/jpeg")
+            await aanalyze_metadata_guest(jpeg)
+            await aclean_metadata_guest(jpeg)
+            gif = SimpleUploadedFile("a.gif", b"GIF89a" + b"\x00" * 32, content_type="image/gif")
+            (await aclean_metadata_guest(gif, "a" * 64)).cleanup()
+            return threading.get_ident()
+
+        exiftool = mock.AsyncMock(return_value=subprocess.CompletedProcess([], 0, stdout=b"", stderr=b""))
+        with mock.patch("files.services.extract_metadata_fast", recording("extract", extract_metadata_fast)), \
+                mock.patch("files.services.upload_sha256", recording("hash", upload_sha256)), \
+                mock.patch("files.services.clean_jpeg_native", recording("clean", clean_jpeg_native)), \
+                mock.patch("files.services.spooled_upload", recording_spool), \
+                mock.patch("files.services.EXIFTOOL_PIPE_MAX_BYTES", 0), \
+                mock.patch("files.services.run_exiftool_async", exiftool), \
+                mock.patch("files.services.file_sha256", return_value="c" * 64):
+            loop_thread = asyncio.run(run())
+
+        self.assertEqual(set(threads), {"extract", "hash", "clean", "spool"})
+        self.assertNotIn(loop_thread, threads.values())
+
+
+class BenchmarkSuiteTests(TestCase):
+    """
+    ✅ The suite runs end to end on the fake ExifTool
+    ✅ Slower or hungrier than the baseline counts as a regression
+    ✅ Only a baseline recorded on this host is compared against
+    """
+
+    def test_suite_runs_without_exiftool(self):
+        with mock.patch("files.exiftool.EXIFTOOL_PATH", "/nonexistent/exiftool"):
+            results = run_benchmarks(calls=3, only="tagged.heic")
+
+        self.assertEqual(len(results), 3)
+        for r in results:
+            self.assertGreater(r.ops_per_sec, 0)
+            self.assertLessEqual(r.p50_us, r.p99_us)
+        # Same bytes every run
+        self.assertEqual(build_corpus()["small.jpg"].data, build_corpus()["small.jpg"].data)
+
+    def test_compare_flags_regressions(self):
+        results = run_benchmarks(calls=3, only="calculate_overall_risk[small")
+        r = results[0]
+        baseline = {r.name: {"p50_us": r.p50_us * 2, "alloc_peak_kb": r.alloc_peak_kb}}
+        self.assertFalse(compare_to_baseline(results, baseline)[0]["regressed"])
+
+        baseline[r.name]["p50_us"] = r.p50_us / 2
+        self.assertTrue(compare_to_baseline(results, baseline)[0]["regressed"])
+        self.assertFalse(compare_to_baseline(results, {})[0]["regressed"])
+
+    def test_baseline_from_another_host_is_not_compared(self):
+        path = os.path.join(tempfile.mkdtemp(), "baseline.json")
+        self.addCleanup(shutil.rmtree, os.path.dirname(path), True)
+        results = run_benchmarks(calls=3, only="calculate_overall_risk[small")
+        save_baseline(results, path)
+        self.assertEqual(set(load_baseline(path)), {results[0].name})
+
+        # A much faster machine recorded it
+        with open(path) as f:
+            stored = json.load(f)
+        stored["host"] = "ci-runner x86_64 CPython 3.0.0"
+        stored["benchmarks"][results[0].name]["p50_us"] = results[0].p50_us / 100
+        with open(path, "w") as f:
+            json.dump(stored, f)
+        with self.assertRaises(BaselineMismatch):
+            load_baseline(path)
+
+        err = io.StringIO()
+        call_command(
+            "benchmark_metadata", calls=3, only="calculate_overall_risk[small", baseline=path,
+            fail_on_regression=True, stdout=io.StringIO(), stderr=err,
+        )
+        self.assertIn("not comparing", err.getvalue())
+
+
+class StageTimingTests(APITestCase):
+    """
+    ✅ Analyze responses carry a Server-Timing header with each stage
+    ✅ The metrics endpoint exposes the same stages as histograms, to staff or the token
+    """
+
+    def setUp(self):
+        get_analysis_cache().clear()
+        get_rate_limit_store().clear()
+
+    def test_server_timing_header_lists_stages(self):
+        upload = SimpleUploadedFile("photo.jpg", FIXTURES["phone.jpg"], content_type="image/jpeg")
+        response = self.client.post("/api/files/guest/analyze/", {"file": upload}, format="multipart")
+        self.assertEqual(response.status_code, 200)
+
+        stages = [part.split(";")[0] for part in response["Server-Timing"].split(", ")]
+        for name in ("upload", "hash", "extract", "simulate_clean", "score", "total"):
+            self.assertIn(name, stages)
+        self.assertEqual(stages[-1], "total")
+
+    def test_metrics_endpoint(self):
+        upload = SimpleUploadedFile("photo.jpg", FIXTURES["phone.jpg"], content_type="image/jpeg")
+        self.client.post("/api/files/guest/analyze/", {"file": upload}, format="multipart")
+        record_exiftool(1)
+
+        # Not public, even with no token configured
+        self.assertEqual(self.client.get("/api/files/metrics/").status_code, 401)
+        self.client.force_login(User.objects.create_user(username="ops@example.com", is_staff=True))
+        response = self.client.get("/api/files/metrics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        body = response.content.decode()
+        self.assertIn("# TYPE metaguard_stage_seconds histogram", body)
+        self.assertIn('metaguard_stage_seconds_bucket{stage="extract",le="+Inf"}', body)
+        self.assertIn('metaguard_exiftool_runs_total{exit_code="1"}', body)
+        self.assertIn('metaguard_bytes_processed_total{operation="analyze"}', body)
+        self.assertIn("metaguard_tag_count_count", body)
+        self.assertGreaterEqual(EXIFTOOL_RUNS.values[("1",)], 1)
+        self.assertIn("# TYPE metaguard_request_seconds histogram", render_metrics())
+
+        self.client.logout()
+        with mock.patch("files.views.METRICS_TOKEN", "s3cret"):
+            self.assertEqual(self.client.get("/api/files/metrics/").status_code, 401)
+            self.assertEqual(self.client.get("/api/files/metrics/", HTTP_AUTHORIZATION="Bearer nope").status_code, 401)
+            self.assertEqual(self.client.get("/api/files/metrics/", HTTP_AUTHORIZATION="Bearer sécret").status_code, 401)
+            response = self.client.get("/api/files/metrics/", HTTP_AUTHORIZATION="Bearer s3cret")
+            self.assertEqual(response.status_code, 200)
+
+
+class AnalysisJobQueueTests(APITestCase):
+    """
+    ✅ Claims are exclusive; a dead worker's job is claimed again after its lease
+    ✅ A running job's lease is renewed only while the job is still its own
+    ✅ Long-polling returns at the deadline, whatever ?wait= says
+    """
+
+    def setUp(self):
+        spool = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool, True)
+        patcher = mock.patch("files.jobs.JOB_SPOOL_DIR", spool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username="j@example.com", password="x")
+        self.client.force_authenticate(self.user)
+
+    def enqueue(self):
+        upload = SimpleUploadedFile("photo.jpg", b"\xff\xd8\xff\xd9", content_type="image/jpeg")
+        with self.captureOnCommitCallbacks():
+            return enqueue_job(self.user, AnalysisJob.KIND_ANALYZE, upload)
+
+    def test_claim_and_lease_recovery(self):
+        job = self.enqueue()
+        claimed = claim_next_job()
+        self.assertEqual((claimed.id, claimed.attempts), (job.id, 1))
+        self.assertIsNone(claim_next_job())
+        self.assertTrue(renew_lease(claimed))
+
+        # The worker died: once the lease runs out the job is claimed again
+        AnalysisJob.objects.filter(id=job.id).update(locked_until=timezone.now() - timedelta(seconds=1))
+        reclaimed = claim_next_job()
+        self.assertEqual((reclaimed.id, reclaimed.attempts), (job.id, 2))
+        self.assertFalse(renew_lease(claimed))
+
+    def test_run_job_and_long_poll(self):
+        job = self.enqueue()
+        url = f"/api/files/user/jobs/{job.id}/"
+
+        started = time.monotonic()
+        for wait in ("nan", "inf", "-5"):
+            self.assertEqual(self.client.get(url, {"wait": wait}).data["status"], "queued")
+        self.assertIsNone(wait_for_job(job.id, User.objects.create_user(username="k@example.com"), timeout=float("nan")))
+        self.assertLess(time.monotonic() - started, 5)
+
+        with mock.patch("files.records.analyze_metadata_cached", return_value=fake_analysis(2)):
+            run_job(claim_next_job())
+        response = self.client.get(url, {"wait": "30"})
+        self.assertEqual(response.data["status"], "done")
+        self.assertEqual(len(response.data["result"]["metadata"]), 2)
+        self.assertFalse(os.path.exists(job.upload_path))
+
+
+class BatchAnalysisTests(APITestCase):
+    """
+    ✅ Files are stored as they finish, before their line goes out
+    ✅ An encrypted or corrupt ZIP member gets its own error line
+    ✅ Django's multipart cap allows a full batch
+    """
+
+    def setUp(self):
+        get_analysis_cache().clear()
+        self.user = User.objects.create_user(username="b@example.com", password="x")
+        self.client.force_authenticate(self.user)
+        patcher = mock.patch("files.batch.analyze_metadata_cached", return_value=fake_analysis(2))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post_batch(self, files):
+        response = self.client.post("/api/files/user/analyze/batch/", {"files": files}, format="multipart")
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+    def test_results_are_stored_before_they_are_reported(self):
+        uploads = [SimpleUploadedFile(f"{i}.jpg", bytes([i]) * 10) for i in range(3)]
+        with mock.patch("files.batch.BATCH_WORKERS", 1):
+            stream = stream_batch_analysis(self.user, uploads)
+            first = json.loads(next(stream))
+            # The client disconnects after one line: that file is already stored
+            stream.close()
+        self.assertEqual(first["status"], "ok")
+        self.assertTrue(FileAnalysis.objects.filter(id=first["id"], user=self.user).exists())
+
+    def test_bad_zip_members_only_fail_themselves(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_STORED) as zf:
+            zf.writestr("good.jpg", b"good bytes")
+            zf.writestr("corrupt.jpg", b"corrupt bytes")
+            zf.writestr("locked.jpg", b"locked bytes")
+        data = bytearray(archive.getvalue())
+        # Flip a byte of one entry (bad CRC) and mark another as encrypted
+        offset = data.index(b"corrupt bytes")
+        data[offset] ^= 0xFF
+        data[data.rindex(b"PK\x01\x02") + 8] |= 0x1  # last central directory entry
+
+        lines = self.post_batch([SimpleUploadedFile("batch.zip", bytes(data), content_type="application/zip")])
+        by_name = {line["file_name"]: line for line in lines if "summary" not in line}
+        self.assertEqual(by_name["good.jpg"]["status"], "ok")
+        self.assertIn("Unreadable", by_name["corrupt.jpg"]["error"])
+        self.assertIn("Encrypted", by_name["locked.jpg"]["error"])
+        summary = lines[-1]
+        self.assertEqual((summary["succeeded"], summary["failed"]), (1, 2))
+        self.assertEqual(summary["analyses"], [{"index": 0, "id": by_name["good.jpg"]["id"]}])
+
+    def test_more_files_than_djangos_default_cap(self):
+        self.assertGreaterEqual(settings.DATA_UPLOAD_MAX_NUMBER_FILES, BATCH_MAX_FILES)
+        lines = self.post_batch([SimpleUploadedFile(f"{i}.jpg", b"x%d" % i) for i in range(120)])
+        self.assertEqual(lines[-1]["succeeded"], 120)
+        self.assertEqual(FileAnalysis.objects.filter(user=self.user).count(), 120)
+
+
+class UserRiskStatsTests(APITestCase):
+    """
+    ✅ Analyze/clean keep the user's stats row current
+    ✅ The stats endpoint reads that one row
+    """
+
+    def setUp(self):
+        use_temp_artifact_dir(self)
+        self.user = User.objects.create_user(username="s@example.com", password="x")
+        self.client.force_authenticate(self.user)
+
+    def test_stats_follow_analyze_and_clean(self):
+        self.assertEqual(self.client.get("/api/files/user/stats/").data["files_scanned"], 0)
+
+        ids = []
+        for tag_count in (3, 6):
+            upload = SimpleUploadedFile("photo.jpg", b"\xff\xd8\xff\xd9", content_type="image/jpeg")
+            with mock.patch("files.records.analyze_metadata_cached", return_value=fake_analysis(tag_count)):
+                ids.append(self.client.post("/api/files/user/analyze/", {"file": upload}, format="multipart").data["id"])
+
+        cleaned = CleanedFile("a" * 64, "b" * 64, data=b"\xff\xd8\xff\xd9")
+        with mock.patch("files.records.clean_metadata_guest", return_value=cleaned):
+            for _ in range(2):  # cleaning the same file twice counts once
+                upload = SimpleUploadedFile("photo.jpg", b"\xff\xd8\xff\xd9", content_type="image/jpeg")
+                self.client.post("/api/files/user/clean/", {"file_id": ids[0], "file": upload}, format="multipart")
+
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/files/user/stats/")
+        self.assertEqual(response.data["files_scanned"], 2)
+        self.assertEqual(response.data["files_cleaned"], 1)
+        self.assertEqual(response.data["risk_levels"], {"High": 2, "Medium": 0, "Low": 0})
+        self.assertEqual(response.data["total_risk_score"], 200.0)
+        self.assertEqual(response.data["fields_found"], 9)
+        self.assertEqual(response.data["bytes_scanned"], 8)
+
+        other = User.objects.create_user(username="o@example.com", password="x")
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get("/api/files/user/stats/").data["files_scanned"], 0)
+
+
+class CompactMetadataMigrationTests(TransactionTestCase):
+    """
+    ✅ 0005 rebuilds field rows from metadata_raw, the only correct copy
+    ✅ Rows the old view saved without tag/risk are matched by position
+    ✅ The migration reverses back to metadata_raw
+    """
+
+    before = [("files", "0004_risk_scores_and_user_stats")]
+    after = [("files", "0005_compact_metadata_fields")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def setUp(self):
+        self.addCleanup(self.migrate, MigrationExecutor(connection).loader.graph.leaf_nodes())
+        apps = self.migrate(self.before)
+        user = apps.get_model("auth", "User").objects.create(username="m@example.com")
+        FileAnalysis = apps.get_model("files", "FileAnalysis")
+        MetadataField = apps.get_model("files", "MetadataField")
+
+        self.metadata = [
+            {"field": "GPSLatitude", "value": "51.5", "risk": "High", "category": "Location", "risk_score": 9.5},
+            {"field": "Make", "value": "Canon", "risk": "Medium", "category": "Device", "risk_score": 4.0},
+            {"field": "ImageWidth", "value": "640", "risk": "Low", "category": "Technical", "risk_score": 0.5},
+        ]
+
+        def analysis(**extra):
+            return FileAnalysis.objects.create(
+                user=user, file_name="a.jpg", file_type="image/jpeg", file_size=1, sha256_before="0" * 64,
+                metadata_raw=self.metadata, risk_level="High", **extra
+            )
+
+        # Baseline shape: tag and risk_level read from keys the dicts don't have
+        self.aligned = analysis(cleaned_at=timezone.now()).id
+        for m in self.metadata:
+            MetadataField.objects.create(
+                analysis_id=self.aligned, tag="", value=m["value"], category=m["category"], risk_level="Low",
+            )
+        self.mismatched = analysis().id
+        MetadataField.objects.create(analysis_id=self.mismatched, tag="", value="?", category="other", risk_level="Low")
+        self.rowless = analysis().id
+
+    def rows(self, apps, analysis_id):
+        fields = apps.get_model("files", "MetadataField").objects.filter(analysis_id=analysis_id).order_by("id")
+        return [(f.tag.name, f.value, f.category, f.risk, f.risk_score, f.removed) for f in fields]
+
+    def test_rows_are_rebuilt_from_metadata_raw(self):
+        apps = self.migrate(self.after)
+        expected = [
+            ("GPSLatitude", "51.5", FieldCategory.LOCATION, 2, 9.5, False),
+            ("Make", "Canon", FieldCategory.DEVICE, 1, 4.0, False),
+            ("ImageWidth", "640", FieldCategory.TECHNICAL, 0, 0.5, False),
+        ]
+        self.assertEqual(self.rows(apps, self.mismatched), expected)
+        self.assertEqual(self.rows(apps, self.rowless), expected)
+        # The cleaned analysis: location and device were removed
+        self.assertEqual(
+            [row[5] for row in self.rows(apps, self.aligned)], [True, True, False],
+        )
+        self.assertEqual([row[:5] for row in self.rows(apps, self.aligned)], [row[:5] for row in expected])
+
+    def test_reverse_restores_metadata_raw(self):
+        self.migrate(self.after)
+        apps = self.migrate(self.before)
+        analysis = apps.get_model("files", "FileAnalysis").objects.get(id=self.rowless)
+        self.assertEqual(
+            [{k: m[k] for k in ("field", "value", "risk", "category", "risk_score")} for m in analysis.metadata_raw],
+            self.metadata,
+        )
+        self.assertEqual(
+            list(analysis.metadata_fields.order_by("id").values_list("tag", "risk_level")),
+            [("GPSLatitude", "High"), ("Make", "Medium"), ("ImageWidth", "Low")],
+        )
+
+
+class RescoreAnalysesTests(APITestCase):
+    """
+    ✅ Stored analyses are re-scored from their field rows
+    ✅ Dry runs write nothing; stats move with the new levels
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="r@example.com", password="x")
+        self.client.force_authenticate(self.user)
+        self.ids = []
+        for tag_count in (3, 6):
+            upload = SimpleUploadedFile("photo.jpg", b"\xff\xd8\xff\xd9", content_type="image/jpeg")
+            # "Tag0" etc. were stored as High/Location; today's rules say Low/Technical
+            with mock.patch("files.records.analyze_metadata_cached", return_value=fake_analysis(tag_count)):
+                self.ids.append(self.client.post("/api/files/user/analyze/", {"file": upload}, format="multipart").data["id"])
+        self.state_path = os.path.join(tempfile.mkdtemp(), "rescore_state.json")
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.state_path))
+
+    def test_dry_run_reports_without_writing(self):
+        report = rescore_analyses(chunk_size=1, workers=1, dry_run=True, state_path=self.state_path)
+
+        self.assertEqual(report["scanned"], 2)
+        self.assertEqual(report["analyses_changed"], 2)
+        self.assertEqual(report["fields_changed"], 3)
+        self.assertEqual(report["transitions"], {("High", "Low"): 2})
+        self.assertEqual(FileAnalysis.objects.filter(risk_level="High").count(), 2)
+        self.assertFalse(os.path.exists(self.state_path))
+
+    def test_rescore_updates_rows_and_stats_in_worker_processes(self):
+        out = io.StringIO()
+        call_command(
+            "rescore_analyses", "--workers", "2", "--chunk-size", "1", "--state-file", self.state_path, stdout=out,
+        )
+        self.assertIn("Changed 2 analyses and 3 fields", out.getvalue())
+
+        first, second = FileAnalysis.objects.filter(id__in=self.ids).order_by("id")
+        self.assertEqual((first.risk_level, first.total_risk_score), ("Low", 3.0))
+        self.assertEqual(second.risk_counts, {"High": 0, "Medium": 0, "Low": 6})
+        self.assertFalse(second.metadata_fields.exclude(category=FieldCategory.TECHNICAL).exists())
+
+        stats = self.client.get("/api/files/user/stats/").data
+        self.assertEqual(stats["risk_levels"], {"High": 0, "Medium": 0, "Low": 2})
+        self.assertEqual(stats["total_risk_score"], 9.0)
+
+        # Nothing left to change, and a finished run leaves no state behind
+        self.assertEqual(rescore_analyses(workers=1)["analyses_changed"], 0)
+        self.assertFalse(os.path.exists(self.state_path))
+
+    def test_resume_continues_after_last_committed_chunk(self):
+        save_state(self.ids[0], self.state_path)
+        out = io.StringIO()
+        call_command("rescore_analyses", "--resume", "--workers", "1", "--state-file", self.state_path, stdout=out)
+
+        self.assertIn("Scanned 1 analyses", out.getvalue())
+        self.assertEqual(FileAnalysis.objects.get(id=self.ids[0]).risk_level, "High")
+        self.assertEqual(FileAnalysis.objects.get(id=self.ids[1]).risk_level, "Low")
+
+
+class RetentionPurgeTests(APITestCase):
+    """
+    ✅ Old / surplus analyses go in set-based batches
+    ✅ Rows, bytes and stats are accounted for
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="p@example.com", password="x")
+        self.client.force_authenticate(self.user)
+        for tag_count in (3, 3, 3, 6):
+            upload = SimpleUploadedFile("photo.jpg", b"\xff\xd8\xff\xd9", content_type="image/jpeg")
+            with mock.patch("files.records.analyze_metadata_cached", return_value=fake_analysis(tag_count)):
+                self.client.post("/api/files/user/analyze/", {"file": upload}, format="multipart")
+        self.ids = list(FileAnalysis.objects.order_by("id").values_list("id", flat=True))
+        FileAnalysis.objects.filter(id=self.ids[0]).update(scanned_at=timezone.now() - timedelta(days=40))
+
+    def test_policy_limits_are_applied_in_batches(self):
+        response = self.client.put(
+            "/api/files/user/policy/", {"retention_days": 30, "retention_max_files": 2}, format="json"
+        )
+        self.assertEqual(response.data["retention_max_files"], 2)
+        for bad in ("soon", "²", "-1", 2.5, True, 2 ** 31, ["30"], {"days": 30}):
+            with self.subTest(retention_days=bad):
+                response = self.client.put("/api/files/user/policy/", {"retention_days": bad}, format="json")
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(UserMetadataPolicy.objects.get(user=self.user).retention_days, 30)
+
+        self.assertEqual(apply_retention(dry_run=True)["analyses"], 2)
+        self.assertEqual(FileAnalysis.objects.count(), 4)
+
+        report = apply_retention(batch_size=1, pause=0)
+        self.assertEqual(report["users"], 1)
+        self.assertEqual(report["analyses"], 2)
+        self.assertEqual(report["metadata_fields"], 6)
+        self.assertEqual(report["value_bytes"], 6 * len("value 0"))
+        self.assertEqual(list(FileAnalysis.objects.order_by("id").values_list("id", flat=True)), self.ids[2:])
+        self.assertEqual(MetadataField.objects.count(), 9)
+
+        stats = self.client.get("/api/files/user/stats/").data
+        self.assertEqual(stats["files_scanned"], 2)
+        self.assertEqual(stats["fields_found"], 9)
+        self.assertEqual(stats["risk_levels"]["High"], 2)
+
+    def test_delete_user_skips_django_cascade_collector(self):
+        out = io.StringIO()
+        with mock.patch("django.db.models.deletion.Collector.collect", side_effect=AssertionError("cascade used")):
+            report = delete_user_data(self.user.id, batch_size=3, pause=0)
+        self.assertEqual(report["analyses"], 4)
+        self.assertFalse(MetadataField.objects.exists())
+
+        call_command("purge_analyses", "--delete-user", str(self.user.id), "--pause", "0", stdout=out)
+        self.assertFalse(User.objects.filter(id=self.user.id).exists())
+        self.assertIn("Deleted 0 analyses", out.getvalue())
+
+
+
+class MetadataSearchTests(APITestCase):
+    """
+    ✅ FTS5 search only ever returns the requesting user's fields
+    ✅ The index follows inserts and deletes
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="q@example.com", password="x")
+        self.other = User.objects.create_user(username="q2@example.com", password="x")
+        self.add_fields(self.user, "John Smith", "37.7749 N")
+        self.add_fields(self.other, "John Doe", "51.5072 N")
+        self.client.force_authenticate(self.user)
+
+    def add_fields(self, user, artist, latitude):
+        analysis = FileAnalysis.objects.create(
+            user=user, file_name="photo.jpg", file_type="image/jpeg", file_size=1,
+            sha256_before="0" * 64, risk_level="High",
+        )
+        metadata = [
+            {"field": "Artist", "value": artist, "risk": "High", "category": "Personal", "risk_score": 8.5},
+            {"field": "GPSLatitude", "value": latitude, "risk": "High", "category": "Location", "risk_score": 9.5},
+        ]
+        tag_ids = intern_tags(metadata_tag_names(metadata))
+        MetadataField.objects.bulk_create(build_metadata_fields(analysis, metadata, tag_ids))
+
+    def search(self, **params):
+        return self.client.get("/api/files/user/search/", params)
+
+    def test_search_is_user_scoped_and_filtered(self):
+        response = self.search(q="john")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r["value"] for r in response.data["results"]], ["John Smith"])
+        self.assertEqual(response.data["results"][0]["category"], "Personal")
+        self.assertIsInstance(response.data["results"][0]["scanned_at"], datetime)
+
+        # Tag names and prefixes match too; filters narrow by category/risk
+        gps = self.search(q="gps*").data["results"]
+        self.assertEqual([(r["field"], r["value"]) for r in gps], [("GPSLatitude", "37.7749 N")])
+        self.assertEqual(self.search(q="gps*", category="personal").data["results"], [])
+        self.assertEqual(len(self.search(q='"john smith"', risk="high,medium").data["results"]), 1)
+        self.assertEqual(self.search(q="john", risk="low").data["results"], [])
+
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.search(q="smith").data["results"], [])
+        self.assertEqual(self.search(q="john").data["results"][0]["value"], "John Doe")
+
+        self.assertEqual(self.search(q="").status_code, 400)
+        self.assertEqual(self.search(q="john", category="secret").status_code, 400)
+        # User input is never parsed as FTS query syntax
+        self.assertEqual(self.search(q='"unbalanced AND (').status_code, 200)
+
+    def test_cursor_pages_and_index_follows_deletes(self):
+        self.add_fields(self.user, "John Smith", "40.7128 N")
+
+        first = self.search(q="john", limit=1).data
+        second = self.search(q="john", limit=1, cursor=first["next_cursor"]).data
+        self.assertGreater(first["results"][0]["field_id"], second["results"][0]["field_id"])
+        self.assertIsNone(second["next_cursor"])
+
+        delete_user_data(self.user.id, pause=0)
+        self.assertEqual(self.search(q="john").data["results"], [])
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO files_metadata_search(files_metadata_search) VALUES ('integrity-check')")
+
+
+class AnalysisCacheTests(TestCase):
+    """
+    ✅ Both backends: hit/miss counters, least recently used evicted first, TTL
+    ✅ get() hands out copies: changing a result doesn't change the cache
+    ✅ The SQLite store is shared by every process using the same file
+    """
+
+    def backends(self, **options):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        path = os.path.join(directory, "analysis_cache.sqlite3")
+        return [LocMemResultCache(**options), SQLiteResultCache(path=path, **options)]
+
+    def test_hits_lru_and_ttl(self):
+        for cache in self.backends(max_entries=2, ttl=60):
+            with self.subTest(backend=type(cache).__name__):
+                self.assertIsNone(cache.get("a"))
+                cache.set("a", {"n": 1})
+                self.assertEqual(cache.get("a"), {"n": 1})
+                self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+                # "a" was used last, so "b" goes when "c" arrives
+                now = time.time()
+                with mock.patch("files.cache.time.time", return_value=now + 1):
+                    cache.set("b", {"n": 2})
+                with mock.patch("files.cache.time.time", return_value=now + 2):
+                    cache.get("a")
+                with mock.patch("files.cache.time.time", return_value=now + 3):
+                    cache.set("c", {"n": 3})
+                self.assertIsNone(cache.get("b"))
+                self.assertEqual(cache.get("a"), {"n": 1})
+
+                with mock.patch("files.cache.time.time", return_value=now + 120):
+                    self.assertIsNone(cache.get("c"))
+                self.assertGreaterEqual(cache.evictions, 2)
+
+    def test_results_are_copies(self):
+        for cache in self.backends():
+            with self.subTest(backend=type(cache).__name__):
+                value = {"metadata": [{"field": "GPSLatitude"}]}
+                cache.set("k", value)
+                value["metadata"].append({"field": "set after"})
+                cache.get("k")["metadata"].clear()
+                self.assertEqual(cache.get("k"), {"metadata": [{"field": "GPSLatitude"}]})
+
+    def test_sqlite_store_is_shared(self):
+        _, first = self.backends()
+        second = SQLiteResultCache(path=first.path)
+        first.set("k", {"n": 1})
+        self.assertEqual(second.get("k"), {"n": 1})
+        second.clear()
+        self.assertIsNone(first.get("k"))
+
+    def test_analysis_is_reused(self):
+        cache = LocMemResultCache()
+        with mock.patch("files.services.get_analysis_cache", return_value=cache), \
+                mock.patch("files.services.analyze_metadata_guest", return_value=fake_analysis(3)) as analyze:
+            first = analyze_metadata_cached(SimpleUploadedFile("a.jpg", b"a"), "a" * 64)
+            first[0].clear()
+            second = analyze_metadata_cached(SimpleUploadedFile("a.jpg", b"a"), "a" * 64)
+        analyze.assert_called_once()
+        self.assertEqual(len(second[0]), 3)
+        self.assertEqual(cache.hits, 1)
+
+
+@mock.patch.dict("files.ratelimit.GUEST_RATE_LIMITS", {
+    "client": {"burst": 2, "per_minute": 1},
+    "ip": {"burst": 3, "per_minute": 1},
+}, clear=True)
+class GuestRateLimitTests(APITestCase):
+    """
+    ✅ Guests get 429 + Retry-After once a bucket is empty
+    ✅ Clearing the session cookie still hits the per-IP bucket
+    ✅ No session rows are written
+    """
+
+    def setUp(self):
+        get_rate_limit_store().clear()
+        self.addCleanup(get_rate_limit_store().clear)
+
+    def analyze(self, **extra):
+        upload = SimpleUploadedFile("photo.jpg", b"\xff\xd8\xff\xd9", content_type="image/jpeg")
+        with mock.patch("files.views.analyze_metadata_cached", return_value=fake_analysis(1)):
+            return self.client.post("/api/files/guest/analyze/", {"file": upload}, format="multipart", **extra)
+
+    def test_buckets_limit_client_and_ip(self):
+        self.assertEqual([self.analyze().status_code for _ in range(2)], [200, 200])
+        limited = self.analyze()
+        self.assertEqual(limited.status_code, 429)
+        self.assertEqual(limited["Retry-After"], "60")
+
+        # A new session cookie gets a fresh client bucket, but the IP bucket has one left
+        self.client.cookies["sessionid"] = "fresh"
+        self.assertEqual(self.analyze().status_code, 200)
+        self.assertEqual(self.analyze().status_code, 429)
+
+        self.assertEqual(self.analyze(REMOTE_ADDR="10.0.0.2").status_code, 200)
+        self.assertFalse(Session.objects.exists())
+
+    def test_oversized_file_is_413_and_costs_no_token(self):
+        upload = SimpleUploadedFile("big.jpg", b"\0" * 16, content_type="image/jpeg")
+        with mock.patch("files.permissions.MAX_GUEST_FILE_SIZE", 8):
+            response = self.client.post("/api/files/guest/analyze/", {"file": upload}, format="multipart")
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual([self.analyze().status_code for _ in range(2)], [200, 200])
+
+    def test_sqlite_store_takes_all_buckets_or_none(self):
+        path = os.path.join(tempfile.mkdtemp(), "rate_limits.sqlite3")
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        store = SQLiteRateLimitStore(path=path)
+        wide, narrow = Bucket("wide", 5, 1.0), Bucket("narrow", 1, 0.5)
+
+        self.assertEqual(store.take([wide, narrow]), 0)
+        self.assertAlmostEqual(store.take([wide, narrow]), 2.0, delta=0.1)
+        # The refused take left "wide" alone: 4 tokens remain, seen by another process
+        other = SQLiteRateLimitStore(path=path)
+        self.assertEqual([other.take([wide]) for _ in range(4)], [0, 0, 0, 0])
+        self.assertGreater(other.take([wide]), 0)
+
+
+@mock.patch.dict("files.uploads.UPLOAD_LIMITS", {
+    "*": {"guest": 1000, "user": 4000, "staff": None},
+}, clear=True)
+class UploadLimitTests(APITestCase):
+    """
+    ✅ Oversized uploads get a 413 before the view runs
+    ✅ Limits depend on the endpoint and on who is uploading
+    """
+
+    def setUp(self):
+        get_rate_limit_store().clear()
+        self.user = User.objects.create_user(username="u@example.com", password="x")
+
+    def post(self, url, size, **extra):
+        upload = SimpleUploadedFile("photo.jpg", b"\0" * size, content_type="image/jpeg")
+        return self.client.post(url, {"file": upload}, format="multipart", **extra)
+
+    def test_content_length_over_limit_is_rejected_before_reading(self):
+        with mock.patch("files.uploads.HashingMemoryFileUploadHandler.new_file") as new_file:
+            response = self.post("/api/files/guest/analyze/", 200 * 1024)
+        self.assertEqual(response.status_code, 413)
+        new_file.assert_not_called()
+
+    def test_streamed_bytes_over_limit_stop_the_upload(self):
+        # Within the multipart slack, so only the chunk counter catches it
+        with mock.patch("files.views.analyze_metadata_cached") as analyze:
+            response = self.post("/api/files/guest/analyze/", 2000)
+            self.assertEqual(response.status_code, 413)
+            self.assertEqual(self.post("/api/files/async/guest/analyze/", 2000).status_code, 413)
+            analyze.assert_not_called()
+
+    def test_authenticated_limits_by_user_and_endpoint(self):
+        self.client.force_authenticate(self.user)
+        with mock.patch("files.records.analyze_metadata_cached", return_value=fake_analysis(1)):
+            self.assertEqual(self.post("/api/files/user/analyze/", 2000).status_code, 200)
+            self.assertEqual(self.post("/api/files/user/analyze/", 5000).status_code, 413)
+
+            with mock.patch.dict("files.uploads.UPLOAD_LIMITS", {"user_analyze": {"user": 100}}):
+                self.assertEqual(self.post("/api/files/user/analyze/", 2000).status_code, 413)
+
+            self.user.is_staff = True
+            self.user.save()
+            self.assertEqual(self.post("/api/files/user/analyze/", 5000).status_code, 200)
+
+
+class CleanedFileDeliveryTests(APITestCase):
+    """
+    ✅ Small cleans are streamed and never stored, unless a link is asked for
+    ✅ Kept cleans last a short TTL: a retry doesn't clean again
+    ✅ Range requests get 206/416, an offload setting hands the file to the proxy
+    """
+
+    def setUp(self):
+        get_rate_limit_store().clear()
+        self.artifact_dir = use_temp_artifact_dir(self)
+        self.user = User.objects.create_user(username="d@example.com", password="x")
+        self.cleaned = CleanedFile("a" * 64, "b" * 64, data=bytes(range(100)))
+
+    def clean_as_user(self, query=""):
+        upload = SimpleUploadedFile("photo.jpg", b"\xff\xd8\xff\xd9", content_type="image/jpeg")
+        with mock.patch("files.records.analyze_metadata_cached", return_value=fake_analysis(3)):
+            analysis_id = self.client.post("/api/files/user/analyze/", {"file": upload}, format="multipart").data["id"]
+        upload = SimpleUploadedFile("photo.jpg", b"\xff\xd8\xff\xd9", content_type="image/jpeg")
+        return self.client.post("/api/files/user/clean/" + query, {"file_id": analysis_id, "file": upload}, format="multipart")
+
+    def guest_download_url(self):
+        artifact = save_artifact("k-guest", "a" * 64, self.cleaned)
+        upload = SimpleUploadedFile("photo.jpg", b"x", content_type="image/jpeg")
+        with mock.patch("files.views.cleaned_artifact", return_value=artifact):
+            response = self.client.post("/api/files/guest/clean/", {"file": upload}, format="multipart")
+        return response["X-Download-URL"]
+
+    def test_clean_retry_and_download_link_reuse_the_artifact(self):
+        self.client.force_authenticate(self.user)
+        with mock.patch("files.records.clean_metadata_guest", return_value=self.cleaned) as clean:
+            first = self.clean_as_user("?link=1")
+            second = self.clean_as_user()
+        self.assertEqual(clean.call_count, 1)
+        self.assertEqual(b"".join(second.streaming_content), bytes(range(100)))
+        self.assertEqual(second["ETag"], '"' + "b" * 64 + '"')
+        self.assertEqual(second["Accept-Ranges"], "bytes")
+
+        url = first["X-Download-URL"]
+        response = self.client.get(url, HTTP_RANGE="bytes=90-")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 90-99/100")
+        self.assertEqual(response["Content-Length"], "10")
+        self.assertEqual(b"".join(response.streaming_content), bytes(range(90, 100)))
+
+        # A user's link only works for that user
+        self.client.force_authenticate(User.objects.create_user(username="e@example.com", password="x"))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_small_cleans_are_streamed_without_storing(self):
+        spooled = tempfile.NamedTemporaryFile(delete=False)
+        spooled.write(bytes(range(100)))
+        spooled.close()
+        cleaned = CleanedFile("a" * 64, "b" * 64, path=spooled.name, temp_paths=[spooled.name])
+
+        self.client.force_authenticate(self.user)
+        with mock.patch("files.records.clean_metadata_guest", return_value=cleaned):
+            response = self.clean_as_user()
+            self.assertEqual(b"".join(response.streaming_content), bytes(range(100)))
+            response.close()
+
+        self.assertNotIn("X-Download-URL", response)
+        self.assertEqual(response["ETag"], '"' + "b" * 64 + '"')
+        self.assertEqual(os.listdir(self.artifact_dir), [])
+        self.assertFalse(os.path.exists(spooled.name))
+
+    def test_large_cleans_and_link_requests_are_stored(self):
+        self.client.force_authenticate(self.user)
+        for query, min_bytes in (("", 100), ("?link=1", 10 ** 9)):
+            with self.subTest(query=query):
+                shutil.rmtree(self.artifact_dir, True)
+                with mock.patch("files.records.clean_metadata_guest", return_value=self.cleaned), \
+                        mock.patch("files.delivery.CLEANED_ARTIFACT_MIN_BYTES", min_bytes):
+                    response = self.clean_as_user(query)
+                self.assertIn("X-Download-URL", response)
+                self.assertEqual(len(os.listdir(self.artifact_dir)), 2)
+
+    def test_byte_ranges(self):
+        url = self.guest_download_url()
+
+        response = self.client.get(url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(b"".join(response.streaming_content), bytes(range(10, 20)))
+        response = self.client.get(url, HTTP_RANGE="bytes=-5")
+        self.assertEqual(b"".join(response.streaming_content), bytes(range(95, 100)))
+
+        response = self.client.get(url, HTTP_RANGE="bytes=100-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */100")
+
+        # A validator for other content, or several ranges: the whole file
+        self.assertEqual(self.client.get(url, HTTP_RANGE="bytes=0-1", HTTP_IF_RANGE='"old"').status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_RANGE="bytes=0-1,5-6").status_code, 200)
+
+    def test_offload_hands_the_file_to_the_proxy(self):
+        url = self.guest_download_url()
+        with mock.patch("files.delivery.CLEANED_FILE_OFFLOAD", "x-accel-redirect"):
+            response = self.client.get(url, HTTP_RANGE="bytes=0-1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Accel-Redirect"], "/protected/cleaned/k-guest")
+        self.assertEqual(response.content, b"")
+
+    def test_expired_artifacts_are_purged(self):
+        artifact = save_artifact("k-old", "a" * 64, self.cleaned)
+        old = time.time() - 3600
+        for path in (artifact.path, artifact.path + ".json"):
+            os.utime(path, (old, old))
+        # A sidecar whose artifact is gone goes too, however fresh
+        with open(os.path.join(self.artifact_dir, "k-lone.json"), "w") as sidecar:
+            sidecar.write("{}")
+        self.assertEqual(purge_expired_artifacts(force=True), 3)
+        self.assertEqual(os.listdir(self.artifact_dir), [])
+
+    def test_reused_artifact_outlives_its_first_ttl(self):
+        url = self.guest_download_url()
+        path = os.path.join(self.artifact_dir, "k-guest")
+        almost_expired = time.time() - CLEANED_ARTIFACT_TTL + 5
+        for name in (path, path + ".json"):
+            os.utime(name, (almost_expired, almost_expired))
+        self.assertIsNotNone(load_artifact("k-guest"))
+
+        # Past the first TTL: the reuse restarted it for both files
+        with mock.patch("files.delivery.time.time", return_value=time.time() + 10):
+            self.assertEqual(purge_expired_artifacts(force=True), 0)
+            self.assertIsNotNone(load_artifact("k-guest"))
+        self.assertEqual(self.client.get(url).status_code, 200)
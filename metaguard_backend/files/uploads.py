@@ -0,0 +1,217 @@
+import hashlib
+from typing import Optional
+
+from django.conf import settings
+from django.core.files.uploadhandler import (
+    FileUploadHandler,
+    MemoryFileUploadHandler,
+    StopUpload,
+    TemporaryFileUploadHandler,
+)
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .fastscan import FAST_SCAN_MIN_BYTES, FAST_SCAN_UPLOAD_ENDPOINTS, HeaderCollector, HeaderOnlyUpload, scan_mode
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+MB = 1024 * 1024
+
+# Endpoint URL name -> caller -> max file bytes per request ("*" = any other endpoint)
+DEFAULT_UPLOAD_LIMITS = {
+    "*": {"guest": 10 * MB, "user": 200 * MB, "staff": None},
+}
+UPLOAD_LIMITS = getattr(settings, "UPLOAD_LIMITS", DEFAULT_UPLOAD_LIMITS)
+
+# Room for multipart boundaries and form fields on top of the file bytes
+UPLOAD_MULTIPART_SLACK = getattr(settings, "UPLOAD_MULTIPART_SLACK", 64 * 1024)
+
+
+# ================================
+# UPLOAD SIZE LIMITS (WHILE STREAMING)
+# ================================
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = "Upload too large"
+    default_code = "upload_too_large"
+
+    def __init__(self, limit: int):
+        super().__init__(f"Upload too large: the limit here is {limit} bytes")
+        self.limit = limit
+
+
+def caller_tier(request) -> str:
+    # DRF views put the JWT user on the request; the async views use api_user
+    user = getattr(request, "api_user", None) or getattr(request, "user", None)
+    if user is None or not user.is_authenticated:
+        return "guest"
+    return "staff" if user.is_staff else "user"
+
+
+def upload_limit(request) -> Optional[int]:
+    """Bytes allowed for this endpoint and caller, None = unlimited"""
+    match = getattr(request, "resolver_match", None)
+    endpoint = UPLOAD_LIMITS.get(match.url_name if match else None, {})
+    tier = caller_tier(request)
+    if tier in endpoint:
+        return endpoint[tier]
+    return UPLOAD_LIMITS.get("*", {}).get(tier)
+
+
+class UploadLimitHandler(FileUploadHandler):
+    """
+    🚧 First in FILE_UPLOAD_HANDLERS: rejects uploads over the limit
+    ✅ From Content-Length before a byte is read
+    ✅ Or as soon as the file chunks go past it (chunked / lying bodies)
+    ✅ Stops reading the body and drops partial files, then raises a 413
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.limit = None
+        self.received = 0
+        self.exceeded = False
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.limit = upload_limit(self.request)
+        if self.limit is not None and content_length > self.limit + UPLOAD_MULTIPART_SLACK:
+            raise UploadTooLarge(self.limit)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.limit is not None and self.received > self.limit:
+            self.exceeded = True
+            # Closes the other handlers' partial files without reading the rest
+            raise StopUpload(connection_reset=True)
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+    def upload_complete(self):
+        if self.exceeded:
+            raise UploadTooLarge(self.limit)
+
+
+# ================================
+# HEADER-ONLY UPLOADS (FAST SCAN)
+# ================================
+class HeaderOnlyUploadHandler(FileUploadHandler):
+    """
+    ✂️ Large uploads to the analyze endpoints keep only what a fast scan reads
+    ✅ JPEG: the first FAST_SCAN_HEAD_BYTES; QuickTime/MP4: every atom but mdat
+    ✅ The rest is hashed and dropped, never written to memory or disk
+    ✅ Other formats and endpoints go to the next handlers untouched
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.active = False
+        self.collector = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        match = getattr(self.request, "resolver_match", None)
+        self.active = (
+            match is not None
+            and match.url_name in FAST_SCAN_UPLOAD_ENDPOINTS
+            and content_length >= FAST_SCAN_MIN_BYTES
+        )
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.collector = None
+
+    def receive_data_chunk(self, raw_data, start):
+        if start == 0 and self.active:
+            mode = scan_mode(raw_data[:12])
+            if mode is not None:
+                self.collector = HeaderCollector(mode)
+                self.sha256 = hashlib.sha256()
+        if self.collector is None:
+            return raw_data
+
+        self.sha256.update(raw_data)
+        self.collector.feed(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.collector is None:
+            return None
+        uploaded_file = HeaderOnlyUpload(
+            self.collector.plan(file_size),
+            self.file_name,
+            self.content_type,
+            self.charset,
+            self.content_type_extra,
+        )
+        uploaded_file.sha256 = self.sha256.hexdigest()
+        return uploaded_file
+
+
+# ================================
+# HASHING UPLOAD HANDLERS
+# ================================
+class Sha256UploadMixin:
+    """
+    🔐 SHA-256 computed while the upload streams in
+    ✅ The digest is attached to the uploaded file as `.sha256`
+    ✅ Only the handler that actually stores the chunks hashes them
+    """
+
+    def new_file(self, *args, **kwargs):
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        passed_on = super().receive_data_chunk(raw_data, start)
+        if passed_on is None:
+            self.sha256.update(raw_data)
+        return passed_on
+
+    def file_complete(self, file_size):
+        uploaded_file = super().file_complete(file_size)
+        if uploaded_file is not None:
+            uploaded_file.sha256 = self.sha256.hexdigest()
+        return uploaded_file
+
+
+class HashingMemoryFileUploadHandler(Sha256UploadMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(Sha256UploadMixin, TemporaryFileUploadHandler):
+    pass
+
+
+# ================================
+# HASH HELPERS
+# ================================
+def upload_sha256(uploaded_file) -> str:
+    """
+    Digest from the upload handler, or computed once from the chunks
+    and remembered on the file for the rest of the request.
+    """
+    file_hash = getattr(uploaded_file, "sha256", None)
+    if file_hash:
+        return file_hash
+
+    sha256_hash = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        sha256_hash.update(chunk)
+    file_hash = sha256_hash.hexdigest()
+
+    try:
+        uploaded_file.sha256 = file_hash
+    except AttributeError:
+        pass
+    return file_hash
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 of a file on disk without loading it into memory"""
+    sha256_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha256_hash.update(block)
+    return sha256_hash.hexdigest()
@@ -1,21 +1,53 @@
 from django.urls import path
+from .async_views import (
+    guest_analyze_metadata_async,
+    guest_clean_metadata_async,
+    analyze_metadata_authenticated_async,
+    clean_metadata_authenticated_async,
+)
 from .views import (
     guest_analyze_metadata, 
     guest_clean_metadata,
     user_file_history,
+    user_file_details,
+    user_metadata_search,
     user_metadata_policy,
+    user_risk_stats,
     analyze_metadata_authenticated,
+    analyze_metadata_batch,
     clean_metadata_authenticated,
+    cleaned_file_download,
+    user_job_status,
+    user_job_download,
+    metrics,
 )
 
 urlpatterns = [
     # 👥 GUEST ENDPOINTS (No login required)
-    path("guest/analyze/", guest_analyze_metadata),
-    path("guest/clean/", guest_clean_metadata),
+    path("guest/analyze/", guest_analyze_metadata, name="guest_analyze"),
+    path("guest/clean/", guest_clean_metadata, name="guest_clean"),
+
+    # 📦 RE-DOWNLOAD A RECENT CLEAN (signed link from X-Download-URL)
+    path("cleaned/<str:token>/", cleaned_file_download, name="cleaned_download"),
     
     # 🔒 AUTHENTICATED ENDPOINTS (Login required)
     path("user/history/", user_file_history, name="user_file_history"),
+    path("user/history/<int:file_id>/", user_file_details, name="user_file_details"),
+    path("user/search/", user_metadata_search, name="user_metadata_search"),
     path("user/policy/", user_metadata_policy, name="user_metadata_policy"),
+    path("user/stats/", user_risk_stats, name="user_risk_stats"),
     path("user/analyze/", analyze_metadata_authenticated, name="user_analyze"),
+    path("user/analyze/batch/", analyze_metadata_batch, name="user_analyze_batch"),
     path("user/clean/", clean_metadata_authenticated, name="user_clean"),
+    path("user/jobs/<uuid:job_id>/", user_job_status, name="user_job_status"),
+    path("user/jobs/<uuid:job_id>/download/", user_job_download, name="user_job_download"),
+
+    # ⚡ NATIVE ASYNC ENDPOINTS (served without a thread per request under ASGI)
+    path("async/guest/analyze/", guest_analyze_metadata_async, name="guest_analyze_async"),
+    path("async/guest/clean/", guest_clean_metadata_async, name="guest_clean_async"),
+    path("async/user/analyze/", analyze_metadata_authenticated_async, name="user_analyze_async"),
+    path("async/user/clean/", clean_metadata_authenticated_async, name="user_clean_async"),
+
+    # 📈 PROMETHEUS SCRAPE TARGET
+    path("metrics/", metrics, name="metrics"),
 ]
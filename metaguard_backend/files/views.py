@@ -2,14 +2,40 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-from django.http import FileResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+import hmac
+import math
 import os
-import hashlib
-from datetime import datetime
+import zipfile
 
-from .models import FileAnalysis, MetadataField, UserMetadataPolicy
-from .permissions import enforce_guest_limits
-from .services import analyze_metadata_guest, clean_metadata_guest
+from .jobs import enqueue_job, wait_for_job
+from .models import AnalysisJob, FileAnalysis, UserMetadataPolicy, UserRiskStats
+from .batch import BatchError, collect_batch_uploads, stream_batch_analysis
+from .delivery import (
+    cleaned_artifact,
+    cleaned_file_response,
+    file_download_response,
+    load_artifact,
+    read_download_token,
+    wants_download_link,
+)
+from .fastscan import header_only
+from .history import (
+    DEFAULT_PAGE_SIZE,
+    HISTORY_FIELDS,
+    InvalidHistoryQuery,
+    history_page,
+    resolve_fields,
+    serialize_file_analysis,
+    with_metadata_fields,
+)
+from .metrics import METRICS_TOKEN, render_metrics, stage
+from .permissions import GuestLimitExceeded, enforce_guest_limits
+from .records import analyze_and_save, clean_and_save
+from .search import DEFAULT_SEARCH_PAGE_SIZE, InvalidSearchQuery, search_metadata
+from .services import analyze_metadata_cached
+from .uploads import upload_sha256
 
 
 # ================================
@@ -24,16 +50,22 @@ def guest_analyze_metadata(request):
             status=status.HTTP_400_BAD_REQUEST,
         )
 
-    uploaded_file = request.FILES.get("file")
+    with stage("upload"):
+        uploaded_file = request.FILES.get("file")
     if not uploaded_file:
         return Response(
             {"error": "No file uploaded"},
             status=status.HTTP_400_BAD_REQUEST,
         )
 
-    enforce_guest_limits(request, uploaded_file)
+    try:
+        enforce_guest_limits(request, uploaded_file)
+    except GuestLimitExceeded as e:
+        return Response({"error": str(e)}, status=e.status_code, headers=e.headers())
 
-    metadata, privacy_count, overall_risk, total_score, risk_counts, remaining_count = analyze_metadata_guest(uploaded_file)
+    file_hash = calculate_file_hash(uploaded_file)
+    result = analyze_metadata_cached(uploaded_file, file_hash)
+    metadata, privacy_count, overall_risk, total_score, risk_counts, remaining_count = result
 
     return Response(
         {
@@ -50,6 +82,8 @@ def guest_analyze_metadata(request):
             "overall_risk": overall_risk,
             "total_risk_score": total_score,
             "risk_counts": risk_counts,
+            "partial_read": result.scan is not None,
+            "scan": result.scan,
         },
         status=status.HTTP_200_OK,
     )
@@ -67,7 +101,8 @@ def guest_clean_metadata(request):
             status=status.HTTP_400_BAD_REQUEST,
         )
 
-    uploaded_file = request.FILES.get("file")
+    with stage("upload"):
+        uploaded_file = request.FILES.get("file")
     if not uploaded_file:
         return Response(
             {"error": "No file uploaded"},
@@ -76,41 +111,20 @@ def guest_clean_metadata(request):
 
     try:
         enforce_guest_limits(request, uploaded_file)
+    except GuestLimitExceeded as e:
+        return Response({"error": str(e)}, status=e.status_code, headers=e.headers())
 
-        clean_path, original_path, hash_changed = clean_metadata_guest(uploaded_file)
-
-        response = FileResponse(
-            open(clean_path, "rb"),
-            as_attachment=True,
-            filename=f"cleaned_{uploaded_file.name}",
-        )
-
-        response["X-Metadata-Cleaned"] = "true"
-        response["X-Hash-Changed"] = str(hash_changed).lower()
-
-        return response
-
-    finally:
-        # 🧹 Always cleanup temp files
-        try:
-            if "original_path" in locals() and os.path.exists(original_path):
-                os.remove(original_path)
-            if "clean_path" in locals() and os.path.exists(clean_path):
-                os.remove(clean_path)
-        except Exception:
-            pass
+    cleaned = cleaned_artifact(uploaded_file, keep=wants_download_link(request))
+    return cleaned_file_response(request, cleaned, f"cleaned_{uploaded_file.name}")
 
 # ================================
 # AUTHENTICATED USER ENDPOINTS
 # ================================
 
+@stage("hash")
 def calculate_file_hash(file_obj):
-    """Calculate SHA-256 hash of file"""
-    sha256_hash = hashlib.sha256()
-    file_obj.seek(0)
-    for chunk in file_obj.chunks():
-        sha256_hash.update(chunk)
-    return sha256_hash.hexdigest()
+    """SHA-256 of the upload (computed by the upload handler as it streamed in)"""
+    return upload_sha256(file_obj)
 
 
 # ================================
@@ -120,46 +134,88 @@ def calculate_file_hash(file_obj):
 @permission_classes([IsAuthenticated])
 def user_file_history(request):
     """
-    ✅ Get ALL files for authenticated user only
+    ✅ Get files for authenticated user only, one page at a time
     ✅ User A cannot see User B's files
-    ✅ Includes all metadata, hashes, timestamps
+    ✅ ?limit=, ?cursor= (from next_cursor) for keyset pagination
+    ✅ ?view=summary or ?fields=a,b,c to project only what the screen needs
     """
-    user = request.user
-    files = FileAnalysis.objects.filter(user=user).prefetch_related('metadata_fields')
-    
-    data = []
-    for file_obj in files:
-        data.append({
-            "id": file_obj.id,
-            "file_name": file_obj.file_name,
-            "file_type": file_obj.file_type,
-            "file_size": file_obj.file_size,
-            "risk_level": file_obj.risk_level,
-            "sha256_before": file_obj.sha256_before,
-            "sha256_after": file_obj.sha256_after,
-            "metadata_raw": file_obj.metadata_raw,
-            "metadata_removed": file_obj.metadata_removed,
-            "scanned_at": file_obj.scanned_at,
-            "cleaned_at": file_obj.cleaned_at,
-            "updated_at": file_obj.updated_at,
-            "metadata_fields": [
-                {
-                    "tag": m.tag,
-                    "value": m.value,
-                    "category": m.category,
-                    "risk_level": m.risk_level,
-                    "removed": m.removed
-                }
-                for m in file_obj.metadata_fields.all()
-            ]
-        })
-    
-    return Response({"files": data}, status=status.HTTP_200_OK)
+    try:
+        fields = resolve_fields(request.GET.get("view"), request.GET.get("fields"))
+        limit = int(request.GET.get("limit", DEFAULT_PAGE_SIZE))
+        data, next_cursor = history_page(request.user, fields, limit, request.GET.get("cursor"))
+    except (InvalidHistoryQuery, ValueError) as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({"files": data, "next_cursor": next_cursor}, status=status.HTTP_200_OK)
+
+
+# ================================
+# SEARCH USER'S SCAN HISTORY
+# ================================
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def user_metadata_search(request):
+    """
+    ✅ Full-text search over the user's own metadata tags and values
+    ✅ ?q= words / "phrases" (all must match, word* for prefixes)
+    ✅ ?category=location,personal&risk=high to filter
+    ✅ ?limit=, ?cursor= (from next_cursor), newest first
+    """
+    try:
+        limit = int(request.GET.get("limit", DEFAULT_SEARCH_PAGE_SIZE))
+        results, next_cursor = search_metadata(
+            request.user,
+            request.GET.get("q", ""),
+            category=request.GET.get("category"),
+            risk=request.GET.get("risk"),
+            limit=limit,
+            cursor=request.GET.get("cursor"),
+        )
+    except (InvalidSearchQuery, ValueError) as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({"results": results, "next_cursor": next_cursor}, status=status.HTTP_200_OK)
+
+
+# ================================
+# GET ONE FILE FROM HISTORY (WITH ISOLATION)
+# ================================
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def user_file_details(request, file_id):
+    """
+    ✅ Full record incl. metadata for one analysis, loaded on demand
+    ✅ 404 if the file belongs to another user
+    """
+    try:
+        file_obj = with_metadata_fields(FileAnalysis.objects).get(id=file_id, user=request.user)
+    except FileAnalysis.DoesNotExist:
+        return Response(
+            {"error": "File not found or you don't have permission to access it"},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+
+    return Response(serialize_file_analysis(file_obj, HISTORY_FIELDS), status=status.HTTP_200_OK)
 
 
 # ================================
 # GET USER'S METADATA POLICY
 # ================================
+# Largest value a PositiveIntegerField holds on every database
+MAX_RETENTION_VALUE = 2147483647
+
+
+def parse_retention_value(value):
+    """A whole number in range, or None for anything else (bools, floats, "²")"""
+    if isinstance(value, (bool, float)):
+        return None
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return None
+    return number if 0 <= number <= MAX_RETENTION_VALUE else None
+
+
 @api_view(["GET", "PUT"])
 @permission_classes([IsAuthenticated])
 def user_metadata_policy(request):
@@ -178,6 +234,8 @@ def user_metadata_policy(request):
             "remove_device": policy.remove_device,
             "remove_software": policy.remove_software,
             "remove_personal": policy.remove_personal,
+            "retention_days": policy.retention_days,
+            "retention_max_files": policy.retention_max_files,
             "created_at": policy.created_at,
             "updated_at": policy.updated_at,
         }, status=status.HTTP_200_OK)
@@ -188,6 +246,20 @@ def user_metadata_policy(request):
         policy.remove_device = request.data.get("remove_device", policy.remove_device)
         policy.remove_software = request.data.get("remove_software", policy.remove_software)
         policy.remove_personal = request.data.get("remove_personal", policy.remove_personal)
+
+        # 🗑️ Retention: whole number of days/files, null for the site default
+        for name in ("retention_days", "retention_max_files"):
+            if name not in request.data:
+                continue
+            value = request.data.get(name)
+            number = None if value in (None, "") else parse_retention_value(value)
+            if number is None and value not in (None, ""):
+                return Response(
+                    {"error": f"{name} must be a whole number or null"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            setattr(policy, name, number)
+
         policy.save()
         
         return Response({
@@ -196,9 +268,39 @@ def user_metadata_policy(request):
             "remove_device": policy.remove_device,
             "remove_software": policy.remove_software,
             "remove_personal": policy.remove_personal,
+            "retention_days": policy.retention_days,
+            "retention_max_files": policy.retention_max_files,
         }, status=status.HTTP_200_OK)
 
 
+# ================================
+# GET USER'S RISK STATS (DASHBOARD)
+# ================================
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def user_risk_stats(request):
+    """
+    ✅ Dashboard counts for the current user from one row
+    ✅ Kept up to date by every analyze/clean, never computed from history
+    """
+    stats = UserRiskStats.objects.filter(user=request.user).first() or UserRiskStats(user=request.user)
+
+    return Response({
+        "files_scanned": stats.files_scanned,
+        "files_cleaned": stats.files_cleaned,
+        "risk_levels": {
+            "High": stats.high_risk_files,
+            "Medium": stats.medium_risk_files,
+            "Low": stats.low_risk_files,
+        },
+        "total_risk_score": round(stats.total_risk_score, 2),
+        "average_risk_score": round(stats.total_risk_score / stats.files_scanned, 2) if stats.files_scanned else 0.0,
+        "fields_found": stats.fields_found,
+        "bytes_scanned": stats.bytes_scanned,
+        "updated_at": stats.updated_at,
+    }, status=status.HTTP_200_OK)
+
+
 # ================================
 # ANALYZE FILE (AUTHENTICATED)
 # ================================
@@ -209,9 +311,12 @@ def analyze_metadata_authenticated(request):
     ✅ Analyze file for authenticated user
     ✅ Store ALL metadata + hashes + timestamps
     ✅ Apply user's custom policy
+    ✅ ?async=1 queues the job and returns 202 with a job id
+    ✅ Header-only uploads are never queued: the scan is already cheap
     """
     user = request.user
-    uploaded_file = request.FILES.get("file")
+    with stage("upload"):
+        uploaded_file = request.FILES.get("file")
     
     if not uploaded_file:
         return Response(
@@ -219,58 +324,12 @@ def analyze_metadata_authenticated(request):
             status=status.HTTP_400_BAD_REQUEST,
         )
     
+    if wants_async(request) and not header_only(uploaded_file):
+        job = enqueue_job(user, AnalysisJob.KIND_ANALYZE, uploaded_file)
+        return Response(job_accepted_payload(job), status=status.HTTP_202_ACCEPTED)
+
     try:
-        # Calculate SHA-256 hash BEFORE processing
-        sha256_before = calculate_file_hash(uploaded_file)
-        
-        # Analyze metadata
-        metadata, privacy_count, overall_risk, total_score, risk_counts, remaining_count = analyze_metadata_guest(uploaded_file)
-        
-        # Get user's policy
-        policy, _ = UserMetadataPolicy.objects.get_or_create(user=user)
-        
-        # Create FileAnalysis record for THIS user
-        file_analysis = FileAnalysis.objects.create(
-            user=user,  # 👤 Isolated to current user
-            file_name=uploaded_file.name,
-            file_type=uploaded_file.content_type or "unknown",
-            file_size=uploaded_file.size,
-            sha256_before=sha256_before,
-            sha256_after=None,  # Will be set after cleaning
-            metadata_raw=metadata,  # 💾 Store ALL metadata as JSON
-            risk_level=overall_risk,
-            scanned_at=datetime.now(),
-        )
-        
-        # Store individual metadata fields
-        for field_data in metadata:
-            MetadataField.objects.create(
-                analysis=file_analysis,
-                tag=field_data.get("tag", ""),
-                value=field_data.get("value", ""),
-                category=field_data.get("category", "other"),
-                risk_level=field_data.get("risk_level", "Low"),
-                removed=False,
-            )
-        
-        return Response({
-            "id": file_analysis.id,
-            "file_name": uploaded_file.name,
-            "metadata": metadata,
-            "before": {
-                "total": len(metadata),
-                "privacy": privacy_count,
-            },
-            "after": {
-                "remaining": remaining_count,
-                "removed": len(metadata) - remaining_count,
-            },
-            "overall_risk": overall_risk,
-            "total_risk_score": total_score,
-            "risk_counts": risk_counts,
-            "sha256_before": sha256_before,
-            "scanned_at": file_analysis.scanned_at,
-        }, status=status.HTTP_200_OK)
+        return Response(analyze_and_save(user, uploaded_file), status=status.HTTP_200_OK)
         
     except Exception as e:
         return Response(
@@ -279,6 +338,35 @@ def analyze_metadata_authenticated(request):
         )
 
 
+# ================================
+# BATCH ANALYZE (AUTHENTICATED)
+# ================================
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def analyze_metadata_batch(request):
+    """
+    ✅ Many files (`files`) or one ZIP in a single request
+    ✅ Files are analyzed in parallel, one NDJSON line each as it finishes
+    ✅ A failing file doesn't fail the batch
+    ✅ Every file gets its own FileAnalysis row, stored in small chunks before it is reported
+    """
+    try:
+        uploads = collect_batch_uploads(request.FILES)
+    except (BatchError, zipfile.BadZipFile) as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    if not uploads:
+        return Response(
+            {"error": "No file uploaded"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    return StreamingHttpResponse(
+        stream_batch_analysis(request.user, uploads),
+        content_type="application/x-ndjson",
+    )
+
+
 # ================================
 # CLEAN FILE (AUTHENTICATED)
 # ================================
@@ -290,9 +378,11 @@ def clean_metadata_authenticated(request):
     ✅ Store SHA-256 after cleaning
     ✅ Store cleaned at timestamp
     ✅ Only user who created it can clean it
+    ✅ ?async=1 queues the job and returns 202 with a job id
     """
     user = request.user
-    file_id = request.data.get("file_id")
+    with stage("upload"):
+        file_id = request.data.get("file_id")
     
     if not file_id:
         return Response(
@@ -302,7 +392,7 @@ def clean_metadata_authenticated(request):
     
     try:
         # 🔒 Get file - will return 404 if user doesn't own it
-        file_analysis = FileAnalysis.objects.get(id=file_id, user=user)
+        file_analysis = FileAnalysis.objects.select_related("user__metadata_policy").get(id=file_id, user=user)
         
         uploaded_file = request.FILES.get("file")
         if not uploaded_file:
@@ -311,32 +401,14 @@ def clean_metadata_authenticated(request):
                 status=status.HTTP_400_BAD_REQUEST,
             )
         
-        clean_path, original_path, hash_changed = clean_metadata_guest(uploaded_file)
-        
-        # Calculate SHA-256 hash AFTER cleaning
-        with open(clean_path, 'rb') as f:
-            sha256_after = calculate_file_hash(f)
-        
-        # Update file record with after-cleaning data
-        file_analysis.sha256_after = sha256_after
-        file_analysis.cleaned_at = datetime.now()
-        file_analysis.save()
-        
-        # Mark removed metadata
-        for metadata_field in file_analysis.metadata_fields.all():
-            if metadata_field.category in ["location", "personal", "device"]:
-                metadata_field.removed = True
-                metadata_field.save()
-        
-        response = FileResponse(
-            open(clean_path, "rb"),
-            as_attachment=True,
-            filename=f"cleaned_{uploaded_file.name}",
-        )
+        if wants_async(request):
+            job = enqueue_job(user, AnalysisJob.KIND_CLEAN, uploaded_file, file_analysis=file_analysis)
+            return Response(job_accepted_payload(job), status=status.HTTP_202_ACCEPTED)
+
+        cleaned = clean_and_save(file_analysis, uploaded_file, keep=wants_download_link(request))
         
-        response["X-Metadata-Cleaned"] = "true"
-        response["X-Hash-Changed"] = str(hash_changed).lower()
-        response["X-SHA256-After"] = sha256_after
+        response = cleaned_file_response(request, cleaned, f"cleaned_{uploaded_file.name}", user)
+        response["X-SHA256-After"] = cleaned.sha256_after
         
         return response
         
@@ -345,12 +417,134 @@ def clean_metadata_authenticated(request):
             {"error": "File not found or you don't have permission to access it"},
             status=status.HTTP_404_NOT_FOUND,
         )
-    finally:
-        # 🧹 Always cleanup temp files
-        try:
-            if "original_path" in locals() and os.path.exists(original_path):
-                os.remove(original_path)
-            if "clean_path" in locals() and os.path.exists(clean_path):
-                os.remove(clean_path)
-        except Exception:
-            pass
\ No newline at end of file
+
+
+# ================================
+# CLEANED FILE RE-DOWNLOAD
+# ================================
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def cleaned_file_download(request, token):
+    """
+    ✅ The X-Download-URL of a clean: same file, no second clean
+    ✅ Range requests resume an interrupted download
+    ✅ Links from an authenticated clean only work for that user
+    """
+    grant = read_download_token(token)
+    cleaned = load_artifact(grant.key) if grant is not None else None
+    if cleaned is None or (grant.user_id is not None and grant.user_id != request.user.id):
+        return Response(
+            {"error": "Download link expired or not yours: clean the file again"},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+
+    return cleaned_file_response(request, cleaned, grant.filename, request.user)
+
+
+# ================================
+# ASYNC JOBS (AUTHENTICATED)
+# ================================
+MAX_JOB_WAIT_SECONDS = 30
+
+
+def wants_async(request):
+    value = request.query_params.get("async") or request.data.get("async")
+    return str(value).lower() in ("1", "true", "yes")
+
+
+def job_accepted_payload(job):
+    return {
+        "job_id": str(job.id),
+        "kind": job.kind,
+        "status": job.status,
+        "status_url": reverse("user_job_status", args=[job.id]),
+    }
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def user_job_status(request, job_id):
+    """
+    ✅ Status of an async job, only for the user who queued it
+    ✅ ?wait=N long-polls up to N seconds for the job to finish
+    ✅ Finished analyze jobs carry the same payload as the sync endpoint
+    """
+    try:
+        wait = float(request.query_params.get("wait", 0))
+    except ValueError:
+        wait = 0
+    # float() also takes "nan" and "inf"
+    wait = min(max(wait, 0), MAX_JOB_WAIT_SECONDS) if math.isfinite(wait) else 0
+
+    job = wait_for_job(job_id, request.user, timeout=wait)
+    if job is None:
+        return Response(
+            {"error": "Job not found or you don't have permission to access it"},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+
+    data = {
+        "job_id": str(job.id),
+        "kind": job.kind,
+        "status": job.status,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+    if job.status == AnalysisJob.STATUS_DONE:
+        data["result"] = job.result
+        if job.kind == AnalysisJob.KIND_CLEAN:
+            data["download_url"] = reverse("user_job_download", args=[job.id])
+    elif job.status == AnalysisJob.STATUS_FAILED:
+        data["error"] = job.error
+
+    return Response(data, status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def user_job_download(request, job_id):
+    """
+    ✅ Cleaned file produced by a finished async clean job
+    ✅ Range requests resume an interrupted download
+    """
+    job = AnalysisJob.objects.filter(
+        id=job_id, user=request.user, kind=AnalysisJob.KIND_CLEAN, status=AnalysisJob.STATUS_DONE
+    ).first()
+    if job is None or not job.result_path or not os.path.exists(job.result_path):
+        return Response(
+            {"error": "Cleaned file not found or no longer available"},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+
+    response = file_download_response(
+        request,
+        job.result_path,
+        f"cleaned_{job.file_name}",
+        etag=job.result["sha256_after"],
+    )
+
+    response["X-Metadata-Cleaned"] = "true"
+    response["X-Hash-Changed"] = str(job.result["hash_changed"]).lower()
+    response["X-SHA256-After"] = job.result["sha256_after"]
+
+    return response
+
+
+# ================================
+# METRICS (PROMETHEUS)
+# ================================
+def metrics(request):
+    """
+    📈 Stage histograms, ExifTool exit codes, bytes and tag counts
+    ✅ Prometheus text format, per worker process
+    ✅ Bearer METRICS_TOKEN for scrapers, or a staff session
+    ✅ Never public: without a token only staff get in
+    """
+    # Bytes: compare_digest() refuses str with non-ASCII characters
+    token = request.headers.get("Authorization", "").encode()
+    scraper = bool(METRICS_TOKEN) and hmac.compare_digest(token, f"Bearer {METRICS_TOKEN}".encode())
+    if not scraper and not request.user.is_staff:
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -52,6 +52,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'files.metrics.ServerTimingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -167,6 +168,150 @@ LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
 
 
+# --------------------------------------------------
+# FILE UPLOADS
+# --------------------------------------------------
+# Same as Django's defaults, but SHA-256 is computed as chunks arrive.
+# UploadLimitHandler goes first so oversized bodies are cut off early;
+# HeaderOnlyUploadHandler keeps only the headers of large media (FAST_SCAN_UPLOAD_ENDPOINTS).
+FILE_UPLOAD_HANDLERS = [
+    'files.uploads.UploadLimitHandler',
+    'files.uploads.HeaderOnlyUploadHandler',
+    'files.uploads.HashingMemoryFileUploadHandler',
+    'files.uploads.HashingTemporaryFileUploadHandler',
+]
+
+# Max file bytes per request: endpoint URL name -> caller -> bytes (None = no limit).
+# Callers are 'guest', 'user' and 'staff'; '*' covers every other endpoint.
+UPLOAD_LIMITS = {
+    '*': {'guest': 10 * 1024 * 1024, 'user': 200 * 1024 * 1024, 'staff': None},
+    'user_analyze_batch': {'user': 1024 * 1024 * 1024},
+}
+
+# Files per batch (or per ZIP). Django's own multipart cap must allow as many.
+BATCH_ANALYZE_MAX_FILES = 500
+DATA_UPLOAD_MAX_NUMBER_FILES = BATCH_ANALYZE_MAX_FILES
+
+
+# --------------------------------------------------
+# EXIFTOOL
+# --------------------------------------------------
+EXIFTOOL_PATH = os.environ.get('EXIFTOOL_PATH', r'C:\exiftool\exiftool.exe')
+
+# Long-lived -stay_open workers (0 = spawn one process per call)
+EXIFTOOL_POOL_SIZE = int(os.environ.get('EXIFTOOL_POOL_SIZE', 2))
+EXIFTOOL_MAX_JOBS_PER_WORKER = 500
+EXIFTOOL_TIMEOUT = 60
+
+# Uploads up to this size go through ExifTool's stdin/stdout, larger ones are spooled to disk
+EXIFTOOL_PIPE_MAX_BYTES = 16 * 1024 * 1024
+
+# Max ExifTool processes the async (ASGI) views run at once, per event loop
+EXIFTOOL_ASYNC_CONCURRENCY = 8
+
+# Read plain JPEG/PNG/TIFF headers in Python; anything else still goes to ExifTool
+METADATA_FAST_PATH = True
+
+# Clean plain JPEGs by rewriting only their metadata segments (no ExifTool)
+JPEG_NATIVE_CLEAN = True
+
+# Large uploads: ExifTool reads only the header atoms/segments (-fast)
+FAST_SCAN_MIN_BYTES = EXIFTOOL_PIPE_MAX_BYTES
+FAST_SCAN_EXIFTOOL_OPTION = '-fast'
+# ...and on these endpoints the rest of the upload is never stored
+FAST_SCAN_UPLOAD_ENDPOINTS = ['guest_analyze', 'user_analyze', 'guest_analyze_async', 'user_analyze_async']
+
+
+# --------------------------------------------------
+# METRICS / SERVER-TIMING
+# --------------------------------------------------
+# Stage histograms at /api/files/metrics/ and a Server-Timing header on /api/ responses
+METRICS_ENABLED = True
+SERVER_TIMING_HEADER = True
+
+# /api/files/metrics/ takes 'Authorization: Bearer <METRICS_TOKEN>' or a staff session
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+
+# --------------------------------------------------
+# ANALYSIS RESULT CACHE
+# --------------------------------------------------
+# Use files.cache.SQLiteResultCache to share results between worker processes
+ANALYSIS_CACHE = {
+    'BACKEND': 'files.cache.LocMemResultCache',
+    'OPTIONS': {
+        'max_entries': 1024,
+        'ttl': 24 * 60 * 60,
+    },
+}
+
+
+# --------------------------------------------------
+# GUEST RATE LIMITS
+# --------------------------------------------------
+# Token buckets: `burst` uploads at once, refilled at `per_minute`.
+# "client" = IP + session cookie, "ip" = the IP alone (cookie cleared)
+GUEST_RATE_LIMITS = {
+    'client': {'burst': 5, 'per_minute': 1},
+    'ip': {'burst': 20, 'per_minute': 10},
+}
+# Use files.ratelimit.SQLiteRateLimitStore to share buckets between worker processes
+GUEST_RATE_LIMIT_STORE = {
+    'BACKEND': 'files.ratelimit.LocMemRateLimitStore',
+    'OPTIONS': {
+        'max_entries': 10000,
+    },
+}
+GUEST_RATE_LIMIT_TRUST_X_FORWARDED_FOR = False
+
+
+# --------------------------------------------------
+# ASYNC ANALYSIS JOBS
+# --------------------------------------------------
+# Set ANALYSIS_JOBS_IN_PROCESS = False when running `manage.py run_analysis_jobs`
+ANALYSIS_JOB_DIR = BASE_DIR / 'job_spool'
+ANALYSIS_JOBS_IN_PROCESS = True
+ANALYSIS_JOB_WORKERS = 2
+ANALYSIS_JOB_LEASE_SECONDS = 10 * 60
+# In-process mode: sweep for leftover jobs and expired results this often
+ANALYSIS_JOB_SWEEP_INTERVAL = 60
+
+
+# --------------------------------------------------
+# CLEANED FILE DELIVERY
+# --------------------------------------------------
+# Cleaned files are kept this long after last use, so retries and resumed
+# downloads (X-Download-URL, Range) don't clean the upload again
+CLEANED_ARTIFACT_DIR = BASE_DIR / 'cleaned_artifacts'
+CLEANED_ARTIFACT_TTL = 15 * 60
+# Only cleans this big, or asked for a link (?link=1), are kept; smaller ones
+# are streamed from memory/temp files and never written to CLEANED_ARTIFACT_DIR
+CLEANED_ARTIFACT_MIN_BYTES = 16 * 1024 * 1024
+# Behind nginx: 'x-accel-redirect', with an internal location aliased to
+# CLEANED_ARTIFACT_DIR at CLEANED_FILE_ACCEL_PREFIX. Apache: 'x-sendfile'.
+CLEANED_FILE_OFFLOAD = None
+CLEANED_FILE_ACCEL_PREFIX = '/protected/cleaned/'
+
+
+# --------------------------------------------------
+# RE-SCORING (manage.py rescore_analyses)
+# --------------------------------------------------
+RESCORE_CHUNK_SIZE = 500
+RESCORE_WORKERS = int(os.environ.get('RESCORE_WORKERS', os.cpu_count() or 1))
+RESCORE_STATE_FILE = BASE_DIR / 'rescore_state.json'
+
+
+# --------------------------------------------------
+# RETENTION (manage.py purge_analyses)
+# --------------------------------------------------
+# Defaults for users whose policy leaves retention empty (None = keep forever)
+RETENTION_DAYS = None
+RETENTION_MAX_FILES = None
+# Analyses deleted per transaction, and the pause between batches
+RETENTION_BATCH_SIZE = 200
+RETENTION_PAUSE_SECONDS = 0.05
+
+
 # --------------------------------------------------
 # DEFAULT PK
 # --------------------------------------------------
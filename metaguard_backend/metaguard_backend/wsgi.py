@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'metaguard_backend.settings')
 
 application = get_wsgi_application()
+
+# Pick up analysis jobs a previous process left behind (in-process mode)
+from files.jobs import start_in_process_worker  # noqa: E402
+
+start_in_process_worker()
@@ -95,37 +95,52 @@ export function Dashboard({
   useEffect(() => {
     const fetchUserData = async () => {
       try {
-        const response = await api.get("/api/files/user/history/");
-        const files = response.data.files;
-        
-        // Calculate stats from user's files
-        const filesAnalyzed = files.length;
-        const metadataRemoved = files.reduce((sum: number, file: any) => {
-          return sum + Object.keys(file.metadata_removed || {}).length;
-        }, 0);
-        const highRiskFiles = files.filter((file: any) => file.risk_level === "High").length;
-        
+        const toDate = (scannedAt: string) => new Date(scannedAt).toISOString().split('T')[0];
+
+        // Totals come from the per-user counters, the table from one small page
+        const [statsResponse, recentResponse] = await Promise.all([
+          api.get("/api/files/user/stats/"),
+          api.get("/api/files/user/history/", {
+            params: { limit: 5, fields: "id,file_name,file_type,risk_level,scanned_at,metadata_raw" },
+          }),
+        ]);
+        const filesAnalyzed = statsResponse.data.files_scanned;
+        const highRiskFiles = statsResponse.data.risk_levels.High;
+
         // Transform files for dashboard display
-        const recentFiles: FileRecord[] = files.map((file: any) => ({
+        const recentFiles: FileRecord[] = recentResponse.data.files.map((file: any) => ({
           id: file.id,
           name: file.file_name,
           type: file.file_type,
           risk: file.risk_level as RiskLevel,
           metadataCount: Object.keys(file.metadata_raw || {}).length,
-          date: new Date(file.scanned_at).toISOString().split('T')[0],
+          date: toDate(file.scanned_at),
         }));
-        
-        // Generate chart data from recent files
-        const chartData = [];
-        const dates = [...new Set(files.map((file: any) => new Date(file.scanned_at).toISOString().split('T')[0]))];
-        dates.sort().slice(-5).forEach(date => {
-          const dayFiles = files.filter((file: any) => new Date(file.scanned_at).toISOString().split('T')[0] === date);
-          const low = dayFiles.filter((file: any) => file.risk_level === "Low").length;
-          const medium = dayFiles.filter((file: any) => file.risk_level === "Medium").length;
-          const high = dayFiles.filter((file: any) => file.risk_level === "High").length;
-          chartData.push({ date, low, medium, high });
-        });
-        
+
+        // Removed fields and the chart need every file: walk the history
+        // page by page (newest first), loading only the columns they use
+        let metadataRemoved = 0;
+        const perDay = new Map<string, { low: number; medium: number; high: number }>();
+        let cursor: string | null = null;
+        do {
+          const page: any = await api.get("/api/files/user/history/", {
+            params: { limit: 200, fields: "scanned_at,risk_level,metadata_removed", ...(cursor ? { cursor } : {}) },
+          });
+          for (const file of page.data.files) {
+            metadataRemoved += Object.keys(file.metadata_removed || {}).length;
+            const date = toDate(file.scanned_at);
+            const day = perDay.get(date) || { low: 0, medium: 0, high: 0 };
+            if (file.risk_level === "Low") day.low += 1;
+            if (file.risk_level === "Medium") day.medium += 1;
+            if (file.risk_level === "High") day.high += 1;
+            perDay.set(date, day);
+          }
+          cursor = page.data.next_cursor;
+        } while (cursor);
+
+        // Chart data for the last 5 days with scans
+        const chartData = [...perDay.keys()].sort().slice(-5).map(date => ({ date, ...perDay.get(date)! }));
+
         setUserData({
           filesAnalyzed,
           metadataRemoved,